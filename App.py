@@ -2,6 +2,7 @@ from PyQt6 import QtWidgets, QtCore
 from PyQt6.QtNetwork import QLocalSocket, QLocalServer
 from contextlib import closing
 from MainWindow import MainWindow
+import multiprocessing
 import sys
 import logging
 import traceback
@@ -162,4 +163,6 @@ def main():
 
 
 if __name__ == '__main__':
+    # 打包后哈希进程池的子进程需要从这里进入
+    multiprocessing.freeze_support()
     main()
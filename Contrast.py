@@ -10,6 +10,7 @@ from PyQt6.QtCore import pyqtSignal, QRunnable, QObject, Qt, QThreadPool
 from PyQt6.QtGui import QPixmap, QImage
 
 from ContrastThread import HashWorker, ContrastWorker
+from hamming_index import PackedHashes
 from common import get_resource_path
 
 
@@ -63,7 +64,7 @@ class Contrast(QtWidgets.QWidget):
         self.parent = parent
         self.folder_page = folder_page
         self.groups = {}
-        self.image_hashes = {}
+        self.image_hashes = PackedHashes()
         self._running = False
         self.thread_pool = QThreadPool.globalInstance()
         self.thread_pool.setMaxThreadCount(4)
@@ -1,56 +1,18 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import numpy as np
-from PIL import Image
 from PyQt6 import QtCore
-import pillow_heif
 
-
-class ImageHasher:
-    @staticmethod
-    def dhash(image_path, hash_size=8):
-        try:
-            ext = image_path.lower().split('.')[-1]
-            if ext in ('heic', 'heif'):
-                heif_file = pillow_heif.read_heif(image_path)
-                img = Image.frombytes(
-                    heif_file.mode,
-                    heif_file.size,
-                    heif_file.data,
-                    "raw",
-                    heif_file.mode,
-                    heif_file.stride,
-                )
-            else:
-                with Image.open(image_path) as img:
-                    img.load()
-
-            w, h = img.size
-            if w < 50 or h < 50:
-                return None
-            if (w / h) < 0.2 or (w / h) > 5:
-                return None
-
-            image = img.convert('L').resize(
-                (hash_size + 1, hash_size),
-                Image.Resampling.BILINEAR
-            )
-
-            pixels = np.array(image, dtype=np.int16)
-            diff = pixels[:, 1:] > pixels[:, :-1]
-            return diff.flatten()
-
-        except Exception:
-            return None
-
-    @staticmethod
-    def hamming_distance(bits1, bits2):
-        return np.count_nonzero(bits1 != bits2)
+from RemoveDuplicationThread import HASH_ALGORITHMS, ImageHasher
+from clustering import LINKAGES, cluster_labels, labels_to_groups
+from config_manager import config_manager
+from hamming_index import MultiIndexHashing, PackedHashes, collapse_identical
+from hash_cache import hash_cache, file_signature
 
 
 class HashWorker(QtCore.QThread):
-    hash_completed = QtCore.pyqtSignal(dict)
+    hash_completed = QtCore.pyqtSignal(object)
     progress_updated = QtCore.pyqtSignal(int)
     error_occurred = QtCore.pyqtSignal(str)
+    log_signal = QtCore.pyqtSignal(str, str)
 
     def __init__(self, image_paths, hash_size=8, max_workers=4):
         super().__init__()
@@ -71,27 +33,42 @@ class HashWorker(QtCore.QThread):
                 path for path in self.image_paths
                 if path.lower().endswith(supported_extensions)
             ]
+
+            # 与 RemoveDuplicationThread 共用同一份哈希缓存
+            algo = ImageHasher.cache_algo(self.hash_size)
+            signatures = {p: sig for p in filtered_paths if (sig := file_signature(p)) is not None}
+            cached = hash_cache.get_many(signatures, algo)
+            records = {p: ImageHasher.from_record(blob) for p, blob in cached.items() if blob}
+            # 旧格式的记录按未命中处理，重新计算后覆盖
+            cached = {p: blob for p, blob in cached.items() if not blob or records[p] is not None}
+            hashes = {p: record[0] for p, record in records.items() if record is not None}
+            filtered_paths = [p for p in signatures if p not in cached]
+            self.log_signal.emit("INFO", f"哈希缓存命中 {len(cached)} 张，未命中 {len(filtered_paths)} 张")
             total = len(filtered_paths)
+            computed = []
 
             with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
                 future_to_path = {
-                    executor.submit(ImageHasher.dhash, path, self.hash_size): path
+                    executor.submit(ImageHasher.analyze, path, self.hash_size): path
                     for path in filtered_paths
                 }
 
                 for i, future in enumerate(as_completed(future_to_path)):
                     if not self._is_running:
+                        hash_cache.put_many(computed, algo)
                         return
 
                     path = future_to_path[future]
                     result = future.result()
                     if result is not None:
-                        hashes[path] = result
+                        hashes[path] = result[0]
+                    computed.append((path, *signatures[path], ImageHasher.to_record(*result) if result is not None else b''))
 
                     self.progress_updated.emit(int((i + 1) / total * 40))
 
+            hash_cache.put_many(computed, algo)
             if self._is_running:
-                self.hash_completed.emit(hashes)
+                self.hash_completed.emit(PackedHashes.from_variants(hashes, HASH_ALGORITHMS))
         except Exception as e:
             self.error_occurred.emit(str(e))
 
@@ -107,40 +84,33 @@ class ContrastWorker(QtCore.QThread):
     def __init__(self, image_hashes, threshold):
         super().__init__()
         self.image_hashes = image_hashes
-        self.threshold = threshold
+        # 与去重页相同的检索半径上限，图片对数不会随阈值失控
+        self.threshold = min(threshold, config_manager.get_setting("max_search_distance", 16))
+        # 与去重页共用聚类方式：single 相似关系可传递；complete 组内任意两张都要在阈值以内
+        self.linkage = config_manager.get_setting("cluster_linkage", "single")
+        if self.linkage not in LINKAGES:
+            self.linkage = "single"
         self._is_running = True
 
     def run(self):
         try:
             groups = {}
-            remaining_paths = set(self.image_hashes.keys())
-            group_id = 0
-            total = len(remaining_paths)
-            processed = 0
-
-            while remaining_paths and self._is_running:
-                seed_path = remaining_paths.pop()
-                groups[group_id] = [seed_path]
-                seed_hash = self.image_hashes[seed_path]
-
-                to_remove = []
-                for path in remaining_paths:
-                    if not self._is_running:
-                        return
-
-                    distance = ImageHasher.hamming_distance(seed_hash, self.image_hashes[path])
-                    if distance <= self.threshold:
-                        groups[group_id].append(path)
-                        to_remove.append(path)
-
-                    processed += 1
-                    progress = min(40 + int((processed / total) * 40), 80)
-                    self.progress_updated.emit(progress)
-
-                for path in to_remove:
-                    remaining_paths.remove(path)
-
-                group_id += 1
+            paths = self.image_hashes.paths
+            # 哈希完全相同的图片合并为一个节点，只在节点之间检索
+            nodes, node_of, _ = collapse_identical(self.image_hashes.codes)
+            pair_i, pair_j, distances = MultiIndexHashing(nodes).pairs_within(
+                self.threshold, should_stop=lambda: not self._is_running
+            )
+            # 聚类结果与遍历顺序无关；没有相似图片的也单独成组
+            labels = cluster_labels(len(nodes), pair_i, pair_j, distances, self.linkage)
+            clusters = labels_to_groups(labels[node_of], min_size=1)
+            total = len(clusters)
+            for group_id, members in enumerate(clusters):
+                if not self._is_running:
+                    break
+                groups[group_id] = [paths[i] for i in members]
+                if group_id % 1000 == 0 or group_id + 1 == total:
+                    self.progress_updated.emit(min(40 + int(((group_id + 1) / total) * 40), 80))
 
             if self._is_running:
                 self.groups_completed.emit(groups)
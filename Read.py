@@ -1,15 +1,82 @@
 import os
+from collections import OrderedDict, defaultdict
+
 from PyQt6 import QtWidgets, QtCore, QtGui
+from PyQt6.QtCore import pyqtSignal, QRunnable, QObject, Qt, QThreadPool
+from PyQt6.QtGui import QImage
+
 from ReadThread import ReadThread
 from common import get_resource_path
+from config_manager import config_manager
+from grid_thumbnails import load_grid_thumbnails
+from image_decode import load_qimage_reduced
+
+
+class ThumbnailLoaderSignals(QObject):
+    thumbnail_ready = pyqtSignal(str, QImage)
+
+
+class ThumbnailLoader(QRunnable):
+    """后台按格子尺寸解码缩略图，去重时已生成的网格缩略图直接取用；失败时发出空图，便于界面不再重试"""
+
+    def __init__(self, path, size, use_embedded=True):
+        super().__init__()
+        self.path = path
+        self.size = size
+        self.use_embedded = use_embedded
+        self.signals = ThumbnailLoaderSignals()
+        self._is_running = True
+
+    def run(self):
+        if not self._is_running:
+            return
+
+        try:
+            image = load_grid_thumbnails([self.path]).get(self.path)
+            if image is None:
+                image = load_qimage_reduced(self.path, self.size, self.use_embedded)
+        except Exception:
+            image = QImage()
+
+        if not image.isNull() and (image.width() > self.size.width() or image.height() > self.size.height()):
+            image = image.scaled(self.size, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+        if self._is_running:
+            self.signals.thumbnail_ready.emit(self.path, image)
+
+    def stop(self):
+        self._is_running = False
 
 
 class Read(QtWidgets.QWidget):
+    # 格子中图片区域的尺寸，缩略图按此尺寸解码
+    THUMBNAIL_SIZE = QtCore.QSize(110, 110)
+    # 可见区域上下各预先加载这么多屏，更远的格子释放图片，只保留在缓存中
+    PRELOAD_SCREENS = 1
+    # 滚动期间最多每隔这么久（毫秒）重新计算一次需要加载的格子，快速拖动时不会为途经的每一屏提交解码任务
+    REFRESH_DELAY_MS = 30
+
     def __init__(self, parent=None, folder_page=None):
         super().__init__(parent)
         self.parent = parent
         self.folder_page = folder_page
         self.thread = None
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(config_manager.get_setting("read_thumbnail_workers", 4))
+        self.use_embedded_thumbnails = config_manager.get_setting("thumbnail_use_embedded", True)
+        # 最近解码的缩略图（路径 → QImage），按最近使用淘汰；格子滚出后再滚回来时直接取用
+        self.thumbnail_cache = OrderedDict()
+        self.max_cache_size = config_manager.get_setting("read_thumbnail_cache_size", 2000)
+        self._loaders = {}
+        self._failed = set()
+        self._frames_by_path = defaultdict(list)
+        self._wanted = set()
+        self._shown = set()
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(self.REFRESH_DELAY_MS)
+        self._refresh_timer.timeout.connect(self._refresh_thumbnails)
+        self._scroll_area = None
         self.layout_config = {
             "gridLayout_5": {"counter": 0, "items": [], "layout": parent.gridLayout_5},
             "gridLayout_4": {"counter": 0, "items": [], "layout": parent.gridLayout_4},
@@ -23,6 +90,24 @@ class Read(QtWidgets.QWidget):
         self.parent.progressBar_Recognition.setValue(0)
         self.parent.progressBar_Recognition.hide()
 
+        self._scroll_area = self._find_scroll_area(self.parent.scrollAreaWidgetContents_image)
+        if self._scroll_area is not None:
+            self._scroll_area.verticalScrollBar().valueChanged.connect(self._schedule_refresh)
+            self._scroll_area.viewport().installEventFilter(self)
+        self.parent.scrollAreaWidgetContents_image.installEventFilter(self)
+
+    @staticmethod
+    def _find_scroll_area(widget):
+        while widget is not None and not isinstance(widget, QtWidgets.QScrollArea):
+            widget = widget.parentWidget()
+        return widget
+
+    def eventFilter(self, obj, event):
+        # 切换到本页、窗口大小变化或新格子布局完成时，可见的格子随之变化
+        if event.type() in (QtCore.QEvent.Type.Show, QtCore.QEvent.Type.Resize):
+            self._schedule_refresh()
+        return super().eventFilter(obj, event)
+
     def toggle_processing(self):
         if self.thread and self.thread.isRunning():
             self._stop_processing()
@@ -76,6 +161,8 @@ class Read(QtWidgets.QWidget):
 
         image_widget = self.create_image_widget(path)
         text_label = self.create_text_label(path)
+        item_frame.image_label = image_widget
+        item_frame.image_path = get_resource_path(path)
 
         vertical_layout.addWidget(image_widget, stretch=7)
         vertical_layout.addWidget(text_label, stretch=1)
@@ -98,16 +185,21 @@ class Read(QtWidgets.QWidget):
         """
 
     def create_image_widget(self, path):
-        image_widget = QtWidgets.QWidget()
+        # 图片由后台线程解码后再设置，样式表中不能引用原图，否则 Qt 每次重绘都在界面线程解码整幅原图
+        image_widget = QtWidgets.QLabel()
         image_widget.setSizePolicy(
             QtWidgets.QSizePolicy.Policy.Preferred,
             QtWidgets.QSizePolicy.Policy.Preferred
         )
+        image_widget.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         image_widget.setCursor(QtGui.QCursor(QtCore.Qt.CursorShape.PointingHandCursor))
-        image_widget.setStyleSheet(f"""
-            background-color: transparent;
-            image: url({get_resource_path(path)});
-            border-radius: 0px;
+        image_widget.setStyleSheet("""
+            QLabel {
+                background-color: transparent;
+                border: none;
+                border-radius: 0px;
+                padding: 0px;
+            }
         """)
         return image_widget
 
@@ -143,4 +235,108 @@ class Read(QtWidgets.QWidget):
         config["layout"].addWidget(item_frame, row, column)
         config["counter"] += 1
         config["items"].append(item_frame)
+        self._frames_by_path[item_frame.image_path].append(item_frame)
         self.parent.update_empty_status(layout, has_content=True)
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if not self._refresh_timer.isActive():
+            self._refresh_timer.start()
+
+    def _view_range(self, screens=0):
+        """可见区域再向上下各扩展 screens 屏（内容控件坐标）；本页不可见时为 None"""
+        if self._scroll_area is None:
+            return -float('inf'), float('inf')
+        viewport = self._scroll_area.viewport()
+        if not viewport.isVisible():
+            return None
+        top = self._scroll_area.verticalScrollBar().value()
+        margin = viewport.height() * screens
+        return top - margin, top + viewport.height() + margin
+
+    def _frames_in_range(self, config, top, bottom):
+        """按行二分查找落在 [top, bottom] 内的格子，每次刷新的开销与格子总数无关"""
+        items = config["items"]
+        container = config["layout"].parentWidget()
+        if not items or container is None or not container.isVisible():
+            return []
+        contents = self.parent.scrollAreaWidgetContents_image
+        offset = container.mapTo(contents, QtCore.QPoint(0, 0)).y() if container is not contents else 0
+        # 刚添加、还没经过布局的格子都在末尾且位置为 (0, 0)，暂不参与查找，布局完成后内容控件尺寸变化会再次刷新
+        low, high = 1, (len(items) + 3) // 4
+        while low < high:
+            middle = (low + high) // 2
+            if items[middle * 4].y() > 0:
+                low = middle + 1
+            else:
+                high = middle
+        rows = low
+
+        low, high = 0, rows
+        while low < high:
+            middle = (low + high) // 2
+            frame = items[middle * 4]
+            if offset + frame.y() + frame.height() < top:
+                low = middle + 1
+            else:
+                high = middle
+        first = low
+        high = rows
+        while low < high:
+            middle = (low + high) // 2
+            if offset + items[middle * 4].y() <= bottom:
+                low = middle + 1
+            else:
+                high = middle
+        return items[first * 4:low * 4]
+
+    def _refresh_thumbnails(self):
+        view = self._view_range(self.PRELOAD_SCREENS)
+        if view is None:
+            return
+        wanted, visible = [], set()
+        for config in self.layout_config.values():
+            wanted.extend(self._frames_in_range(config, *view))
+            visible.update(self._frames_in_range(config, *self._view_range()))
+        self._wanted = set(wanted)
+
+        # 远离可见区域的格子释放图片，界面持有的图片数量不随文件夹大小增长
+        for frame in self._shown - self._wanted:
+            frame.image_label.clear()
+        self._shown &= self._wanted
+        wanted_paths = {frame.image_path for frame in wanted}
+        for path in [path for path in self._loaders if path not in wanted_paths]:
+            # 线程池在任务结束后会释放它，这里只做标记：尚未开始的任务轮到时直接返回
+            self._loaders.pop(path).stop()
+
+        for frame in wanted:
+            if frame in self._shown:
+                continue
+            path = frame.image_path
+            image = self.thumbnail_cache.get(path)
+            if image is not None:
+                self.thumbnail_cache.move_to_end(path)
+                self._show_thumbnail(frame, image)
+            elif path not in self._loaders and path not in self._failed:
+                loader = ThumbnailLoader(path, self.THUMBNAIL_SIZE, self.use_embedded_thumbnails)
+                loader.signals.thumbnail_ready.connect(self.on_thumbnail_ready)
+                self._loaders[path] = loader
+                # 可见的格子优先解码，预加载的排在后面
+                self.thread_pool.start(loader, 1 if frame in visible else 0)
+
+    def on_thumbnail_ready(self, path, image):
+        if self._loaders.pop(path, None) is None:
+            return  # 已滚出预加载范围
+        if image.isNull():
+            self._failed.add(path)
+            return
+        self.thumbnail_cache[path] = image
+        while len(self.thumbnail_cache) > self.max_cache_size:
+            self.thumbnail_cache.popitem(last=False)
+        for frame in self._frames_by_path.get(path, ()):
+            if frame in self._wanted and frame not in self._shown:
+                self._show_thumbnail(frame, image)
+
+    def _show_thumbnail(self, frame, image):
+        frame.image_label.setPixmap(QtGui.QPixmap.fromImage(image))
+        self._shown.add(frame)
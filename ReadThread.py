@@ -2,11 +2,11 @@ import os
 import re
 from pathlib import Path
 import numpy as np
-from PIL import Image
 from PyQt6 import QtCore, QtWidgets
 from skimage import feature
 
 from common import detect_media_type
+from image_decode import open_image_reduced
 
 
 class ReadThread(QtCore.QThread):
@@ -14,6 +14,9 @@ class ReadThread(QtCore.QThread):
     finished = QtCore.pyqtSignal()
     progress_updated = QtCore.pyqtSignal(int)
 
+    # 截图检测时解码的大致边长
+    DETECT_SIZE = 800
+
     def __init__(self, folders=None):
         super().__init__()
         self.folders = folders or []
@@ -104,8 +107,8 @@ class ReadThread(QtCore.QThread):
         for pattern in self.screenshot_patterns:
             if re.search(pattern, filename):
                 return True
-        img = Image.open(image_path)
-        width, height = img.size
+        # LBP 纹理统计只需要中等分辨率，按检测尺寸解码即可
+        gray_img, (width, height) = open_image_reduced(image_path, self.DETECT_SIZE, 'L')
         size_match = any(abs(w - width) <= 10 and abs(h - height) <= 10 for w, h in self.common_screen_sizes)
 
         def check_lbp(gray_np):
@@ -116,7 +119,6 @@ class ReadThread(QtCore.QThread):
             threshold = 0.45 if size_match else 0.55
             return np.any(hist > threshold)
 
-        gray_img = img.convert('L')
         gray_np = np.array(gray_img, dtype=np.uint8)
         return check_lbp(gray_np)
 
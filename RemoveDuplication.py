@@ -1,14 +1,36 @@
 import os
 import shutil
+import logging
+import time
 
-import pillow_heif
 import send2trash
-from PIL import Image
 from PyQt6 import QtWidgets, QtCore, QtGui
 from PyQt6.QtCore import pyqtSignal, QRunnable, QObject, Qt, QThreadPool
 from PyQt6.QtGui import QPixmap, QImage
 
-from RemoveDuplicationThread import HashWorker, ContrastWorker
+from RemoveDuplicationThread import (HASH_ALGORITHMS, HashWorker, ContrastWorker, LibraryMatchWorker,
+                                     SimilarSearchWorker, load_cached_qualities)
+from hamming_index import PackedHashes
+from hash_cache import hash_cache
+from config_manager import config_manager
+from embedded_thumbnail import open_embedded_thumbnail
+from grid_thumbnails import load_grid_thumbnails
+from image_decode import load_qimage_reduced, pil_to_qimage
+from image_quality import quality_rank
+from raw_preview import RAW_EXTENSIONS
+from video_fingerprint import VIDEO_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff',
+                 '.heif', '.heic', *RAW_EXTENSIONS}
+
+HASH_ALGORITHM_NAMES = {
+    'dhash': '差值哈希 dHash',
+    'ahash': '均值哈希 aHash',
+    'phash': '感知哈希 pHash',
+    'whash': '小波哈希 wHash',
+}
 
 
 class ThumbnailLoaderSignals(QObject):
@@ -16,21 +38,12 @@ class ThumbnailLoaderSignals(QObject):
     progress_updated = pyqtSignal(int)
 
 
-def load_heic_as_qimage(path):
-    heif_file = pillow_heif.read_heif(path)
-    image = Image.frombytes(heif_file.mode, heif_file.size, heif_file.data, "raw")
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    buffer = image.tobytes()
-    qimage = QImage(buffer, image.width, image.height, QImage.Format.Format_RGB888)
-    return qimage.copy()
-
-
 class ThumbnailLoader(QRunnable):
-    def __init__(self, path, size, total_images):
+    def __init__(self, path, size, total_images, use_embedded=True):
         super().__init__()
         self.path = path
         self.size = size
+        self.use_embedded = use_embedded
         self.total_images = total_images
         self.signals = ThumbnailLoaderSignals()
         self._is_running = True
@@ -39,24 +52,21 @@ class ThumbnailLoader(QRunnable):
         if not self._is_running:
             return
 
-        image = QImage()
-        if self.path.lower().endswith(('.heic', '.heif')):
-            try:
-                image = load_heic_as_qimage(self.path)
-            except Exception:
-                pass
-        else:
-            image.load(self.path)
+        try:
+            image = load_qimage_reduced(self.path, self.size, self.use_embedded)
+        except Exception:
+            image = QImage()
 
         if not image.isNull() and self._is_running:
             scaled_image = image.scaled(self.size.width(), self.size.height(),
                                         Qt.AspectRatioMode.KeepAspectRatio,
                                         Qt.TransformationMode.SmoothTransformation)
             self.signals.thumbnail_ready.emit(self.path, scaled_image)
-            progress = 80 + int((1 / self.total_images) * 20)
-            self.signals.progress_updated.emit(progress)
+            if self.total_images:
+                progress = 80 + int((1 / self.total_images) * 20)
+                self.signals.progress_updated.emit(progress)
 
-        if self._is_running:
+        if self._is_running and self.total_images:
             self.signals.progress_updated.emit(100)
 
         if not image.isNull():
@@ -67,13 +77,20 @@ class ThumbnailLoader(QRunnable):
 
 
 class Contrast(QtWidgets.QWidget):
+    # 预览占位图只要求内嵌缩略图覆盖该尺寸
+    PLACEHOLDER_BOX = (160, 160)
+    # 每轮事件循环最多创建的分组数
+    RENDER_BATCH = 50
+
     def __init__(self, parent=None, folder_page=None):
         super().__init__(parent)
         self.parent = parent
         self.folder_page = folder_page
         self.groups = {}
-        self.image_hashes = {}
+        self.image_hashes = PackedHashes()
         self._running = False
+        # 为 True 时结果来自滑块触发的内存重新分组，没有分组时不弹出提示框
+        self._silent_results = False
         self.thread_pool = QThreadPool.globalInstance()
         self.thread_pool.setMaxThreadCount(4)
         self.selected_images = []
@@ -83,14 +100,50 @@ class Contrast(QtWidgets.QWidget):
         self.thumbnail_loaders = []
         self.max_cache_size = 200
         self.current_progress = 0
+        self._preview_paths = ()
+        self.similarity_graph = None
+        self._group_widgets = {}
+        self._pending_groups = []
+        self._results_row = 0
+        self._total_images = 0
+        # 拖动滑块时只在停下后重新分组一次
+        self._regroup_timer = QtCore.QTimer(self)
+        self._regroup_timer.setSingleShot(True)
+        self._regroup_timer.setInterval(200)
+        self._regroup_timer.timeout.connect(self.regroup_from_memory)
+        self.use_embedded_thumbnails = config_manager.get_setting("thumbnail_use_embedded", True)
 
     def init_page(self):
         self.parent.horizontalSlider_levelContrast.setRange(0, 100)
         self.parent.horizontalSlider_levelContrast.setValue(100)
         self.parent.verticalFrame_similar.hide()
+        # 四种哈希在同一次解码中全部算好，切换算法只需重新检索，不必重新计算哈希
+        slider_box = self.parent.horizontalSlider_levelContrast.parentWidget()
+        self.algorithm_combo = QtWidgets.QComboBox(slider_box)
+        for algorithm in HASH_ALGORITHMS:
+            self.algorithm_combo.addItem(HASH_ALGORITHM_NAMES[algorithm], algorithm)
+        index = self.algorithm_combo.findData(config_manager.get_setting("hash_algorithm", "dhash"))
+        self.algorithm_combo.setCurrentIndex(max(index, 0))
+        # 增量对比：只处理新导入的文件夹，与已建立索引的图库比对
+        self.incremental_button = QtWidgets.QToolButton(slider_box)
+        self.incremental_button.setText("增量对比")
+        self.incremental_button.setToolTip("只计算新文件夹的哈希，查找图库中已存在的相似图片")
+        self.similar_search_button = QtWidgets.QToolButton(slider_box)
+        self.similar_search_button.setText("以图搜图")
+        self.similar_search_button.setToolTip("选择一张图片，在已建立索引的图库中查找最相似的图片")
+        if slider_box.layout() is not None:
+            slider_box.layout().addWidget(self.algorithm_combo)
+            slider_box.layout().addWidget(self.incremental_button)
+            slider_box.layout().addWidget(self.similar_search_button)
+
+    def log(self, level, message):
+        logger.log(logging.getLevelName(level), message)
 
     def get_similarity_threshold(self, val):
-        return int(64 * (100 - val) / 100)
+        # 距离超过 max_search_distance 的哈希已与随机图片无异，而检索出的图片对数随半径急剧增长，
+        # 滑块再往低调也不再放宽检索半径
+        max_distance = config_manager.get_setting("max_search_distance", 16)
+        return min(int(64 * (100 - val) / 100), max_distance)
 
     def on_slider_value_changed(self, val):
         if val == 100:
@@ -106,9 +159,55 @@ class Contrast(QtWidgets.QWidget):
 
         self.parent.label_levelContrast.setText(f"{text} ({val}%)")
         self.parent.label_levelContrast.setStyleSheet(f"QLabel{{color:{color};}}")
+        if self.has_hashes() and not self.workers_busy():
+            self._regroup_timer.start()
+
+    def has_hashes(self):
+        return bool(len(self.image_hashes) or self.image_hashes.videos)
+
+    def current_algorithm(self):
+        return self.algorithm_combo.currentData() or "dhash"
+
+    def on_algorithm_changed(self, _index):
+        config_manager.update_setting("hash_algorithm", self.current_algorithm())
+        # 相似图与哈希算法绑定，换算法后作废，用内存中的另一种哈希重新检索
+        self.similarity_graph = None
+        if self.has_hashes() and not self.workers_busy():
+            self._regroup_timer.start()
+
+    def workers_busy(self):
+        return any(
+            hasattr(self, name) and getattr(self, name).isRunning()
+            for name in ('hash_worker', 'contrast_worker', 'library_worker', 'search_worker')
+        )
+
+    def regroup_from_memory(self):
+        """相似度变化后用内存中的哈希和相似图重新分组，不再读取任何图片"""
+        if not self.has_hashes() or self.workers_busy():
+            return
+        threshold = self.get_similarity_threshold(self.parent.horizontalSlider_levelContrast.value())
+        # 拖动滑块时没有分组只清空结果，不弹出提示框
+        self._silent_results = True
+        if self.similarity_graph is None or not self.similarity_graph.covers(threshold):
+            # 超出相似图范围时只需按新阈值扩展检索，哈希仍在内存中，已复核的图片对沿用原相似图
+            self._running = True
+            self.reset_progress()
+            self.parent.startContrastToolButton.setText("停止对比")
+            self.parent.startContrastToolButton.clicked.disconnect()
+            self.parent.startContrastToolButton.clicked.connect(self.stop_processing)
+            self.start_contrast_worker(threshold, self.similarity_graph)
+            return
+        start_time = time.perf_counter()
+        groups = self.similarity_graph.groups(threshold)
+        self.log("DEBUG", f"按阈值 {threshold} 重新分组完成，耗时 {time.perf_counter() - start_time:.3f} 秒")
+        self._running = True
+        self.on_groups_computed(groups)
 
     def connect_signals(self):
         self.parent.horizontalSlider_levelContrast.valueChanged.connect(self.on_slider_value_changed)
+        self.algorithm_combo.currentIndexChanged.connect(self.on_algorithm_changed)
+        self.incremental_button.clicked.connect(self.start_incremental_contrast)
+        self.similar_search_button.clicked.connect(self.start_similar_search)
         self.parent.startContrastToolButton.clicked.connect(self.startContrast)
         self.parent.moveToolButton.clicked.connect(self.move_selected_images)
         self.parent.autoSelectToolButton.clicked.connect(self.auto_select_images)
@@ -118,9 +217,11 @@ class Contrast(QtWidgets.QWidget):
         dest_folder = QtWidgets.QFileDialog.getExistingDirectory(self, "选择目标文件夹")
         if not dest_folder:
             return
+        moved = []
         for img in self.selected_images:
             try:
                 shutil.move(img, os.path.join(dest_folder, os.path.basename(img)))
+                moved.append(img)
             except Exception as e:
                 QtWidgets.QMessageBox.warning(self, "无法移动图片",
                                               f"无法移动图片 {os.path.basename(img)}: {e}\n\n"
@@ -128,14 +229,19 @@ class Contrast(QtWidgets.QWidget):
                                               "• 目标文件夹权限不足\n"
                                               "• 文件正在被其他程序使用\n"
                                               "• 磁盘空间不足")
+        if moved:
+            # 原路径的缓存记录已失效，新位置下次扫描时重新计算
+            hash_cache.remove_paths(moved)
         self.display_all_images()
 
     def auto_select_images(self):
         self.selected_images.clear()
+        # 质量指标在计算哈希时已存入缓存，这里只查询缓存，不再解码图片
+        qualities = load_cached_qualities([p for paths in self.groups.values() if len(paths) > 1 for p in paths])
         for group_id, paths in self.groups.items():
             if len(paths) <= 1:
                 continue
-            best = max(paths, key=lambda x: os.path.getsize(x))
+            best = max(paths, key=lambda p: quality_rank(p, qualities.get(p)))
             self.selected_images.extend([p for p in paths if p != best])
         self.refresh_selection_visuals()
 
@@ -156,11 +262,13 @@ class Contrast(QtWidgets.QWidget):
 
         success_count = 0
         failed_count = 0
+        deleted = []
 
         for img in self.selected_images:
             try:
                 send2trash.send2trash(img)
                 success_count += 1
+                deleted.append(img)
             except Exception as e:
                 failed_count += 1
                 QtWidgets.QMessageBox.warning(self, "删除失败",
@@ -170,6 +278,8 @@ class Contrast(QtWidgets.QWidget):
                                               "• 回收站功能异常\n"
                                               "• 权限不足")
 
+        if deleted:
+            hash_cache.remove_paths(deleted)
         if success_count > 0:
             QtWidgets.QMessageBox.information(self, "操作完成",
                                               f"成功删除 {success_count} 张图片到回收站{f'，{failed_count} 张删除失败' if failed_count > 0 else ''}\n\n"
@@ -179,15 +289,29 @@ class Contrast(QtWidgets.QWidget):
         self.display_all_images()
 
     def refresh_selection_visuals(self):
-        layout = self.parent.layout_contrast_images
-        for i in reversed(range(layout.count())):
-            widget = layout.itemAt(i).widget()
-            if isinstance(widget, QtWidgets.QLabel):
+        for box in self._group_widgets.values():
+            for widget in box.findChildren(QtWidgets.QLabel):
                 path = widget.property("image_path")
+                if path is None:
+                    continue
                 widget.setProperty("selected", path in self.selected_images)
                 widget.style().unpolish(widget)
                 widget.style().polish(widget)
 
+    @staticmethod
+    def collect_paths(folders, formats):
+        paths = []
+        for folder_info in folders:
+            folder_path = folder_info['path']
+            if folder_info['include_sub'] == 1:
+                for root, _, files in os.walk(folder_path):
+                    paths.extend(os.path.join(root, f) for f in files
+                                 if os.path.splitext(f)[1].lower() in formats)
+            else:
+                paths.extend(os.path.join(folder_path, f) for f in os.listdir(folder_path)
+                             if os.path.splitext(f)[1].lower() in formats)
+        return paths
+
     def startContrast(self):
         folders = self.folder_page.get_all_folders() if self.folder_page else []
         if not folders:
@@ -197,25 +321,14 @@ class Contrast(QtWidgets.QWidget):
             return
 
         self._running = True
-        self.parent.progressBar_Contrast.setValue(0)
-        supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff',
-                             '.heif', '.heic', '.arw', '.cr2', '.cr3', '.nef', '.orf', '.sr2',
-                             '.raf', '.dng', '.rw2', '.pef', '.nrw', '.kdc'}
-        image_paths = []
-        for folder_info in folders:
-            folder_path = folder_info['path']
-            if folder_info['include_sub'] == 1:
-                for root, _, files in os.walk(folder_path):
-                    image_paths.extend(os.path.join(root, f) for f in files
-                                       if os.path.splitext(f)[1].lower() in supported_formats)
-            else:
-                image_paths.extend(os.path.join(folder_path, f) for f in os.listdir(folder_path)
-                                   if os.path.splitext(f)[1].lower() in supported_formats)
+        self._silent_results = False
+        self.reset_progress()
+        image_paths = self.collect_paths(folders, IMAGE_FORMATS | set(VIDEO_EXTENSIONS))
 
         if not image_paths:
             QtWidgets.QMessageBox.information(self, "提示",
                                               "在所选文件夹中未找到支持的图片文件\n\n"
-                                              "支持的格式：.jpg/.jpeg/.png/.bmp/.gif/.webp/.tif/.tiff/.heif/.heic\n"
+                                              "支持的格式：.jpg/.jpeg/.png/.bmp/.gif/.webp/.tif/.tiff/.heif/.heic、RAW 及常见视频格式\n"
                                               "请检查文件夹路径和文件格式")
             self._running = False
             self.parent.toolButton_startContrast.setEnabled(True)
@@ -246,14 +359,108 @@ class Contrast(QtWidgets.QWidget):
             'current_stage': 'hashing'
         }
 
-        self.hash_worker = HashWorker(image_paths)
+        self.exact_groups = []
+        self.image_hashes = PackedHashes()
+        self.similarity_graph = None
+        self.groups = {}
+        self._total_images = 0
+        self.reset_results_view()
+        self.hash_worker = HashWorker(image_paths, algorithm=self.current_algorithm(),
+                                      scan_roots=[folder['path'] for folder in folders])
+        self.hash_worker.exact_groups_found.connect(self.on_exact_groups_found)
+        self.hash_worker.groups_streamed.connect(self.on_groups_streamed)
         self.hash_worker.hash_completed.connect(self.on_hashes_computed)
         self.hash_worker.progress_updated.connect(self.update_progress)
         self.hash_worker.error_occurred.connect(self.on_hash_error)
+        self.hash_worker.log_signal.connect(self.log)
+        self.hash_worker.start()
+
+    def start_incremental_contrast(self):
+        """增量对比：只计算新导入文件夹的哈希，再查询由哈希缓存构建的图库索引，图库不重新扫描"""
+        if self.workers_busy():
+            return
+        folders = self.folder_page.get_all_folders() if self.folder_page else []
+        start_dir = folders[-1]['path'] if folders else ""
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, "选择新导入的文件夹", start_dir)
+        if not folder:
+            return
+        image_paths = self.collect_paths([{'path': folder, 'include_sub': 1}], IMAGE_FORMATS)
+        if not image_paths:
+            QtWidgets.QMessageBox.information(self, "提示", "在所选文件夹中未找到支持的图片文件")
+            return
+
+        self._running = True
+        self._silent_results = False
+        self.incremental_folder = folder
+        self.exact_groups = []
+        self.image_hashes = PackedHashes()
+        self.similarity_graph = None
+        self.reset_progress()
+        self.parent.verticalFrame_similar.show()
+        self.parent.startContrastToolButton.setText("停止对比")
+        self.parent.startContrastToolButton.clicked.disconnect()
+        self.parent.startContrastToolButton.clicked.connect(self.stop_processing)
+
+        self.hash_worker = HashWorker(image_paths, algorithm=self.current_algorithm(), exact_prepass=False,
+                                      scan_roots=[folder])
+        self.hash_worker.hash_completed.connect(self.on_incremental_hashes_computed)
+        self.hash_worker.progress_updated.connect(self.update_progress)
+        self.hash_worker.error_occurred.connect(self.on_hash_error)
+        self.hash_worker.log_signal.connect(self.log)
         self.hash_worker.start()
 
+    def on_incremental_hashes_computed(self, hashes):
+        if not len(hashes):
+            self.on_groups_computed([])
+            return
+        threshold = self.get_similarity_threshold(self.parent.horizontalSlider_levelContrast.value())
+        self.library_worker = LibraryMatchWorker(hashes.with_algorithm(self.current_algorithm()), threshold,
+                                                 exclude_folder=self.incremental_folder)
+        self.library_worker.result_signal.connect(self.on_groups_computed)
+        self.library_worker.progress_signal.connect(self.update_progress)
+        self.library_worker.log_signal.connect(self.log)
+        self.library_worker.start()
+
+    def start_similar_search(self):
+        if self.workers_busy():
+            return
+        formats = " ".join(f"*{ext}" for ext in sorted(IMAGE_FORMATS))
+        image_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "选择要查找的图片", "", f"图片 ({formats})")
+        if not image_path:
+            return
+        k = config_manager.get_setting("similar_search_k", 20)
+        # 首次查询要加载图库索引，期间按钮切换为停止状态，可以取消
+        self.parent.startContrastToolButton.setText("停止对比")
+        self.parent.startContrastToolButton.clicked.disconnect()
+        self.parent.startContrastToolButton.clicked.connect(self.stop_processing)
+        self.search_worker = SimilarSearchWorker(image_path, k, self.current_algorithm())
+        self.search_worker.result_signal.connect(self.on_similar_search_done)
+        self.search_worker.log_signal.connect(self.log)
+        self.search_worker.start()
+
+    def on_similar_search_done(self, image_path, results):
+        if not self.search_worker.is_running():
+            return  # 结果在停止之前已发出，丢弃
+        for path, distance in results:
+            self.log("DEBUG", f"相似图片 {path}，汉明距离 {distance}")
+        self._running = True
+        self._silent_results = False
+        self.exact_groups = []
+        self.image_hashes = PackedHashes()
+        self.similarity_graph = None
+        self.parent.verticalFrame_similar.show()
+        # 查询图片排在第一位，其后按距离从近到远
+        self.on_groups_computed([[image_path] + [path for path, _ in results]] if results else [])
+
+    def on_exact_groups_found(self, groups):
+        self.exact_groups = groups
+
     def on_hashes_computed(self, hashes):
-        if not hashes:
+        self.image_hashes = hashes
+        if not self.has_hashes() and self.exact_groups:
+            self.on_groups_computed([])
+            return
+        if not self.has_hashes():
             QtWidgets.QMessageBox.information(self, "提示",
                                               "未成功计算任何图片的哈希值\n\n"
                                               "可能的原因：\n"
@@ -267,25 +474,43 @@ class Contrast(QtWidgets.QWidget):
             self.parent.startContrastToolButton.clicked.connect(self.startContrast)
             return
 
-        self.image_hashes = hashes
-
         self.processing_state.update({
             'current_stage': 'contrasting',
             'hashed_images': len(hashes)
         })
 
         similarity_percent = self.parent.horizontalSlider_levelContrast.value()
-        threshold = self.get_similarity_threshold(similarity_percent)
+        self.start_contrast_worker(self.get_similarity_threshold(similarity_percent))
 
-        self.contrast_worker = ContrastWorker(self.image_hashes, threshold)
+    def start_contrast_worker(self, threshold, previous_graph=None):
+        hashes = self.image_hashes.with_algorithm(self.current_algorithm())
+        self.contrast_worker = ContrastWorker(hashes, threshold, previous_graph)
+        self.contrast_worker.graph_signal.connect(self.on_graph_ready)
         self.contrast_worker.result_signal.connect(self.on_groups_computed)
         self.contrast_worker.progress_signal.connect(self.update_progress)
+        self.contrast_worker.log_signal.connect(self.log)
         self.contrast_worker.start()
 
+    def on_graph_ready(self, graph):
+        self.similarity_graph = graph
+
     def on_groups_computed(self, groups):
+        groups = self.merge_exact_groups(groups)
         self.groups = {f"group_{i}": group for i, group in enumerate(groups)}
+        grouped = {path for group in groups for path in group}
+        self.selected_images = [path for path in self.selected_images if path in grouped]
         self.display_all_images()
 
+    def merge_exact_groups(self, groups):
+        """相似组里的代表图片展开为它的全部副本，没有相似图片的完全重复组单独成组"""
+        copies = {group[0]: group for group in self.exact_groups}
+        merged, represented = [], set()
+        for group in groups:
+            merged.append([path for representative in group for path in copies.get(representative, [representative])])
+            represented.update(group)
+        merged.extend(group for group in self.exact_groups if group[0] not in represented)
+        return merged
+
     def on_hash_error(self, error_msg):
         QtWidgets.QMessageBox.warning(self, "计算错误",
                                       f"图片哈希计算过程中发生错误：{error_msg}\n\n"
@@ -308,6 +533,14 @@ class Contrast(QtWidgets.QWidget):
             self.contrast_worker.stop()
             self.contrast_worker.wait()
 
+        if hasattr(self, 'library_worker') and self.library_worker.isRunning():
+            self.library_worker.stop()
+            self.library_worker.wait()
+
+        if hasattr(self, 'search_worker') and self.search_worker.isRunning():
+            self.search_worker.stop()
+            self.search_worker.wait()
+
         for loader in self.thumbnail_loaders:
             if hasattr(loader, 'stop'):
                 loader.stop()
@@ -322,39 +555,41 @@ class Contrast(QtWidgets.QWidget):
                                           "图片处理任务已被用户中断\n\n"
                                           "已保存当前处理进度，您可以稍后继续处理。")
 
-    def display_all_images(self):
+    def reset_results_view(self):
         layout = self.parent.layout_contrast_images
         self.clear_layout(layout)
         layout.setAlignment(QtCore.Qt.AlignmentFlag.AlignTop)
-        duplicate_groups = {k: v for k, v in self.groups.items() if len(v) > 1}
-        total_images = sum(len(v) for v in duplicate_groups.values())
-        no_images = True
-        row = col = 0
-
         self.thumbnail_loaders.clear()
+        self._group_widgets = {}
+        self._pending_groups = []
+        self._results_row = 0
 
-        for idx, (gid, paths) in enumerate(duplicate_groups.items(), 1):
-            if not paths or not self._running:
-                continue
-            no_images = False
-            title = QtWidgets.QLabel(f"📁 第{idx}组 ({len(paths)}张)")
-            title.setStyleSheet("QLabel{font:bold 14px;color:#1976D2;padding:2px 0;}")
-            layout.addWidget(title, row, 0, 1, 4)
-            row += 1
-            for path in paths:
-                if col >= 2:
-                    col = 0
-                    row += 1
-                thumb = self.create_thumbnail(path, total_images)
-                if thumb:
-                    layout.addWidget(thumb, row, col)
-                    col += 1
-            if paths and self._running:
-                self.add_separator(layout, row + 1)
-                row += 2
-                col = 0
+    def display_all_images(self):
+        """清空后重新显示全部分组；分批创建控件，大量分组时界面也能立即响应"""
+        self.reset_results_view()
+        self._pending_groups = [(gid, paths) for gid, paths in self.groups.items() if len(paths) > 1]
+        self._total_images = sum(len(paths) for _, paths in self._pending_groups)
+        if not self._pending_groups or not self._running:
+            self._finish_display(no_images=True)
+            return
+        self._render_pending_groups()
+
+    def _render_pending_groups(self):
+        batch = self._pending_groups[:self.RENDER_BATCH]
+        del self._pending_groups[:self.RENDER_BATCH]
+        for gid, paths in batch:
+            if not self._running:
+                return
+            self.show_group(gid, paths)
+        if self._pending_groups:
+            QtCore.QTimer.singleShot(0, self._render_pending_groups)
+        else:
+            self._finish_display(no_images=False)
+
+    def _finish_display(self, no_images):
         if no_images:
             self.update_progress(100)
+        if no_images and not self._silent_results:
             self.parent.verticalFrame_similar.hide()
             QtWidgets.QMessageBox.information(self, "检测完成",
                                               "未发现重复或相似的图片\n\n"
@@ -364,7 +599,58 @@ class Contrast(QtWidgets.QWidget):
         self.parent.startContrastToolButton.clicked.disconnect()
         self.parent.startContrastToolButton.clicked.connect(self.startContrast)
 
-    def create_thumbnail(self, path, total_images):
+    def show_group(self, gid, paths):
+        """显示一个分组；该组已显示时只补上新增的图片，组标题随之更新"""
+        box = self._group_widgets.get(gid)
+        if box is None:
+            box = QtWidgets.QWidget()
+            box_layout = QtWidgets.QVBoxLayout(box)
+            box_layout.setContentsMargins(0, 0, 0, 0)
+            box.title = QtWidgets.QLabel()
+            box.title.setStyleSheet("QLabel{font:bold 14px;color:#1976D2;padding:2px 0;}")
+            box_layout.addWidget(box.title)
+            box.grid = QtWidgets.QGridLayout()
+            box_layout.addLayout(box.grid)
+            sep = QtWidgets.QFrame()
+            sep.setFrameShape(QtWidgets.QFrame.Shape.HLine)
+            sep.setStyleSheet("border:1px dashed #BDBDBD;")
+            box_layout.addWidget(sep)
+            box.paths = []
+            box.index = len(self._group_widgets) + 1
+            self._group_widgets[gid] = box
+            self.parent.layout_contrast_images.addWidget(box, self._results_row, 0, 1, 4)
+            self._results_row += 1
+        new_paths = [path for path in paths if path not in box.paths and path not in self.thumbnail_cache]
+        # 哈希计算时已顺带生成的缩略图直接从缓存取用，只有缓存中没有的才交给后台线程解码原图
+        stored = load_grid_thumbnails(new_paths) if new_paths else {}
+        for path in paths:
+            if path in box.paths:
+                continue
+            # 边算边显示的分组出现时总数尚未确定（为 0），这些缩略图不汇报进度，以免进度条提前到 100%
+            thumb = self.create_thumbnail(path, self._total_images, stored.get(path))
+            box.grid.addWidget(thumb, len(box.paths) // 2, len(box.paths) % 2)
+            box.paths.append(path)
+        box.title.setText(f"📁 第{box.index}组 ({len(box.paths)}张)")
+
+    def remove_group(self, gid):
+        box = self._group_widgets.pop(gid, None)
+        if box is not None:
+            self.parent.layout_contrast_images.removeWidget(box)
+            box.deleteLater()
+
+    def on_groups_streamed(self, batch):
+        """哈希计算期间陆续确认的重复组，边算边显示，结果页无需等待全部完成"""
+        if not self._running:
+            return
+        self.parent.verticalFrame_similar.show()
+        for gid, paths, absorbed in batch:
+            for old_gid in absorbed:
+                self.remove_group(f"stream_{old_gid}")
+                self.groups.pop(f"stream_{old_gid}", None)
+            self.groups[f"stream_{gid}"] = paths
+            self.show_group(f"stream_{gid}", paths)
+
+    def create_thumbnail(self, path, total_images, stored_image=None):
         label = QtWidgets.QLabel()
         label.setFixedSize(95, 95)
         label.setProperty("image_path", path)
@@ -376,15 +662,21 @@ class Contrast(QtWidgets.QWidget):
 
         if path in self.thumbnail_cache:
             label.setPixmap(QtGui.QPixmap.fromImage(self.thumbnail_cache[path]))
-        else:
-            if len(self.thumbnail_cache) >= self.max_cache_size:
-                to_remove = int(len(self.thumbnail_cache) * 0.1)
-                for key in list(self.thumbnail_cache.keys())[:to_remove]:
-                    del self.thumbnail_cache[key]
+            return label
 
-            loader = ThumbnailLoader(path, QtCore.QSize(95, 95), total_images)
+        if len(self.thumbnail_cache) >= self.max_cache_size:
+            to_remove = int(len(self.thumbnail_cache) * 0.1)
+            for key in list(self.thumbnail_cache.keys())[:to_remove]:
+                del self.thumbnail_cache[key]
+
+        if stored_image is not None:
+            self.on_thumbnail_ready(path, stored_image.scaled(95, 95, Qt.AspectRatioMode.KeepAspectRatio,
+                                                              Qt.TransformationMode.SmoothTransformation), label)
+        else:
+            loader = ThumbnailLoader(path, QtCore.QSize(95, 95), total_images, self.use_embedded_thumbnails)
             loader.signals.thumbnail_ready.connect(lambda p, img: self.on_thumbnail_ready(p, img, label))
-            loader.signals.progress_updated.connect(self.update_progress)
+            if total_images:
+                loader.signals.progress_updated.connect(self.update_progress)
             self.thumbnail_loaders.append(loader)
             self.thread_pool.start(loader)
 
@@ -410,36 +702,43 @@ class Contrast(QtWidgets.QWidget):
         else:
             compare_path = current_group[0]
 
-        pixmap_a = self.load_image_to_pixmap(path)
-        if pixmap_a:
-            self.parent.label_image_A.setPixmap(pixmap_a.scaled(
-                self.parent.label_image_A.width(),
-                self.parent.label_image_A.height(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            ))
-
-        pixmap_b = self.load_image_to_pixmap(compare_path)
-        if pixmap_b:
-            self.parent.label_image_B.setPixmap(pixmap_b.scaled(
-                self.parent.label_image_B.width(),
-                self.parent.label_image_B.height(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            ))
+        previews = ((self.parent.label_image_A, path), (self.parent.label_image_B, compare_path))
+        self._preview_paths = (path, compare_path)
+        if self.use_embedded_thumbnails:
+            # 先用内嵌缩略图占位让界面立即有反馈，下一轮事件循环再加载清晰的预览
+            for label, image_path in previews:
+                placeholder = open_embedded_thumbnail(image_path, self.PLACEHOLDER_BOX)
+                if placeholder is not None:
+                    self._set_preview_pixmap(label, QPixmap.fromImage(pil_to_qimage(placeholder[0])))
+            QtCore.QTimer.singleShot(0, lambda: self._load_previews(previews))
+        else:
+            self._load_previews(previews)
 
         self.parent.verticalFrame_13.show()
 
-    def load_image_to_pixmap(self, path):
-        if path.lower().endswith(('.heic', '.heif')):
-            try:
-                qimage = load_heic_as_qimage(path)
-                return QPixmap.fromImage(qimage)
-            except Exception:
-                return None
-        else:
-            pixmap = QPixmap(path)
-            return pixmap if not pixmap.isNull() else None
+    def _load_previews(self, previews):
+        if tuple(image_path for _, image_path in previews) != self._preview_paths:
+            return  # 期间已切换到其它图片
+        for label, image_path in previews:
+            pixmap = self.load_image_to_pixmap(image_path, label.size())
+            if pixmap:
+                self._set_preview_pixmap(label, pixmap)
+
+    @staticmethod
+    def _set_preview_pixmap(label, pixmap):
+        label.setPixmap(pixmap.scaled(
+            label.width(),
+            label.height(),
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation
+        ))
+
+    def load_image_to_pixmap(self, path, size):
+        try:
+            image = load_qimage_reduced(path, size)
+        except Exception:
+            return None
+        return QPixmap.fromImage(image) if not image.isNull() else None
 
     def toggle_thumbnail_selection(self, label):
         path = label.property("image_path")
@@ -458,22 +757,24 @@ class Contrast(QtWidgets.QWidget):
             return
         self.thumbnail_cache[path] = image.copy()
         pixmap = QPixmap.fromImage(image)
-        label.setPixmap(pixmap)
+        try:
+            label.setPixmap(pixmap)
+        except RuntimeError:
+            return  # 所在分组已被合并或结果页已刷新
         label.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         label.setScaledContents(True)
         image = QImage()
 
+    def reset_progress(self):
+        """开始新的检索前归零；update_progress 只会前进，不归零的话上次的 100% 会一直保持"""
+        self.current_progress = 0
+        self.parent.progressBar_Contrast.setValue(0)
+
     def update_progress(self, value):
         if value > self.current_progress:
             self.current_progress = value
             self.parent.progressBar_Contrast.setValue(value)
 
-    def add_separator(self, layout, row):
-        sep = QtWidgets.QFrame()
-        sep.setFrameShape(QtWidgets.QFrame.Shape.HLine)
-        sep.setStyleSheet("border:1px dashed #BDBDBD;")
-        layout.addWidget(sep, row, 0, 1, layout.columnCount())
-
     def clear_layout(self, layout):
         while layout.count():
             item = layout.takeAt(0)
@@ -481,24 +782,8 @@ class Contrast(QtWidgets.QWidget):
                 widget.deleteLater()
 
     def show_image(self, label, path):
-        if path.lower().endswith(('.heic', '.heif')):
-            try:
-                heif = pillow_heif.read_heif(path)
-                img = Image.frombytes(heif.mode, heif.size, heif.data, "raw")
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-                qimg = QImage(img.tobytes(), img.width, img.height, QImage.Format.Format_RGB888)
-                if not qimg.isNull():
-                    pix = QPixmap.fromImage(qimg)
-                    pix = pix.scaled(label.width(), label.height(),
-                                     Qt.AspectRatioMode.KeepAspectRatio,
-                                     Qt.TransformationMode.SmoothTransformation)
-                    label.setPixmap(pix)
-                return
-            except:
-                return
-        pix = QPixmap(path)
-        if not pix.isNull():
+        pix = self.load_image_to_pixmap(path, label.size())
+        if pix is not None:
             pix = pix.scaled(label.width(), label.height(),
                              Qt.AspectRatioMode.KeepAspectRatio,
                              Qt.TransformationMode.SmoothTransformation)
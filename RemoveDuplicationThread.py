@@ -1,137 +1,551 @@
 import os
 import logging
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import threading
 import time
 
 import numpy as np
-import pillow_heif
 from PIL import Image
 from PyQt6 import QtCore
 from PyQt6.QtCore import QThread, pyqtSignal
 
+from cascade import THUMB_SIZE, gray_thumbnail, gray_thumbnail_algo, verify_pairs
+from capture_window import (CAPTURE_CACHE_ALGO, read_capture_info, capture_to_blob, blob_to_capture,
+                            windowed_pairs)
+from clustering import LINKAGES, SimilarityGraph, StreamingGroups
+from config_manager import config_manager
+from hamming_index import MultiIndexHashing, PackedHashes, bits_to_code, collapse_identical
+from hash_cache import hash_cache, file_signature, codes_to_blob, blob_to_codes
+from exact_duplicates import find_exact_duplicates
+from grid_thumbnails import GRID_THUMBNAIL_SIZE, encode_grid_thumbnail, grid_thumbnail_algo
+from image_decode import HEIF_EXTENSIONS, open_image_reduced
+from image_quality import QUALITY_BYTES, SHARPNESS_MIN_DECODE, ImageQuality, measure_quality
+from io_scheduler import EXIF_PREFETCH_BYTES, READ_ORDERS, Prefetcher, ReadScheduler, order_for_locality
+from library_index import get_library_index
+from raw_preview import RAW_EXTENSIONS
+from video_fingerprint import (VIDEO_CACHE_ALGO, VIDEO_EXTENSIONS, VideoFingerprints, is_video_file,
+                               video_fingerprint)
+
+logger = logging.getLogger(__name__)
+
+HASH_BACKENDS = ('thread', 'process')
+HASH_ALGORITHMS = ('dhash', 'ahash', 'phash', 'whash')
+HASH_BYTES = 8 * len(HASH_ALGORITHMS)
+HASH_RECORD_BYTES = HASH_BYTES + QUALITY_BYTES
+
 
 class ImageHasher:
-    
+
+    # 解码方式变化会让哈希略有不同，升级该版本号使旧缓存失效（6：超大图片改为分块解码，不再记为无法处理；
+    # 7：wHash 改为 Haar 多频带；8：解码至少 256px，清晰度在更大的尺寸上计算）
+    DECODER_VERSION = 8
+
     @staticmethod
-    def dhash(image_path, hash_size=8):
-        try:
-            # 文件大小检查，避免处理过大的文件
-            file_size = os.path.getsize(image_path)
-            if file_size > 100 * 1024 * 1024:  # 100MB限制
-                return None
-                
-            ext = image_path.lower().split('.')[-1]
-            if ext in ('heic', 'heif'):
-                heif_file = pillow_heif.read_heif(image_path)
-                img = Image.frombytes(
-                    heif_file.mode,
-                    heif_file.size,
-                    heif_file.data,
-                    "raw",
-                    heif_file.mode,
-                    heif_file.stride,
-                )
-            else:
-                with Image.open(image_path) as img:
-                    img.load()
+    def cache_algo(hash_size, use_embedded=False):
+        # 四种哈希与质量指标存在同一条缓存记录里；内嵌缩略图算出的哈希与原图略有差异，两种来源分开缓存
+        suffix = "t" if use_embedded else ""
+        return f"hash{hash_size}v{ImageHasher.DECODER_VERSION}{suffix}"
+
+    @staticmethod
+    def to_record(codes, quality):
+        return codes_to_blob(codes) + quality.to_bytes()
 
-            w, h = img.size
+    @staticmethod
+    def from_record(blob):
+        """解析缓存记录为 (哈希元组, 质量指标)，格式不符（旧版本记录）时返回 None"""
+        if len(blob) != HASH_RECORD_BYTES:
+            return None
+        return blob_to_codes(blob[:HASH_BYTES]), ImageQuality.from_bytes(blob[HASH_BYTES:])
+
+    @staticmethod
+    def compute_hashes(image_path, hash_size=8, use_embedded=False):
+        """
+        一次解码同时计算 HASH_ALGORITHMS 中的全部哈希，按该顺序返回元组，无法计算时返回 None。
+        切换或组合算法都不需要再次读取和解码图片。
+        """
+        analyzed = ImageHasher.analyze(image_path, hash_size, use_embedded)
+        return analyzed[0] if analyzed is not None else None
+
+    @staticmethod
+    def analyze(image_path, hash_size=8, use_embedded=False):
+        """在同一次解码中计算全部哈希和质量指标，返回 (哈希元组, ImageQuality)，无法计算时返回 None"""
+        return ImageHasher.analyze_with_thumbnail(image_path, hash_size, use_embedded, None)[0]
+
+    @staticmethod
+    def analyze_with_thumbnail(image_path, hash_size=8, use_embedded=False, thumbnail_size=GRID_THUMBNAIL_SIZE,
+                               gray_size=None):
+        """
+        与 analyze 相同，thumbnail_size 不为空时还由同一次解码生成结果页的网格缩略图，
+        gray_size 不为空时生成 SSIM 复核用的灰度缩略图，
+        返回 (analyze 的结果, 缩略图 JPEG 字节, 灰度缩略图字节)，无法计算的部分为 None。
+        """
+        try:
+            # 只按 pHash、网格缩略图和清晰度所需的尺寸解码，大图不再整幅解码；不做 reduce，避免相邻像素的大小关系被改变。
+            # 无论是否生成缩略图都按同样的尺寸和颜色模式解码，两种模式算出的哈希完全一致
+            box = max(hash_size * 4, GRID_THUMBNAIL_SIZE, SHARPNESS_MIN_DECODE)
+            img, (w, h) = open_image_reduced(image_path, (box, box), None, use_embedded, reducing_gap=None)
+            gray = img.convert('L') if img.mode != 'L' else img
             if w < 50 or h < 50:
-                return None
+                return None, None, None
             if (w / h) < 0.2 or (w / h) > 5:
-                return None
-
-            # 限制最大尺寸，避免内存占用过高
-            max_dimension = 2000
-            if w > max_dimension or h > max_dimension:
-                ratio = min(max_dimension / w, max_dimension / h)
-                new_w, new_h = int(w * ratio), int(h * ratio)
-                img = img.resize((new_w, new_h), Image.Resampling.BILINEAR)
-
-            image = img.convert('L').resize(
-                (hash_size + 1, hash_size),
-                Image.Resampling.BILINEAR
-            )
+                return None, None, None
 
-            pixels = np.array(image, dtype=np.int16)
-            diff = pixels[:, 1:] > pixels[:, :-1]
-            return diff.flatten()
+            analysis = ImageHasher.hashes_from_image(gray, hash_size), measure_quality(image_path, gray, (w, h))
+            return (analysis,
+                    encode_grid_thumbnail(img, thumbnail_size) if thumbnail_size else None,
+                    gray_thumbnail(gray, gray_size).tobytes() if gray_size else None)
 
         except Exception:
-            return None
+            return None, None, None
 
     @staticmethod
-    def hamming_distance(bits1, bits2):
-        return np.count_nonzero(bits1 != bits2)
+    def hashes_from_image(img, hash_size=8):
+        """由已解码的灰度图计算全部哈希，除 dHash 外共用同一块 (4·hash_size)² 的灰度缓冲"""
+        diff_pixels = np.array(img.resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR), dtype=np.int16)
+        dhash = bits_to_code(diff_pixels[:, 1:] > diff_pixels[:, :-1])
+
+        side = hash_size * 4
+        pixels = np.array(img.resize((side, side), Image.Resampling.BILINEAR), dtype=np.float64)
+        blocks = pixels.reshape(hash_size, 4, hash_size, 4).mean(axis=(1, 3))
+        ahash = bits_to_code(blocks > blocks.mean())
+        whash = _wavelet_hash(pixels)
+        dct = _dct_matrix(side)
+        low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+        phash = bits_to_code(low > np.median(low))
+
+        hashes = {'dhash': dhash, 'ahash': ahash, 'phash': phash, 'whash': whash}
+        return tuple(hashes[name] for name in HASH_ALGORITHMS)
+
+    @staticmethod
+    def dhash(image_path, hash_size=8, use_embedded=False):
+        hashes = ImageHasher.compute_hashes(image_path, hash_size, use_embedded)
+        return hashes[HASH_ALGORITHMS.index('dhash')] if hashes is not None else None
+
+    @staticmethod
+    def hamming_distance(code1, code2):
+        return (int(code1) ^ int(code2)).bit_count()
 
     @staticmethod
     def hash_to_int(hash_bits, num_bits=8):
-        return int(''.join(['1' if bit else '0' for bit in hash_bits[:num_bits]]), 2)
+        return bits_to_code(np.asarray(hash_bits, dtype=bool)[:num_bits]) >> (64 - num_bits)
+
+
+def _haar_step(x):
+    """一级二维 Haar 分解，返回 (低频, 水平细节, 竖直细节, 对角细节)，各为原尺寸的一半"""
+    top, bottom = x[0::2], x[1::2]
+    rows_low, rows_high = (top + bottom) / 2, (top - bottom) / 2
+    return ((rows_low[:, 0::2] + rows_low[:, 1::2]) / 2, (rows_low[:, 0::2] - rows_low[:, 1::2]) / 2,
+            (rows_high[:, 0::2] + rows_high[:, 1::2]) / 2, (rows_high[:, 0::2] - rows_high[:, 1::2]) / 2)
+
+
+def _wavelet_hash(pixels):
+    """
+    小波哈希：(4·hash_size)² 的灰度图做三级 Haar 分解，最粗一级的低频和三个细节频带各 (hash_size/2)² 个系数，
+    每个频带与自身的中位数比较。只取低频时结果等同于块均值与中位数比较（与 aHash 几乎一致），
+    细节频带记录的是边缘走向，因此与 aHash、dHash 互补。hash_size 须为偶数（默认 8）。
+    """
+    low = pixels
+    for _ in range(3):
+        low, *details = _haar_step(low)
+    bands = (low, *details)
+    return bits_to_code(np.concatenate([(band > np.median(band)).ravel() for band in bands]))
+
+
+@lru_cache(maxsize=8)
+def _dct_matrix(size):
+    """正交 DCT-II 变换矩阵，二维 DCT 即 M @ X @ M.T"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def find_similar(image_path, k=10, algorithm="dhash", hash_size=8, use_embedded=None, max_distance=None,
+                 should_stop=None):
+    """
+    以图搜图：返回图库（哈希缓存中已有的全部图片）里与 image_path 最相似的 k 张图片，
+    形如 [(路径, 汉明距离), ...]，按距离从近到远排列。查询图片本身不在结果中。
+    查询图片的哈希优先从缓存读取；图库索引常驻内存，不扫描磁盘。
+    should_stop 在计算查询哈希、加载图库索引之后各检查一次，返回 True 时提前返回空结果。
+    """
+    if use_embedded is None:
+        use_embedded = config_manager.get_setting("hash_use_embedded_thumbnail", False)
+    cache_algo = ImageHasher.cache_algo(hash_size, bool(use_embedded))
+    signature = file_signature(image_path)
+    if signature is None:
+        raise FileNotFoundError(image_path)
+    record = ImageHasher.from_record(hash_cache.get_many({image_path: signature}, cache_algo).get(image_path, b''))
+    codes = record[0] if record else ImageHasher.compute_hashes(image_path, hash_size, bool(use_embedded))
+    if codes is None:
+        raise ValueError("无法计算该图片的哈希")
+    code = codes[HASH_ALGORITHMS.index(algorithm)]
+    if should_stop and should_stop():
+        return []
+
+    library = get_library_index(cache_algo, HASH_ALGORITHMS)
+    if should_stop and should_stop():
+        return []
+    # 多取一些，给查询图片自身和已被删除的过期记录留出位置
+    ids, distances = library.index(algorithm).nearest(code, k + 1 + k // 4, max_distance)
+    query = os.path.normcase(os.path.abspath(image_path))
+    results = [(library.paths[i], d) for i, d in zip(ids.tolist(), distances.tolist())
+               if os.path.normcase(os.path.abspath(library.paths[i])) != query and os.path.exists(library.paths[i])]
+    return results[:k]
+
+
+def load_cached_qualities(paths, hash_size=8, use_embedded=None):
+    """从哈希缓存读取哈希时顺带算好的质量指标 {路径: ImageQuality}，不读取图像；文件已变化或没有记录的不在结果中"""
+    if use_embedded is None:
+        use_embedded = config_manager.get_setting("hash_use_embedded_thumbnail", False)
+    signatures = {path: sig for path in paths if (sig := file_signature(path)) is not None}
+    cached = hash_cache.get_many(signatures, ImageHasher.cache_algo(hash_size, bool(use_embedded)))
+    records = {path: ImageHasher.from_record(blob) for path, blob in cached.items()}
+    return {path: record[1] for path, record in records.items() if record is not None}
+
+
+def _hash_to_blob(image_path, hash_size, use_embedded=False, thumbnail_size=None, gray_size=None):
+    """进程池任务：只回传打包好的缓存记录（无法计算时为空字节）和缩略图字节，避免跨进程传输 numpy 对象"""
+    analyzed, thumbnail, gray = ImageHasher.analyze_with_thumbnail(image_path, hash_size, use_embedded,
+                                                                   thumbnail_size, gray_size)
+    return ImageHasher.to_record(*analyzed) if analyzed is not None else b'', thumbnail, gray
 
 
 class HashWorker(QtCore.QThread):
     
-    hash_completed = QtCore.pyqtSignal(dict)
+    hash_completed = QtCore.pyqtSignal(object)
+    exact_groups_found = QtCore.pyqtSignal(list)
+    # 计算过程中已确认的重复组，分批发出：[(组号, 成员列表, 被并入的组号列表)]
+    groups_streamed = QtCore.pyqtSignal(list)
     progress_updated = QtCore.pyqtSignal(int)
     error_occurred = QtCore.pyqtSignal(str)
+    log_signal = QtCore.pyqtSignal(str, str)
+
+    # 每个工作单元最多排队的任务数，保证池子不空转的同时限制内存占用
+    IN_FLIGHT_PER_WORKER = 4
 
-    def __init__(self, image_paths, hash_size=8, max_workers=4):
+    def __init__(self, image_paths, hash_size=8, max_workers=None, use_cache=True, backend=None,
+                 throttle_ms=None, use_embedded=None, exact_prepass=True, algorithm=None, scan_roots=()):
         super().__init__()
         self.image_paths = image_paths
+        # 本次扫描的文件夹：完成后清理其中已删除或已移走的文件的缓存记录
+        self.scan_roots = list(scan_roots)
         self.hash_size = hash_size
+        self.use_cache = use_cache
+        self.backend = backend or config_manager.get_setting("hash_backend", "thread")
+        if self.backend not in HASH_BACKENDS:
+            self.backend = "thread"
+        if max_workers is None:
+            max_workers = config_manager.get_setting("hash_workers", 0) or (
+                os.cpu_count() or 4 if self.backend == "process" else 4
+            )
         self.max_workers = max_workers
+        # 每处理一张图片额外暂停的毫秒数，0 表示全速
+        if throttle_ms is None:
+            throttle_ms = config_manager.get_setting("hash_throttle_ms", 0)
+        self.throttle_ms = max(0, throttle_ms)
+        # 是否直接用 JPEG/HEIC 内嵌的缩略图计算哈希（速度快很多，但与原图哈希略有差异）
+        if use_embedded is None:
+            use_embedded = config_manager.get_setting("hash_use_embedded_thumbnail", False)
+        self.use_embedded = bool(use_embedded)
+        # 先找出字节完全相同的文件，每组只留一个代表去计算哈希
+        self.exact_prepass = exact_prepass
+        # 全部算法都会计算并缓存，这里只决定结果默认选用哪一种
+        self.algorithm = algorithm or config_manager.get_setting("hash_algorithm", "dhash")
+        if self.algorithm not in HASH_ALGORITHMS:
+            self.algorithm = "dhash"
+        # 连拍时间窗口模式需要每张图片的拍摄时间和相机
+        self.read_capture = config_manager.get_setting("burst_window_mode", False)
+        self.videos = VideoFingerprints()
+        # 每隔这么多毫秒把新确认的重复组交给界面
+        self.stream_interval = config_manager.get_setting("stream_groups_interval_ms", 1000) / 1000
+        self._stream = StreamingGroups()
+        self._last_stream = 0.0
+        # 合并模式：哈希时顺带从同一次解码生成结果页的网格缩略图并写入缓存（缩略图只存于缓存中）
+        store_thumbnails = use_cache and config_manager.get_setting("hash_store_grid_thumbnails", True)
+        self.thumbnail_size = GRID_THUMBNAIL_SIZE if store_thumbnails else None
+        self._thumbnails = []
+        # SSIM 复核用的灰度缩略图同样由哈希时的解码生成并写入缓存，对比阶段不再重新解码原图
+        store_gray = use_cache and config_manager.get_setting("cascade_verify", True)
+        self.gray_size = THUMB_SIZE if store_gray else None
+        self._gray_thumbnails = []
+        # 机械硬盘、NAS：按磁盘位置排序后顺序读取，并限制每个设备同时读取的线程数（"off" 表示不调度）
+        self.read_order = config_manager.get_setting("io_read_order", "off")
+        if self.read_order not in READ_ORDERS:
+            self.read_order = "off"
+        self.readers_per_device = config_manager.get_setting("io_readers_per_device", 1)
+        # 预读：处理第 N 个文件时提前让系统读入之后 prefetch_depth 个文件，0 表示关闭
+        self.prefetch_depth = config_manager.get_setting("prefetch_depth", 8)
+        self.prefetch_mode = config_manager.get_setting("prefetch_mode", "auto")
         self._is_running = True
         self._stop_lock = threading.Lock()
 
+    def log(self, level, message):
+        self.log_signal.emit(level, message)
+
+    @property
+    def cache_algo(self):
+        return ImageHasher.cache_algo(self.hash_size, self.use_embedded)
+
+    def _create_executor(self):
+        if self.backend == "process":
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def _submit(self, executor, path):
+        if self.backend == "process":
+            return executor.submit(_hash_to_blob, path, self.hash_size, self.use_embedded, self.thumbnail_size,
+                                   self.gray_size)
+        return executor.submit(ImageHasher.analyze_with_thumbnail, path, self.hash_size, self.use_embedded,
+                               self.thumbnail_size, self.gray_size)
+
+    def _prefetch_bytes(self, path):
+        """
+        预读解码实际会用到的范围（0 表示整个文件）：RAW 只解析文件头并读取内嵌预览，视频只跳转读取几帧，
+        使用内嵌缩略图时 HEIF 只读 meta 和缩略图条目，这些都只预读文件头，不把几十 MB 的文件整个读入
+        """
+        lower = path.lower()
+        if lower.endswith(RAW_EXTENSIONS + VIDEO_EXTENSIONS):
+            return EXIF_PREFETCH_BYTES
+        if self.use_embedded and lower.endswith(HEIF_EXTENSIONS):
+            return EXIF_PREFETCH_BYTES
+        return 0
+
+    def _collect(self, future):
+        """返回 ((哈希元组, 质量指标), 缩略图字节, 灰度缩略图字节)，无法计算的部分为 None"""
+        result, thumbnail, gray = future.result(timeout=30)  # 增加超时控制
+        if self.backend == "process":
+            return (ImageHasher.from_record(result) if result else None), thumbnail, gray
+        return result, thumbnail, gray
+
+    def _load_cached(self, paths):
+        """从哈希缓存中取出未变化文件的哈希，返回 (命中结果, 待计算路径, 文件签名, 命中数)"""
+        signatures = {}
+        for path in paths:
+            signature = file_signature(path)
+            if signature is not None:
+                signatures[path] = signature
+
+        cached = hash_cache.get_many(signatures, self.cache_algo) if self.use_cache else {}
+        # 空记录表示该文件上次已判定为无法计算哈希（过小、比例异常等），同样视为命中
+        records = {path: ImageHasher.from_record(blob) for path, blob in cached.items() if blob}
+        cached = {path: blob for path, blob in cached.items() if not blob or records[path] is not None}
+        hits = {path: record[0] for path, record in records.items() if record is not None}
+        misses = [path for path in signatures if path not in cached]
+        return hits, misses, signatures, len(cached)
+
+    def _save_thumbnails(self):
+        """把已生成的网格缩略图和灰度缩略图写入缓存，显示分组和 SSIM 复核时直接读取，不必再次解码原图"""
+        if self._thumbnails:
+            hash_cache.put_many(self._thumbnails, grid_thumbnail_algo(self.thumbnail_size))
+            self._thumbnails = []
+        if self._gray_thumbnails:
+            hash_cache.put_many(self._gray_thumbnails, gray_thumbnail_algo(self.gray_size))
+            self._gray_thumbnails = []
+
+    def _save_cached(self, computed, signatures):
+        self._save_thumbnails()
+        if not self.use_cache or not computed:
+            return
+        hash_cache.put_many(
+            ((path, *signatures[path], ImageHasher.to_record(*record) if record is not None else b'')
+             for path, record in computed.items()),
+            self.cache_algo
+        )
+
+    def _load_capture_info(self, paths):
+        """读取拍摄时间和相机，优先使用缓存，未命中的用线程池读取 EXIF"""
+        signatures = {}
+        for path in paths:
+            signature = file_signature(path)
+            if signature is not None:
+                signatures[path] = signature
+        cached = hash_cache.get_many(signatures, CAPTURE_CACHE_ALGO) if self.use_cache else {}
+        capture_info = {path: blob_to_capture(blob) for path, blob in cached.items()}
+        missing = [path for path in signatures if path not in cached]
+
+        # 由开始读取的工作线程推进预读窗口，统计的是真正读取时文件头是否已在页缓存中
+        prefetcher = Prefetcher(missing, self.prefetch_depth, self.prefetch_mode, EXIF_PREFETCH_BYTES)
+
+        def read_one(index):
+            prefetcher.advance(index)
+            return read_capture_info(missing[index])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for path, info in zip(missing, executor.map(read_one, range(len(missing)))):
+                if not self.is_running():
+                    break
+                capture_info[path] = info
+        prefetcher.close()
+        if self.use_cache:
+            hash_cache.put_many(
+                ((path, *signatures[path], capture_to_blob(*capture_info[path]))
+                 for path in missing if path in capture_info),
+                CAPTURE_CACHE_ALGO
+            )
+        self.log("DEBUG", f"拍摄信息缓存命中 {len(cached)} 张，读取 EXIF {len(missing)} 张；{prefetcher.summary()}")
+        return capture_info
+
+    def _load_video_fingerprints(self, paths):
+        """计算视频指纹，优先使用缓存；每个视频只跳转读取几帧，ffmpeg 在子进程中解码，线程池即可并行"""
+        signatures = {}
+        for path in paths:
+            signature = file_signature(path)
+            if signature is not None:
+                signatures[path] = signature
+        cached = hash_cache.get_many(signatures, VIDEO_CACHE_ALGO) if self.use_cache else {}
+        fingerprints = {path: blob_to_codes(blob) for path, blob in cached.items() if blob}
+        missing = [path for path in signatures if path not in cached]
+
+        computed = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for path, fingerprint in zip(missing, executor.map(video_fingerprint, missing)):
+                if not self.is_running():
+                    break
+                computed[path] = fingerprint
+                if fingerprint is not None:
+                    fingerprints[path] = fingerprint
+        if self.use_cache and computed:
+            hash_cache.put_many(
+                ((path, *signatures[path], codes_to_blob(codes) if codes is not None else b'')
+                 for path, codes in computed.items()),
+                VIDEO_CACHE_ALGO
+            )
+        self.log("INFO", f"视频指纹缓存命中 {len(cached)} 个，新计算 {len(computed)} 个")
+        return VideoFingerprints.from_dict(fingerprints)
+
+    def _stream_hashes(self, items, force=False):
+        """哈希完全相同的图片先行归组，按时间间隔分批发出"""
+        column = HASH_ALGORITHMS.index(self.algorithm)
+        for path, codes in items:
+            if codes is not None:
+                self._stream.add(path, codes[column])
+        now = time.monotonic()
+        if force or now - self._last_stream >= self.stream_interval:
+            self._last_stream = now
+            batch = self._stream.flush()
+            # 先写入缩略图，界面收到分组后即可从缓存读取
+            self._save_thumbnails()
+            if batch and self.is_running():
+                self.groups_streamed.emit(batch)
+
+    def _prune_cache(self):
+        if not self.use_cache or not self.scan_roots:
+            return
+        removed = hash_cache.prune_missing(self.scan_roots, self.image_paths)
+        if removed:
+            self.log("DEBUG", f"已从哈希缓存清理 {removed} 个不再存在的文件的记录")
+
+    def _emit_hashes(self, hashes):
+        self._prune_cache()
+        packed = PackedHashes.from_variants(hashes, HASH_ALGORITHMS).with_algorithm(self.algorithm)
+        packed.videos = self.videos
+        if self.read_capture:
+            packed.attach_capture(self._load_capture_info(packed.paths))
+        if self.is_running():
+            self.hash_completed.emit(packed)
+
     def run(self):
         try:
             hashes = {}
             supported_extensions = (
                 '.jpg', '.jpeg', '.png', '.bmp', '.gif',
                 '.heic', '.heif', '.webp', '.tif', '.tiff'
-            )
+            ) + RAW_EXTENSIONS + VIDEO_EXTENSIONS
 
             filtered_paths = [
                 path for path in self.image_paths
                 if path.lower().endswith(supported_extensions)
             ]
+
+            if not filtered_paths:
+                self.hash_completed.emit(PackedHashes())
+                return
+
+            # 排好的顺序一直保留到哈希阶段，完全相同文件的预扫描也因此按磁盘位置读取
+            filtered_paths = order_for_locality(filtered_paths, self.read_order)
+
+            if self.exact_prepass:
+                exact_groups, filtered_paths = find_exact_duplicates(
+                    filtered_paths, should_stop=lambda: not self.is_running()
+                )
+                if not self.is_running():
+                    return
+                copies = sum(len(group) - 1 for group in exact_groups)
+                self.log("INFO", f"发现 {len(exact_groups)} 组完全相同的文件，{copies} 个副本无需解码")
+                self.exact_groups_found.emit(exact_groups)
+                self._stream = StreamingGroups(exact_groups)
+                self._stream_hashes((), force=True)
+
+            video_paths = [path for path in filtered_paths if is_video_file(path)]
+            if video_paths:
+                filtered_paths = [path for path in filtered_paths if not is_video_file(path)]
+                self.videos = self._load_video_fingerprints(video_paths)
+                if not self.is_running():
+                    return
+
+            hashes, filtered_paths, signatures, hit_count = self._load_cached(filtered_paths)
+            self.log("INFO", f"哈希缓存命中 {hit_count} 张，未命中 {len(filtered_paths)} 张")
+            self._stream_hashes(hashes.items(), force=True)
+            computed = {}
             total = len(filtered_paths)
-            
             if total == 0:
-                self.hash_completed.emit({})
+                self.progress_updated.emit(40)
+                self._emit_hashes(hashes)
                 return
 
-            # 分批处理，避免内存占用过高
-            batch_size = 50
+            # 常驻工作池 + 有上限的在途任务队列：完成一个补一个，既不让池子空转也不一次性提交全部任务
             processed_count = 0
-            
-            for batch_start in range(0, total, batch_size):
-                if not self.is_running():
-                    return
-                    
-                batch_end = min(batch_start + batch_size, total)
-                batch_paths = filtered_paths[batch_start:batch_end]
-                
-                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                    future_to_path = {
-                        executor.submit(ImageHasher.dhash, path, self.hash_size): path
-                        for path in batch_paths
-                    }
-
-                    for future in as_completed(future_to_path):
-                        if not self.is_running():
-                            # 取消剩余任务
-                            for f in future_to_path:
-                                f.cancel()
-                            return
-
-                        path = future_to_path[future]
+            max_in_flight = self.max_workers * self.IN_FLIGHT_PER_WORKER
+            pending = {}
+            path_iter = iter(filtered_paths)
+            self.log("DEBUG", f"哈希计算使用 {self.backend} 后端，{self.max_workers} 个工作单元，"
+                              f"最多 {max_in_flight} 个在途任务")
+            prefetcher = None
+            if self.read_order != "off":
+                # 读取由调度器按设备顺序完成，解码任务只在文件已读入页缓存后提交
+                path_iter = ReadScheduler(filtered_paths, self.readers_per_device, max_in_flight * 2,
+                                          should_stop=lambda: not self.is_running(),
+                                          head_bytes=self._prefetch_bytes)
+                self.log("DEBUG", f"按 {self.read_order} 顺序读取，{path_iter.devices} 个设备，"
+                                  f"每个设备 {self.readers_per_device} 个读取线程")
+            else:
+                # 提交任务时预读其后的文件；任务在队列中等待期间文件就已读入页缓存
+                prefetcher = Prefetcher(filtered_paths, self.prefetch_depth, self.prefetch_mode, self._prefetch_bytes)
+                path_iter = iter(prefetcher)
+            started = time.perf_counter()
+            executor = self._create_executor()
+
+            try:
+                while True:
+                    while len(pending) < max_in_flight and self.is_running():
+                        path = next(path_iter, None)
+                        if path is None:
+                            break
+                        pending[self._submit(executor, path)] = path
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    if not self.is_running():
+                        self._save_cached(computed, signatures)
+                        return
+
+                    done_paths = []
+                    for future in done:
+                        path = pending.pop(future)
+                        done_paths.append(path)
                         try:
-                            result = future.result(timeout=30)  # 增加超时控制
+                            result, thumbnail, gray = self._collect(future)
+                            if thumbnail is not None:
+                                self._thumbnails.append((path, *signatures[path], thumbnail))
+                            if gray is not None:
+                                self._gray_thumbnails.append((path, *signatures[path], gray))
                             if result is not None:
-                                hashes[path] = result
+                                hashes[path] = result[0]
+                            computed[path] = result
                         except Exception as e:
                             # 单个文件处理失败不影响整体流程
                             pass
@@ -139,17 +553,37 @@ class HashWorker(QtCore.QThread):
                         processed_count += 1
                         if processed_count % 10 == 0 or processed_count == total:
                             self.progress_updated.emit(int(processed_count / total * 40))
-                
-                # 批次间短暂休眠，降低CPU占用
-                if self.is_running() and batch_start + batch_size < total:
-                    time.sleep(0.1)
+                    self._stream_hashes((done_path, hashes.get(done_path)) for done_path in done_paths)
+
+                    # 需要降低CPU占用时，按设置的每张图片间隔放慢补充任务的速度
+                    if self.throttle_ms and done:
+                        time.sleep(self.throttle_ms * len(done) / 1000)
+            finally:
+                if isinstance(path_iter, ReadScheduler):
+                    path_iter.close()
+                if prefetcher is not None:
+                    prefetcher.close()
+                # 取消尚未开始的任务，正在运行的进程任务结束后自然退出
+                executor.shutdown(wait=False, cancel_futures=True)
 
+            elapsed = time.perf_counter() - started
+            if prefetcher is not None:
+                read_summary = prefetcher.summary()
+            else:
+                read_summary = f"读取由调度器完成，读入 {path_iter.bytes_read / 2 ** 20:.1f} MB"
+            self.log("DEBUG", f"哈希计算 {processed_count} 张用时 {elapsed:.1f} 秒"
+                              f"（{processed_count / elapsed if elapsed else 0:.1f} 张/秒）；{read_summary}")
+
+            self._save_cached(computed, signatures)
+            self._stream_hashes((), force=True)
             if self.is_running():
-                self.hash_completed.emit(hashes)
+                self._emit_hashes(hashes)
         except Exception as e:
             self.error_occurred.emit(str(e))
 
     def stop(self):
+        # 只设置标志：工作池由 run 自己关闭（最多等待一次 wait 的超时），
+        # 避免在 run 仍在提交任务时从界面线程关闭工作池
         with self._stop_lock:
             self._is_running = False
     
@@ -161,13 +595,28 @@ class HashWorker(QtCore.QThread):
 class ContrastWorker(QThread):
     progress_signal = pyqtSignal(int)
     result_signal = pyqtSignal(list)
+    graph_signal = pyqtSignal(object)
     finished_signal = pyqtSignal()
     log_signal = pyqtSignal(str, str)
 
-    def __init__(self, hash_dict, similarity_threshold, parent=None):
+    def __init__(self, hashes, similarity_threshold, previous_graph=None, parent=None):
         super().__init__(parent)
-        self.hash_dict = hash_dict
+        self.hashes = hashes
+        # 只检索到用户当前的阈值：检索耗时随半径急剧增长，调低阈值时直接用相似图重新分组，
+        # 调高到超出相似图范围时才扩展检索，previous_graph 中已复核过的图片对沿用原结果，不再复核
         self.similarity_threshold = similarity_threshold
+        self.previous_graph = previous_graph
+        # single：相似关系可传递；complete：组内任意两张都要在阈值以内
+        self.linkage = config_manager.get_setting("cluster_linkage", "single")
+        if self.linkage not in LINKAGES:
+            self.linkage = "single"
+        # 只比较同一相机在时间窗口内的图片，跨窗口只保留几乎相同的图片对
+        self.use_capture_window = (config_manager.get_setting("burst_window_mode", False)
+                                   and getattr(hashes, "taken_at", None) is not None)
+        # 第二阶段：哈希距离超过 cascade_trust_distance 的候选对再用 64px 灰度缩略图的 SSIM 复核
+        self.cascade_verify = config_manager.get_setting("cascade_verify", True)
+        self.cascade_trust_distance = config_manager.get_setting("cascade_trust_distance", 4)
+        self.cascade_min_ssim = config_manager.get_setting("cascade_min_ssim", 0.6)
         self._is_running = True
         self._stop_lock = threading.Lock()
 
@@ -176,15 +625,16 @@ class ContrastWorker(QThread):
 
     def run(self):
         try:
-            image_paths = list(self.hash_dict.keys())
-            
-            if not image_paths:
+            image_paths = self.hashes.paths
+            videos = getattr(self.hashes, "videos", None)
+
+            if not image_paths and not videos:
                 self.log("WARNING", "没有可对比的图片哈希数据")
                 self.result_signal.emit([])
                 return
                 
-            total_comparisons = len(image_paths) * (len(image_paths) - 1) // 2
-            self.log("INFO", f"开始对比 {len(image_paths)} 张图片的相似度，共需进行 {total_comparisons} 次对比")
+            self.log("INFO", f"开始对比 {len(image_paths)} 张图片、{len(videos or ())} 个视频的相似度，"
+                             f"汉明距离阈值 {self.similarity_threshold}")
             
             similar_groups = self._optimized_grouping(image_paths)
             
@@ -199,69 +649,100 @@ class ContrastWorker(QThread):
             self.log("ERROR", f"相似度对比过程中发生严重错误: {str(e)}")
             self.finished_signal.emit()
     
+    def _reusable_graph(self, image_paths, node_of):
+        """上次的相似图与本次是同一批哈希且范围更小时才能沿用，返回它或 None"""
+        previous = self.previous_graph
+        if previous is None or previous.max_threshold >= self.similarity_threshold:
+            return None
+        videos = getattr(self.hashes, "videos", None)
+        if len(previous.paths) != len(image_paths) + len(videos or ()):
+            return None
+        if previous.paths[:len(image_paths)] != list(image_paths):
+            return None
+        if not np.array_equal(previous.node_of[:len(image_paths)], node_of):
+            return None
+        return previous
+
     def _optimized_grouping(self, image_paths):
-        similar_groups = []
-        processed = 0
-        total = len(image_paths)
-        
-        hash_groups = {}
-        for i, path in enumerate(image_paths):
+        start_time = time.perf_counter()
+        threshold = self.similarity_threshold
+        # 哈希完全相同的图片合并为一个节点，之后的检索、复核和相似图都按节点进行
+        nodes, node_of, first = collapse_identical(self.hashes.codes)
+        previous = self._reusable_graph(image_paths, node_of)
+        if self.use_capture_window:
+            window = config_manager.get_setting("burst_window_seconds", 10)
+            global_threshold = config_manager.get_setting("burst_global_threshold", 4)
+            pair_i, pair_j, distances = windowed_pairs(
+                nodes, node_of, self.hashes.taken_at, self.hashes.cameras,
+                threshold, window, global_threshold,
+                should_stop=lambda: not self.is_running()
+            )
+            mode = f"连拍时间窗口 {window} 秒"
+        else:
+            index = MultiIndexHashing(nodes)
+            pair_i, pair_j, distances = index.pairs_within(
+                threshold,
+                should_stop=lambda: not self.is_running()
+            )
+            mode = "全量索引"
+        if not self.is_running():
+            return []
+        self.log("DEBUG", f"第一阶段（{mode}）检索完成，{len(image_paths)} 张图片合并为 {len(nodes)} 个不同的哈希，"
+                          f"阈值 {threshold} 以内共 {len(pair_i)} 对，耗时 {time.perf_counter() - start_time:.2f} 秒")
+        if previous is not None:
+            # 上次范围内的图片对已经复核过，只有新纳入的距离段需要复核，之后并入上次的结果
+            fresh = distances > previous.max_threshold
+            pair_i, pair_j, distances = pair_i[fresh], pair_j[fresh], distances[fresh]
+        self.progress_signal.emit(50)
+
+        if self.cascade_verify and len(pair_i):
+            start_time = time.perf_counter()
+            # 每个节点用它的第一张图片复核
+            keep, checked = verify_pairs(
+                [image_paths[k] for k in first.tolist()], pair_i, pair_j, distances,
+                self.cascade_trust_distance, self.cascade_min_ssim,
+                max_workers=os.cpu_count() or 4,
+                should_stop=lambda: not self.is_running()
+            )
             if not self.is_running():
-                break
-                
-            hash_bits = self.hash_dict[path]
-            group_key = tuple(hash_bits[:16])
-            if group_key not in hash_groups:
-                hash_groups[group_key] = []
-            hash_groups[group_key].append(path)
-            
-            processed += 1
-            self.progress_signal.emit(int(processed / total * 50))
-        
-        final_groups = []
-        processed_groups = 0
-        total_groups = len(hash_groups)
-        
-        for group_paths in hash_groups.values():
+                return []
+            pair_i, pair_j, distances = pair_i[keep], pair_j[keep], distances[keep]
+            self.log("DEBUG", f"第二阶段（SSIM 复核）完成，复核 {checked} 对，剔除 {len(keep) - len(pair_i)} 对，"
+                              f"保留 {len(pair_i)} 对，耗时 {time.perf_counter() - start_time:.2f} 秒")
+            self.progress_signal.emit(75)
+
+        if previous is not None:
+            count = len(nodes)
+            images = (previous.pair_i < count) & (previous.pair_j < count)
+            pair_i = np.concatenate([previous.pair_i[images], pair_i])
+            pair_j = np.concatenate([previous.pair_j[images], pair_j])
+            distances = np.concatenate([previous.distances[images], distances])
+            self.log("DEBUG", f"沿用阈值 {previous.max_threshold} 以内已复核的 {int(images.sum())} 对图片")
+
+        videos = getattr(self.hashes, "videos", None)
+        if videos:
+            # 视频按帧序列距离检索，下标接在图片之后，与图片共用同一张相似图
+            start_time = time.perf_counter()
+            video_i, video_j, video_d = videos.pairs_within(
+                threshold, should_stop=lambda: not self.is_running()
+            )
             if not self.is_running():
-                break
-                
-            if len(group_paths) == 1:
-                continue
-                
-            current_group = []
-            for i in range(len(group_paths)):
-                if not self.is_running():
-                    break
-                    
-                path1 = group_paths[i]
-                hash1 = self.hash_dict[path1]
-                
-                similar_in_group = False
-                for j in range(len(current_group)):
-                    path2 = current_group[j]
-                    hash2 = self.hash_dict[path2]
-                    
-                    try:
-                        distance = ImageHasher.hamming_distance(hash1, hash2)
-                        if distance <= self.similarity_threshold:
-                            similar_in_group = True
-                            break
-                    except Exception:
-                        continue
-                
-                if similar_in_group or not current_group:
-                    current_group.append(path1)
-                else:
-                    final_groups.append(current_group)
-                    current_group = [path1]
-            
-            if current_group and len(current_group) > 1:
-                final_groups.append(current_group)
-            
-            processed_groups += 1
-            self.progress_signal.emit(50 + int(processed_groups / total_groups * 50))
-        
+                return []
+            offset = len(nodes)
+            pair_i = np.concatenate([pair_i, video_i + offset])
+            pair_j = np.concatenate([pair_j, video_j + offset])
+            distances = np.concatenate([distances, video_d])
+            node_of = np.concatenate([node_of, np.arange(offset, offset + len(videos), dtype=np.int64)])
+            image_paths = list(image_paths) + videos.paths
+            self.log("DEBUG", f"视频指纹检索完成，{len(videos)} 个视频中共 {len(video_i)} 对相似，"
+                              f"耗时 {time.perf_counter() - start_time:.2f} 秒")
+
+        graph = SimilarityGraph(image_paths, pair_i, pair_j, distances, threshold, self.linkage, node_of)
+        self.graph_signal.emit(graph)
+        start_time = time.perf_counter()
+        final_groups = graph.groups(threshold)
+        self.log("DEBUG", f"{self.linkage} 聚类完成，耗时 {time.perf_counter() - start_time:.2f} 秒")
+        self.progress_signal.emit(100)
         return final_groups
 
     def stop(self):
@@ -271,4 +752,105 @@ class ContrastWorker(QThread):
     
     def is_running(self):
         with self._stop_lock:
-            return self._is_running
\ No newline at end of file
+            return self._is_running
+
+class SimilarSearchWorker(QThread):
+    """在后台执行以图搜图，首次查询时需要从哈希缓存加载图库索引"""
+    result_signal = pyqtSignal(str, list)
+    log_signal = pyqtSignal(str, str)
+
+    def __init__(self, image_path, k=10, algorithm="dhash", parent=None):
+        super().__init__(parent)
+        self.image_path = image_path
+        self.k = k
+        self.algorithm = algorithm
+        self._is_running = True
+        self._stop_lock = threading.Lock()
+
+    def run(self):
+        try:
+            start_time = time.perf_counter()
+            results = find_similar(self.image_path, self.k, self.algorithm,
+                                   should_stop=lambda: not self.is_running())
+            if not self.is_running():
+                self.log_signal.emit("WARNING", "以图搜图已被用户取消")
+                return
+            self.log_signal.emit("DEBUG", f"以图搜图完成，返回 {len(results)} 张，"
+                                          f"耗时 {(time.perf_counter() - start_time) * 1000:.0f} 毫秒")
+            self.result_signal.emit(self.image_path, results)
+        except Exception as e:
+            self.log_signal.emit("ERROR", f"以图搜图失败: {str(e)}")
+            if self.is_running():
+                self.result_signal.emit(self.image_path, [])
+
+    def stop(self):
+        with self._stop_lock:
+            self._is_running = False
+
+    def is_running(self):
+        with self._stop_lock:
+            return self._is_running
+
+
+class LibraryMatchWorker(QThread):
+    """增量模式：只拿新导入图片的哈希去查询由哈希缓存构建的图库索引，图库本身不再读取或重新分组"""
+    progress_signal = pyqtSignal(int)
+    result_signal = pyqtSignal(list)
+    finished_signal = pyqtSignal()
+    log_signal = pyqtSignal(str, str)
+
+    def __init__(self, hashes, similarity_threshold, exclude_folder=None, hash_size=8, use_embedded=None,
+                 parent=None):
+        super().__init__(parent)
+        self.hashes = hashes
+        self.similarity_threshold = similarity_threshold
+        self.exclude_folder = exclude_folder
+        if use_embedded is None:
+            use_embedded = config_manager.get_setting("hash_use_embedded_thumbnail", False)
+        # 与 HashWorker 写入缓存时使用的键一致
+        self.cache_algo = ImageHasher.cache_algo(hash_size, bool(use_embedded))
+        self._is_running = True
+        self._stop_lock = threading.Lock()
+
+    def log(self, level, message):
+        self.log_signal.emit(level, message)
+
+    def run(self):
+        try:
+            start_time = time.perf_counter()
+            library = get_library_index(self.cache_algo, HASH_ALGORITHMS)
+            algorithm = self.hashes.algorithm or "dhash"
+            self.log("DEBUG", f"图库索引共 {len(library)} 张图片，加载耗时 {time.perf_counter() - start_time:.2f} 秒")
+            self.progress_signal.emit(60)
+
+            start_time = time.perf_counter()
+            query_ids, matched_paths, distances = library.query(
+                self.hashes.codes, self.similarity_threshold, algorithm,
+                exclude_folder=self.exclude_folder, should_stop=lambda: not self.is_running()
+            )
+            if not self.is_running():
+                self.log("WARNING", "增量对比操作已被用户取消")
+                return
+
+            # 每张新图片与它在图库中的匹配组成一组，匹配按距离从近到远排列
+            matches = {}
+            for query_id, path, distance in zip(query_ids.tolist(), matched_paths, distances.tolist()):
+                matches.setdefault(query_id, []).append((distance, path))
+            groups = [[self.hashes.paths[query_id]] + [path for _, path in sorted(found)]
+                      for query_id, found in sorted(matches.items())]
+            self.log("INFO", f"增量对比完成：{len(self.hashes)} 张新图片中有 {len(groups)} 张已在图库中存在相似图片，"
+                             f"查询耗时 {time.perf_counter() - start_time:.2f} 秒")
+            self.progress_signal.emit(100)
+            self.result_signal.emit(groups)
+            self.finished_signal.emit()
+        except Exception as e:
+            self.log("ERROR", f"增量对比过程中发生严重错误: {str(e)}")
+            self.finished_signal.emit()
+
+    def stop(self):
+        with self._stop_lock:
+            self._is_running = False
+
+    def is_running(self):
+        with self._stop_lock:
+            return self._is_running
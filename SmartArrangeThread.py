@@ -16,6 +16,8 @@ from PyQt6 import QtCore
 
 from ReverseGeocoding import get_address_from_coordinates
 from common import get_resource_path
+from config_manager import config_manager
+from io_scheduler import EXIF_PREFETCH_BYTES, READ_ORDERS, Prefetcher, order_for_locality, prefetch_summary
 
 # 配置日志记录
 logger = logging.getLogger(__name__)
@@ -108,6 +110,13 @@ class SmartArrangeThread(QtCore.QThread):
         self.log_signal = parent.log_signal if parent else None
         self.files_to_rename = []
         self.files_lock = threading.Lock()
+        # 机械硬盘、NAS 上按磁盘位置顺序读取同一目录下的文件（"off" 表示保持目录列出的顺序）
+        self.read_order = config_manager.get_setting("io_read_order", "off")
+        if self.read_order not in READ_ORDERS:
+            self.read_order = "off"
+        self.prefetch_depth = config_manager.get_setting("prefetch_depth", 8)
+        self.prefetch_mode = config_manager.get_setting("prefetch_mode", "auto")
+        self._prefetchers = []
 
     def calculate_total_files(self):
         """计算总文件数，增强错误处理"""
@@ -158,6 +167,7 @@ class SmartArrangeThread(QtCore.QThread):
             success_count = 0
             fail_count = 0
             self.processed_files = 0
+            self._prefetchers = []
 
             for folder_info in self.folders:
                 if self._stop_flag:
@@ -200,6 +210,7 @@ class SmartArrangeThread(QtCore.QThread):
 
                 self.log("DEBUG", "="*40)
                 self.log("DEBUG", f"文件整理完成了，成功处理了 {success_count} 个文件，失败了 {fail_count} 个文件")
+                self.log("DEBUG", f"读取 EXIF：{prefetch_summary(self._prefetchers)}")
                 self.log("DEBUG", "="*3+"LeafView © 2025 Yangshengzhou.All Rights Reserved"+"="*3)
                 self.progress_signal.emit(100)
             else:
@@ -213,69 +224,89 @@ class SmartArrangeThread(QtCore.QThread):
         
         if folder_info.get('include_sub', 0):
             for root, _, files in os.walk(folder_path):
-                # 批量处理，每批处理100个文件
-                batch_size = 100
-                for i in range(0, len(files), batch_size):
-                    if self.is_stopped():
-                        self.log("WARNING", "您已经取消了当前文件夹的处理")
-                        return
-                    
-                    batch_files = files[i:i + batch_size]
-                    for file in batch_files:
+                files = self._ordered_files(root, files)
+                with self._exif_prefetcher(root, files) as prefetcher:
+                    # 批量处理，每批处理100个文件
+                    batch_size = 100
+                    for i in range(0, len(files), batch_size):
                         if self.is_stopped():
                             self.log("WARNING", "您已经取消了当前文件夹的处理")
                             return
-                        full_file_path = Path(root) / file
-                        if self.destination_root:
-                            self.process_single_file(full_file_path)
-                        else:
-                            self.process_single_file(full_file_path, base_folder=folder_path)
+                    
+                        batch_files = files[i:i + batch_size]
+                        for position, file in enumerate(batch_files, i):
+                            if self.is_stopped():
+                                self.log("WARNING", "您已经取消了当前文件夹的处理")
+                                return
+                            prefetcher.advance(position)
+                            full_file_path = Path(root) / file
+                            if self.destination_root:
+                                self.process_single_file(full_file_path)
+                            else:
+                                self.process_single_file(full_file_path, base_folder=folder_path)
                         
-                        with self.processed_lock:
-                            self.processed_files += 1
+                            with self.processed_lock:
+                                self.processed_files += 1
                         
-                        if self.total_files > 0:
-                            percent_complete = int((self.processed_files / self.total_files) * 80)
-                            self.progress_signal.emit(percent_complete)
+                            if self.total_files > 0:
+                                percent_complete = int((self.processed_files / self.total_files) * 80)
+                                self.progress_signal.emit(percent_complete)
                     
-                    # 批次之间短暂休息，减少CPU占用
-                    time.sleep(0.01)
+                        # 批次之间短暂休息，减少CPU占用
+                        time.sleep(0.01)
         else:
             # 获取文件列表，分批处理
             try:
                 all_files = [f for f in os.listdir(folder_path) if (folder_path / f).is_file()]
-                batch_size = 100
+                all_files = self._ordered_files(folder_path, all_files)
+                with self._exif_prefetcher(folder_path, all_files) as prefetcher:
+                    batch_size = 100
                 
-                for i in range(0, len(all_files), batch_size):
-                    if self.is_stopped():
-                        self.log("WARNING", "文件夹处理被用户中断")
-                        return
-                    
-                    batch_files = all_files[i:i + batch_size]
-                    for file in batch_files:
+                    for i in range(0, len(all_files), batch_size):
                         if self.is_stopped():
                             self.log("WARNING", "文件夹处理被用户中断")
                             return
-                        full_file_path = folder_path / file
-                        # 如果有目标根路径（复制操作），则不传递base_folder参数
-                        if self.destination_root:
-                            self.process_single_file(full_file_path)
-                        else:
-                            self.process_single_file(full_file_path)
+                    
+                        batch_files = all_files[i:i + batch_size]
+                        for position, file in enumerate(batch_files, i):
+                            if self.is_stopped():
+                                self.log("WARNING", "文件夹处理被用户中断")
+                                return
+                            prefetcher.advance(position)
+                            full_file_path = folder_path / file
+                            # 如果有目标根路径（复制操作），则不传递base_folder参数
+                            if self.destination_root:
+                                self.process_single_file(full_file_path)
+                            else:
+                                self.process_single_file(full_file_path)
                         
-                        with self.processed_lock:
-                            self.processed_files += 1
+                            with self.processed_lock:
+                                self.processed_files += 1
                         
-                        if self.total_files > 0:
-                            percent_complete = int((self.processed_files / self.total_files) * 80)
-                            self.progress_signal.emit(percent_complete)
+                            if self.total_files > 0:
+                                percent_complete = int((self.processed_files / self.total_files) * 80)
+                                self.progress_signal.emit(percent_complete)
                     
-                    # 批次之间短暂休息，减少CPU占用
-                    time.sleep(0.01)
+                        # 批次之间短暂休息，减少CPU占用
+                        time.sleep(0.01)
                     
             except Exception as e:
                 self.log("ERROR", f"处理文件夹时出错: {str(e)}")
 
+    def _exif_prefetcher(self, root, files):
+        """逐个读取 EXIF 时提前把后面几个文件的文件头读入页缓存；统计在整理结束时合并输出一次"""
+        prefetcher = Prefetcher([os.path.join(root, f) for f in files], self.prefetch_depth, self.prefetch_mode,
+                                EXIF_PREFETCH_BYTES)
+        self._prefetchers.append(prefetcher)
+        return prefetcher
+
+    def _ordered_files(self, root, files):
+        """开启读取调度时按磁盘位置排列同一目录下的文件名，逐个读取 EXIF 或复制时磁头顺序移动"""
+        if self.read_order == "off":
+            return files
+        ordered = order_for_locality([os.path.join(root, f) for f in files], self.read_order)
+        return [os.path.basename(path) for path in ordered]
+
     def process_renaming(self):
         file_count = {}
         total_rename_files = len(self.files_to_rename)
@@ -334,7 +365,7 @@ class SmartArrangeThread(QtCore.QThread):
                 self.log("WARNING", "文件提取操作被用户中断")
                 break
             
-            for file in files:
+            for file in self._ordered_files(root, files):
                 if self._stop_flag:
                     self.log("WARNING", "您已经取消了文件提取操作")
                     break
@@ -5,17 +5,22 @@ from PyQt6 import QtWidgets, QtCore, QtGui
 from PyQt6.QtCore import pyqtSignal, QThread, QDateTime
 import os
 import shutil
+import time
 from datetime import datetime
-from PIL import Image
 import pytesseract
 
 from common import get_resource_path, detect_media_type
+from config_manager import config_manager
+from image_decode import open_image_reduced
+from io_scheduler import Prefetcher
 
 
 class TextRecognitionThread(QThread):
     progress_updated = pyqtSignal(int)
     log_updated = pyqtSignal(str, str)
     recognition_complete = pyqtSignal(dict)
+
+    MAX_OCR_SIZE = 3000
     
     def __init__(self, image_paths, lang='chi_sim+eng'):
         super().__init__()
@@ -26,12 +31,18 @@ class TextRecognitionThread(QThread):
     def run(self):
         results = {}
         total = len(self.image_paths)
+        # 识别当前图片时，后台提前把之后几张读入页缓存
+        prefetcher = Prefetcher(self.image_paths, config_manager.get_setting("prefetch_depth", 8),
+                                config_manager.get_setting("prefetch_mode", "auto"))
+        started = time.perf_counter()
         
         for i, image_path in enumerate(self.image_paths):
             if self._stop_requested:
+                prefetcher.close()
                 self.log_updated.emit('INFO', '您取消了文字识别操作')
                 return
                 
+            prefetcher.advance(i)
             try:
                 media_info = detect_media_type(image_path)
                 if not media_info['valid']:
@@ -47,14 +58,17 @@ class TextRecognitionThread(QThread):
             except Exception as e:
                 self.log_updated.emit('ERROR', f'处理 {os.path.basename(image_path)} 时出错了: {str(e)}')
                 
+        prefetcher.close()
+        elapsed = time.perf_counter() - started
+        self.log_updated.emit('DEBUG', f'文字识别 {total} 张用时 {elapsed:.1f} 秒；{prefetcher.summary()}')
         self.recognition_complete.emit(results)
     
     def _recognize_image_text(self, image_path):
         try:
-            with Image.open(image_path) as img:
-                gray_img = img.convert('L')
-                text = pytesseract.image_to_string(gray_img, lang=self.lang)
-                return text.strip()
+            # 超大图片在解码阶段缩小到识别够用的分辨率，普通照片仍按原尺寸识别
+            gray_img, _ = open_image_reduced(image_path, self.MAX_OCR_SIZE, 'L')
+            text = pytesseract.image_to_string(gray_img, lang=self.lang)
+            return text.strip()
         except Exception as e:
             self.log_updated.emit('ERROR', f'识别 {os.path.basename(image_path)} 里的文字失败了: {str(e)}\n\n' 
                              '可能的原因：\n' 
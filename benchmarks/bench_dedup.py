@@ -0,0 +1,274 @@
+"""
+去重全流程基准：在可复现的合成语料上分阶段计时，并按真实分组计算查准率/查全率。
+
+用法:
+    python benchmarks/bench_dedup.py [--scenes 300] [--thresholds 4 8 12] [--backend thread] [--out 目录]
+                                     [--prefetch-depth 8] [--prefetch-mode auto] [--read-order off]
+
+语料由 PIL 在本地生成（同一 --seed 每次完全相同）：每个场景是一张互不相关的原图，
+约一半场景再派生出若干副本——字节相同的拷贝、不同 JPEG 质量的重新编码、缩小、裁边、转为 HEIC。
+依次测量 扫描 → 哈希 → 分组 → 缩略图 各阶段的耗时、张/秒和峰值内存，
+再以“同一场景的图片应在同一组”为标准统计图片对级别的查准率/查全率，以及每种副本的查全率。
+哈希缓存放在临时目录中，每次都是冷缓存；分组阶段使用的配置与界面相同。
+预读与读取顺序参数只在本次运行中覆盖设置，不写入配置文件；哈希阶段的预读效果见 DEBUG 日志。
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pillow_heif
+from PIL import Image
+from PyQt6.QtCore import QSize
+from PyQt6.QtGui import QGuiApplication
+
+from RemoveDuplicationThread import ContrastWorker, HashWorker
+from config_manager import config_manager
+from grid_thumbnails import load_grid_thumbnails
+from hash_cache import hash_cache
+from image_decode import load_qimage_reduced
+from io_scheduler import PREFETCH_MODES, READ_ORDERS
+
+pillow_heif.register_heif_opener()
+
+# 副本种类：名称 → 由原图生成副本的函数
+VARIANTS = {
+    "拷贝": lambda img, src, dst: shutil.copyfile(src, dst),
+    "质量85": lambda img, src, dst: img.save(dst, quality=85),
+    "质量60": lambda img, src, dst: img.save(dst, quality=60),
+    "质量35": lambda img, src, dst: img.save(dst, quality=35),
+    "缩小50%": lambda img, src, dst: img.resize((img.width // 2, img.height // 2),
+                                               Image.Resampling.LANCZOS).save(dst, quality=90),
+    "裁边4%": lambda img, src, dst: img.crop((img.width // 25, img.height // 25,
+                                             img.width - img.width // 25,
+                                             img.height - img.height // 25)).save(dst, quality=90),
+    "HEIC": lambda img, src, dst: img.save(dst, quality=80),
+}
+VARIANT_SUFFIX = {"HEIC": ".heic"}
+
+
+def make_scene(rng, size):
+    """多尺度噪声叠加出的原图：低频决定整体结构，高频提供纹理，场景之间互不相关"""
+    width, height = size
+    canvas = np.zeros((height, width, 3), dtype=np.float32)
+    for cells, weight in ((4, 0.5), (16, 0.3), (64, 0.2)):
+        base = rng.integers(0, 256, size=(cells * 3 // 4 or 1, cells, 3), dtype=np.uint8)
+        layer = Image.fromarray(base).resize(size, Image.Resampling.BICUBIC)
+        canvas += weight * np.asarray(layer, dtype=np.float32)
+    return Image.fromarray(np.clip(canvas, 0, 255).astype(np.uint8))
+
+
+def generate_corpus(folder, scenes, size, dup_ratio, seed):
+    """生成语料，返回 {路径: (场景号, 副本种类)}；原图的种类为 "原图" """
+    rng = np.random.default_rng(seed)
+    truth = {}
+    names = list(VARIANTS)
+    for scene in range(scenes):
+        img = make_scene(rng, size)
+        src = os.path.join(folder, f"scene_{scene:05d}.jpg")
+        img.save(src, quality=92)
+        truth[src] = (scene, "原图")
+        if rng.random() >= dup_ratio:
+            continue
+        for name in rng.choice(names, size=int(rng.integers(1, 4)), replace=False):
+            dst = os.path.join(folder, f"scene_{scene:05d}_{names.index(name)}{VARIANT_SUFFIX.get(name, '.jpg')}")
+            VARIANTS[name](img, src, dst)
+            truth[dst] = (scene, name)
+    return truth
+
+
+def collect_images(folder):
+    extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.heic', '.heif', '.webp', '.tif', '.tiff')
+    return [
+        os.path.join(root, f)
+        for root, _, files in os.walk(folder)
+        for f in files if f.lower().endswith(extensions)
+    ]
+
+
+def peak_rss_mb():
+    """本进程与已结束子进程（进程池后端）的峰值常驻内存，单位 MB"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 2 ** 20, 0.0
+
+    import resource
+    scale = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10  # macOS 单位为字节，Linux 为 KB
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def merge_exact_groups(groups, exact_groups):
+    """与结果页相同：相似组里的代表图片展开为全部副本，没有相似图片的完全重复组单独成组"""
+    copies = {group[0]: group for group in exact_groups}
+    merged, represented = [], set()
+    for group in groups:
+        merged.append([path for representative in group for path in copies.get(representative, [representative])])
+        represented.update(group)
+    merged.extend(group for group in exact_groups if group[0] not in represented)
+    return merged
+
+
+def pair_count(n):
+    return n * (n - 1) // 2
+
+
+def score(groups, truth):
+    """图片对级别的 (查准率, 查全率)，以及每种副本与其原图被分到同一组的比例"""
+    scene_sizes = Counter(scene for scene, _ in truth.values())
+    true_pairs = sum(pair_count(n) for n in scene_sizes.values())
+    predicted_pairs = sum(pair_count(len(group)) for group in groups)
+    hits = sum(pair_count(n) for group in groups
+               for n in Counter(truth[path][0] for path in group if path in truth).values())
+
+    group_of = {path: k for k, group in enumerate(groups) for path in group}
+    originals = {scene: path for path, (scene, kind) in truth.items() if kind == "原图"}
+    found, total = Counter(), Counter()
+    for path, (scene, kind) in truth.items():
+        if kind == "原图":
+            continue
+        total[kind] += 1
+        original = originals[scene]
+        if path in group_of and group_of[path] == group_of.get(original):
+            found[kind] += 1
+    per_kind = {kind: found[kind] / total[kind] for kind in total}
+    precision = hits / predicted_pairs if predicted_pairs else 1.0
+    recall = hits / true_pairs if true_pairs else 1.0
+    return precision, recall, per_kind
+
+
+class StageTimer:
+    def __init__(self):
+        self.rows = []
+
+    def run(self, name, count, func):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        own, children = peak_rss_mb()
+        self.rows.append((name, count, elapsed, own, children))
+        return result
+
+    def report(self):
+        print(f"{'阶段':<8}{'图片数':>8}{'耗时(s)':>10}{'张/秒':>10}{'峰值内存(MB)':>14}{'子进程(MB)':>12}")
+        for name, count, elapsed, own, children in self.rows:
+            rate = count / elapsed if elapsed else 0.0
+            print(f"{name:<8}{count:>8}{elapsed:>10.2f}{rate:>10.1f}{own:>14.1f}{children:>12.1f}")
+
+
+def run_hashing(paths, backend, workers):
+    worker = HashWorker(paths, max_workers=workers, backend=backend)
+    result = {"exact": [], "hashes": None, "streamed": 0}
+    worker.exact_groups_found.connect(lambda groups: result.update(exact=groups))
+    worker.hash_completed.connect(lambda hashes: result.update(hashes=hashes))
+    worker.groups_streamed.connect(lambda batch: result.update(streamed=result["streamed"] + len(batch)))
+    worker.error_occurred.connect(lambda message: print(f"哈希出错: {message}"))
+    worker.log_signal.connect(lambda level, message: print(f"  [{level}] {message}") if level == "DEBUG" else None)
+    worker.run()
+    return result
+
+
+def run_grouping(hashes, threshold, algorithm):
+    worker = ContrastWorker(hashes.with_algorithm(algorithm), threshold)
+    result = []
+    worker.result_signal.connect(result.extend)
+    worker.run()
+    return result
+
+
+def load_thumbnails(paths, tile):
+    """结果页的缩略图：优先取哈希时写入缓存的网格缩略图，缓存中没有的再解码原图"""
+    stored = load_grid_thumbnails(paths)
+    for path in paths:
+        if path not in stored:
+            load_qimage_reduced(path, tile)
+    return len(stored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="去重全流程基准")
+    parser.add_argument("--scenes", type=int, default=300, help="互不相关的原图数量")
+    parser.add_argument("--size", type=int, nargs=2, default=(2000, 1500), metavar=("宽", "高"))
+    parser.add_argument("--dup-ratio", type=float, default=0.5, help="派生副本的场景比例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[4, 8, 12], help="汉明距离阈值")
+    parser.add_argument("--algorithm", default="dhash")
+    parser.add_argument("--backend", default="thread", choices=["thread", "process"])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", help="语料保存目录（保留以便复查），默认使用临时目录")
+    parser.add_argument("--prefetch-depth", type=int, default=None, help="预读深度，0 表示关闭")
+    parser.add_argument("--prefetch-mode", choices=PREFETCH_MODES, default=None)
+    parser.add_argument("--read-order", choices=READ_ORDERS, default=None)
+    args = parser.parse_args()
+
+    for key, value in (("prefetch_depth", args.prefetch_depth), ("prefetch_mode", args.prefetch_mode),
+                       ("io_read_order", args.read_order)):
+        if value is not None:
+            config_manager.config["settings"][key] = value
+
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = args.out or os.path.join(tmp, "corpus")
+        os.makedirs(folder, exist_ok=True)
+        # 每次都从冷缓存开始，也不污染正式的哈希缓存
+        hash_cache.db_file = Path(tmp) / "hash_cache.db"
+
+        print(f"正在生成 {args.scenes} 个场景的合成语料...")
+        truth = generate_corpus(folder, args.scenes, tuple(args.size), args.dup_ratio, args.seed)
+        kinds = Counter(kind for _, kind in truth.values())
+        print(f"图片数量: {len(truth)}（" + "，".join(f"{kind} {n}" for kind, n in kinds.items()) + "）")
+
+        timer = StageTimer()
+        paths = timer.run("扫描", len(truth), lambda: collect_images(folder))
+        hashed = timer.run("哈希", len(paths), lambda: run_hashing(paths, args.backend, args.workers))
+        if hashed["hashes"] is None:
+            print("哈希阶段没有结果")
+            return
+
+        scores = []
+        for threshold in args.thresholds:
+            groups = timer.run(f"分组@{threshold}", len(hashed["hashes"]),
+                               lambda: run_grouping(hashed["hashes"], threshold, args.algorithm))
+            groups = merge_exact_groups(groups, hashed["exact"])
+            scores.append((threshold, len(groups), *score(groups, truth)))
+
+        grouped = sorted({path for group in groups for path in group})
+        stored = timer.run("缩略图", len(grouped), lambda: load_thumbnails(grouped, QSize(95, 95)))
+        hash_cache.close()
+
+        print()
+        timer.report()
+        print(f"\n缩略图: {stored}/{len(grouped)} 张直接取自哈希阶段写入的缓存；"
+              f"哈希期间流式发出 {hashed['streamed']} 批分组")
+        print()
+        names = [name for name in VARIANTS if name in kinds]
+        print(f"{'阈值':>4}{'组数':>6}{'查准率':>8}{'查全率':>8}" + "".join(f"{name:>9}" for name in names))
+        for threshold, count, precision, recall, per_kind in scores:
+            print(f"{threshold:>4}{count:>6}{precision:>8.3f}{recall:>8.3f}"
+                  + "".join(f"{per_kind.get(name, 0.0):>9.2f}" for name in names))
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+内嵌缩略图快速路径基准：比较哈希和 95px 缩略图在整图（缩小）解码与内嵌缩略图两种方式下的速度。
+
+用法:
+    python benchmarks/bench_embedded_thumbnail.py [图片文件夹] [--count 100]
+
+未指定文件夹时会生成一批带 320px 缩略图条目的 12MP HEIC（以 HEIC 为主），
+外加少量带 EXIF 缩略图的 JPEG。
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import piexif
+import pillow_heif
+from PIL import Image
+from PyQt6.QtCore import QSize
+from PyQt6.QtGui import QGuiApplication
+
+from RemoveDuplicationThread import ImageHasher
+from embedded_thumbnail import open_embedded_thumbnail
+from image_decode import load_qimage_reduced
+
+pillow_heif.register_heif_opener()
+
+
+def generate_corpus(folder, count, size=(4032, 3024)):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        base = rng.integers(0, 256, size=(30, 40, 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize(size, Image.Resampling.BICUBIC)
+        if i % 5 == 4:
+            thumb = img.copy()
+            thumb.thumbnail((160, 160))
+            buffer = io.BytesIO()
+            thumb.save(buffer, "JPEG")
+            exif = piexif.dump({"0th": {}, "1st": {piexif.ImageIFD.Compression: 6},
+                                "thumbnail": buffer.getvalue()})
+            path = os.path.join(folder, f"synthetic_{i:05d}.jpg")
+            img.save(path, quality=90, exif=exif)
+        else:
+            path = os.path.join(folder, f"synthetic_{i:05d}.heic")
+            img.save(path, quality=80, thumbnails=[320])
+        paths.append(path)
+    return paths
+
+
+def collect_images(folder):
+    extensions = ('.jpg', '.jpeg', '.heic', '.heif')
+    return [
+        os.path.join(root, f)
+        for root, _, files in os.walk(folder)
+        for f in files if f.lower().endswith(extensions)
+    ]
+
+
+def timed(func, paths):
+    start = time.perf_counter()
+    for path in paths:
+        try:
+            func(path)
+        except Exception:
+            pass  # 损坏的文件计入耗时但不中断测试
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内嵌缩略图快速路径基准")
+    parser.add_argument("folder", nargs="?", help="图片文件夹，不指定则生成合成图片")
+    parser.add_argument("--count", type=int, default=100, help="合成图片数量")
+    args = parser.parse_args()
+
+    app = QGuiApplication.instance() or QGuiApplication(sys.argv)
+    tile = QSize(95, 95)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.folder:
+            paths = collect_images(args.folder)
+        else:
+            print(f"正在生成 {args.count} 张合成图片...")
+            paths = generate_corpus(tmp, args.count)
+
+        usable = sum(open_embedded_thumbnail(p, (95, 95)) is not None for p in paths)
+        print(f"图片数量: {len(paths)}，内嵌缩略图可用: {usable}")
+
+        cases = [
+            ("dhash", lambda p: ImageHasher.dhash(p), lambda p: ImageHasher.dhash(p, use_embedded=True)),
+            ("95px 缩略图", lambda p: load_qimage_reduced(p, tile), lambda p: load_qimage_reduced(p, tile, True)),
+        ]
+        print(f"{'场景':<12}{'缩小解码(s)':>12}{'内嵌缩略图(s)':>14}{'加速比':>8}")
+        for name, decode, embedded in cases:
+            slow = timed(decode, paths)
+            fast = timed(embedded, paths)
+            print(f"{name:<12}{slow:>12.2f}{fast:>14.2f}{slow / fast if fast else 0:>8.1f}")
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+哈希后端吞吐量基准：比较线程池与进程池在不同工作单元数下的哈希速度。
+
+用法:
+    python benchmarks/bench_hash_backend.py [图片文件夹] [--workers 1 2 4 8] [--count 400]
+
+未指定文件夹时会在临时目录里生成一批 24MP 的合成 JPEG。
+每种组合都关闭哈希缓存，测的是纯计算吞吐量。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from RemoveDuplicationThread import HashWorker
+
+
+def generate_corpus(folder, count, size=(6000, 4000)):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        base = rng.integers(0, 256, size=(30, 40, 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize(size, Image.Resampling.BICUBIC)
+        path = os.path.join(folder, f"synthetic_{i:05d}.jpg")
+        img.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def collect_images(folder):
+    extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.heic', '.heif', '.webp', '.tif', '.tiff')
+    return [
+        os.path.join(root, f)
+        for root, _, files in os.walk(folder)
+        for f in files if f.lower().endswith(extensions)
+    ]
+
+
+def run_once(paths, backend, workers):
+    worker = HashWorker(paths, max_workers=workers, use_cache=False, backend=backend)
+    result = {}
+    worker.hash_completed.connect(lambda hashes: result.update(count=len(hashes)))
+    start = time.perf_counter()
+    worker.run()
+    elapsed = time.perf_counter() - start
+    return result.get('count', 0), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="哈希后端吞吐量基准")
+    parser.add_argument("folder", nargs="?", help="图片文件夹，不指定则生成合成图片")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, 8, os.cpu_count() or 1}))
+    parser.add_argument("--count", type=int, default=200, help="合成图片数量")
+    parser.add_argument("--backends", nargs="+", default=["thread", "process"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.folder:
+            paths = collect_images(args.folder)
+        else:
+            print(f"正在生成 {args.count} 张合成图片...")
+            paths = generate_corpus(tmp, args.count)
+
+        print(f"图片数量: {len(paths)}，CPU 核心数: {os.cpu_count()}")
+        print(f"{'后端':<10}{'工作单元':>8}{'耗时(s)':>10}{'张/秒':>10}{'加速比':>8}")
+        for backend in args.backends:
+            baseline = None
+            for workers in args.workers:
+                hashed, elapsed = run_once(paths, backend, workers)
+                rate = hashed / elapsed if elapsed else 0.0
+                baseline = baseline or rate
+                print(f"{backend:<10}{workers:>8}{elapsed:>10.2f}{rate:>10.1f}{rate / baseline:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
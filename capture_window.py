@@ -0,0 +1,144 @@
+import calendar
+import datetime
+import io
+import os
+import struct
+
+import exifread
+import numpy as np
+import pillow_heif
+
+from hamming_index import MultiIndexHashing, popcount64
+
+# 缓存中的算法名，拍摄信息与哈希共用同一张缓存表
+CAPTURE_CACHE_ALGO = "capture1"
+
+_EXIF_EXTENSIONS = (
+    '.jpg', '.jpeg', '.tif', '.tiff', '.arw', '.cr2', '.nef', '.dng',
+    '.orf', '.sr2', '.rw2', '.pef', '.nrw', '.srw'
+)
+
+
+def _parse_exif_timestamp(tags):
+    """DateTimeOriginal（带亚秒）转为秒数；只用于比较先后，按 UTC 换算避免夏令时跳变"""
+    value = str(tags.get('EXIF DateTimeOriginal', '')).strip()
+    if not value or value == 'None':
+        return None
+    try:
+        taken = datetime.datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    timestamp = float(calendar.timegm(taken.timetuple()))
+    subsec = str(tags.get('EXIF SubSecTimeOriginal', '')).strip()
+    if subsec.isdigit():
+        timestamp += float(f"0.{subsec}")
+    return timestamp
+
+
+def read_capture_info(path):
+    """
+    读取拍摄时间和相机型号，返回 (时间戳或 None, "品牌 型号")。
+    与 SmartArrangeThread 使用相同的 exifread 标签；HEIC 只读取元数据，不解码图像。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext in ('.heic', '.heif'):
+            exif = pillow_heif.open_heif(path).info.get('exif') or b''
+            if exif.startswith(b'Exif\x00\x00'):
+                exif = exif[6:]
+            if not exif:
+                return None, ''
+            tags = exifread.process_file(io.BytesIO(exif), details=False)
+        elif ext in _EXIF_EXTENSIONS:
+            with open(path, 'rb') as f:
+                tags = exifread.process_file(f, details=False)
+        else:
+            return None, ''
+    except Exception:
+        return None, ''
+
+    make = str(tags.get('Image Make', '')).strip().strip('"\'')
+    model = str(tags.get('Image Model', '')).strip().strip('"\'')
+    return _parse_exif_timestamp(tags), f"{make} {model}".strip()
+
+
+def capture_to_blob(timestamp, camera):
+    """编码为缓存记录；没有拍摄时间时为空字节"""
+    if timestamp is None:
+        return b''
+    return struct.pack('>d', timestamp) + camera.encode('utf-8')
+
+
+def blob_to_capture(blob):
+    if len(blob) < 8:
+        return None, ''
+    return struct.unpack('>d', blob[:8])[0], blob[8:].decode('utf-8', errors='replace')
+
+
+def _merge_pairs(n, parts):
+    parts = [part for part in parts if len(part[0])]
+    if not parts:
+        return (np.zeros(0, dtype=np.int64),) * 3
+    pair_i = np.concatenate([part[0] for part in parts])
+    pair_j = np.concatenate([part[1] for part in parts])
+    distances = np.concatenate([part[2] for part in parts])
+    _, unique = np.unique(pair_i * n + pair_j, return_index=True)
+    return pair_i[unique], pair_j[unique], distances[unique]
+
+
+def _window_pairs(nodes, node_of, order, times, radius, window):
+    """order 为同一相机按时间排好序的图片下标，逐个偏移量比较时间窗口内的图片，结果映射为节点对"""
+    found = []
+    sorted_times = times[order]
+    for offset in range(1, len(order)):
+        close = np.flatnonzero(sorted_times[offset:] - sorted_times[:-offset] <= window)
+        if not len(close):
+            break
+        left, right = node_of[order[close]], node_of[order[close + offset]]
+        distances = popcount64(nodes[left] ^ nodes[right])
+        # 同一节点的图片本来就同组，不必记录
+        keep = (distances <= radius) & (left != right)
+        found.append((np.minimum(left, right)[keep], np.maximum(left, right)[keep], distances[keep]))
+    return found
+
+
+def windowed_pairs(nodes, node_of, taken_at, cameras, radius, window_seconds, global_radius, should_stop=None):
+    """
+    按拍摄时间窗口剪枝的候选对检索。nodes、node_of 由 collapse_identical 得到，
+    taken_at、cameras 按图片给出；返回节点对 (i, j, 距离)，i < j，按 (i, j) 排序：
+    - 同一相机、拍摄时间相差不超过 window_seconds 的图片之间按 radius 比较；
+    - 没有拍摄时间的图片之间仍按 radius 全量检索；
+    - 其余跨窗口的图片对只保留距离不超过 global_radius 的（完全相同或极其接近）。
+    """
+    nodes = np.ascontiguousarray(nodes, dtype=np.uint64)
+    node_of = np.asarray(node_of, dtype=np.int64)
+    taken_at = np.asarray(taken_at, dtype=np.float64)
+    empty = (np.zeros(0, dtype=np.int64),) * 3
+    parts = []
+
+    global_radius = min(global_radius, radius)
+    parts.append(MultiIndexHashing(nodes).pairs_within(global_radius, should_stop))
+
+    known = ~np.isnan(taken_at)
+    unknown = np.unique(node_of[~known])
+    if len(unknown) > 1 and radius > global_radius:
+        sub_i, sub_j, sub_d = MultiIndexHashing(nodes[unknown]).pairs_within(radius, should_stop)
+        parts.append((unknown[sub_i], unknown[sub_j], sub_d))
+
+    if radius > global_radius:
+        by_camera = {}
+        for index in np.flatnonzero(known).tolist():
+            by_camera.setdefault(cameras[index], []).append(index)
+        for members in by_camera.values():
+            if should_stop and should_stop():
+                return empty
+            members = np.asarray(members, dtype=np.int64)
+            order = members[np.lexsort((node_of[members], taken_at[members]))]
+            # 同一节点、同一时刻的图片（例如复制出的多份）只保留一张参与比较
+            distinct = np.r_[True, (np.diff(taken_at[order]) != 0) | (np.diff(node_of[order]) != 0)]
+            parts.extend(_window_pairs(nodes, node_of, order[distinct], taken_at, radius, window_seconds))
+
+    if should_stop and should_stop():
+        return empty
+    pair_i, pair_j, distances = _merge_pairs(len(nodes), parts)
+    return pair_i, pair_j, distances
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from hash_cache import hash_cache, file_signature
+from image_decode import open_image_reduced
+
+# 第二阶段使用的灰度缩略图边长
+THUMB_SIZE = 64
+# SSIM 的局部窗口边长（不重叠的方块）与常数（按 8 位灰度）
+_BLOCK = 8
+_C1 = (0.01 * 255) ** 2
+_C2 = (0.03 * 255) ** 2
+# 每批计算的图片对数量，限制临时内存
+_PAIR_CHUNK = 256
+
+
+def gray_thumbnail_algo(size=THUMB_SIZE):
+    return f"gray{size}v1"
+
+
+def gray_thumbnail(img, size=THUMB_SIZE):
+    """由已解码的灰度图生成 size×size 的灰度缩略图（与哈希一样不保持宽高比）"""
+    return np.asarray(img.resize((size, size), Image.Resampling.BILINEAR), dtype=np.uint8)
+
+
+def make_gray_thumbnail(path, size=THUMB_SIZE):
+    """缓存中没有哈希时顺带生成的缩略图时，单独解码生成，失败时返回 None"""
+    try:
+        img, _ = open_image_reduced(path, (size, size), 'L')
+        return gray_thumbnail(img, size)
+    except Exception:
+        return None
+
+
+def load_gray_thumbnails(paths, size=THUMB_SIZE, use_cache=True, max_workers=4, should_stop=None):
+    """读取一批图片的灰度缩略图，优先使用缓存；返回 {路径: uint8 数组}，失败的图片不在结果中"""
+    algo = gray_thumbnail_algo(size)
+    signatures = {}
+    for path in paths:
+        signature = file_signature(path)
+        if signature is not None:
+            signatures[path] = signature
+    cached = hash_cache.get_many(signatures, algo) if use_cache else {}
+    thumbs = {
+        path: np.frombuffer(blob, dtype=np.uint8).reshape(size, size)
+        for path, blob in cached.items() if len(blob) == size * size
+    }
+    missing = [path for path in signatures if path not in cached]
+
+    computed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for path, thumb in zip(missing, executor.map(make_gray_thumbnail, missing, [size] * len(missing))):
+            if should_stop and should_stop():
+                break
+            if thumb is not None:
+                thumbs[path] = thumb
+            computed.append((path, *signatures[path], thumb.tobytes() if thumb is not None else b''))
+    if use_cache:
+        hash_cache.put_many(computed, algo)
+    return thumbs
+
+
+def _block_mean(images):
+    """(批, 高, 宽) 数组按 _BLOCK×_BLOCK 不重叠方块求均值"""
+    count, height, width = images.shape
+    blocks = images.reshape(count, height // _BLOCK, _BLOCK, width // _BLOCK, _BLOCK)
+    return np.einsum('pajbk->pab', blocks) * (1.0 / (_BLOCK * _BLOCK))
+
+
+def ssim_pairs(thumbs, pair_i, pair_j):
+    """
+    对一组缩略图（N×H×W）上的图片对计算平均 SSIM，局部窗口取 8×8 不重叠方块。
+    每张图的局部均值和方差只算一次，逐对只需计算协方差。
+    """
+    # 以 128 为中心的 float32：SSIM 的协方差与平移无关，数值范围小，精度足够且速度更快
+    thumbs = np.asarray(thumbs, dtype=np.float32) - 128.0
+    mu = _block_mean(thumbs)
+    variance = _block_mean(thumbs * thumbs) - mu * mu
+    brightness = mu + 128.0
+    scores = np.empty(len(pair_i), dtype=np.float64)
+    for start in range(0, len(pair_i), _PAIR_CHUNK):
+        left = pair_i[start:start + _PAIR_CHUNK]
+        right = pair_j[start:start + _PAIR_CHUNK]
+        mu_x, mu_y = brightness[left], brightness[right]
+        covariance = _block_mean(thumbs[left] * thumbs[right]) - mu[left] * mu[right]
+        numerator = (2 * mu_x * mu_y + _C1) * (2 * covariance + _C2)
+        denominator = (mu_x * mu_x + mu_y * mu_y + _C1) * (variance[left] + variance[right] + _C2)
+        scores[start:start + _PAIR_CHUNK] = (numerator / denominator).mean(axis=(1, 2))
+    return scores
+
+
+def verify_pairs(paths, pair_i, pair_j, distances, trust_distance, min_ssim,
+                 use_cache=True, max_workers=4, should_stop=None):
+    """
+    第二阶段校验：哈希距离不超过 trust_distance 的图片对直接保留，
+    其余图片对用 64px 灰度缩略图的 SSIM 复核，低于 min_ssim 的剔除。
+    返回 (保留掩码, 复核的对数)。缩略图无法生成的图片对保留，交给用户判断。
+    """
+    keep = np.ones(len(pair_i), dtype=bool)
+    check = np.flatnonzero(np.asarray(distances) > trust_distance)
+    if not len(check):
+        return keep, 0
+
+    involved = np.union1d(pair_i[check], pair_j[check])
+    thumbs = load_gray_thumbnails([paths[k] for k in involved], use_cache=use_cache,
+                                  max_workers=max_workers, should_stop=should_stop)
+    if should_stop and should_stop():
+        return keep, 0
+    available = np.array([paths[k] in thumbs for k in involved], dtype=bool)
+    involved = involved[available]
+    if not len(involved):
+        return keep, 0
+
+    slot = np.full(len(paths), -1, dtype=np.int64)
+    slot[involved] = np.arange(len(involved))
+    left, right = slot[pair_i[check]], slot[pair_j[check]]
+    usable = (left >= 0) & (right >= 0)
+    stack = np.stack([thumbs[paths[k]] for k in involved])
+    scores = ssim_pairs(stack, left[usable], right[usable])
+    keep[check[usable]] = scores >= min_ssim
+    return keep, int(usable.sum())
@@ -0,0 +1,231 @@
+from collections import defaultdict
+
+import numpy as np
+
+LINKAGES = ('single', 'complete')
+
+
+class UnionFind:
+    """并查集（路径压缩），合并时总以较小下标为根，结果与合并顺序无关"""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if root_b < root_a:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        return root_a
+
+    def labels(self):
+        return np.fromiter((self.find(x) for x in range(len(self.parent))), dtype=np.int64, count=len(self.parent))
+
+
+def connected_components(n, pair_i, pair_j):
+    """
+    向量化求连通分量：反复把每条边两端的标签挂到较小的一端，再做指针跳跃压缩，
+    返回每个节点所在分量的最小下标。
+    """
+    labels = np.arange(n, dtype=np.int64)
+    pair_i = np.asarray(pair_i, dtype=np.int64)
+    pair_j = np.asarray(pair_j, dtype=np.int64)
+    while len(pair_i):
+        li, lj = labels[pair_i], labels[pair_j]
+        changed = li != lj
+        if not changed.any():
+            break
+        pair_i, pair_j = pair_i[changed], pair_j[changed]
+        li, lj = li[changed], lj[changed]
+        np.minimum.at(labels, np.maximum(li, lj), np.minimum(li, lj))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+    return labels
+
+
+def labels_to_groups(labels, min_size=2):
+    """把分量标签转为下标分组：只保留不少于 min_size 个成员的分量，组内和组间都按下标排序"""
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    groups = [order[s:e].tolist() for s, e in zip(starts, ends) if e - s >= min_size]
+    groups.sort(key=lambda group: group[0])
+    return groups
+
+
+def complete_link_groups(n, pair_i, pair_j, distances):
+    """
+    全连接聚类：按 (距离, i, j) 从小到大处理每条边，只有两组之间所有图片两两都有边时才合并，
+    保证组内任意两张图片都在阈值以内。处理顺序固定，结果可复现。
+    本身就是完全图的连通分量（重复图片最常见的情况）直接成组，只有其余分量逐边处理。
+    """
+    pair_i = np.asarray(pair_i, dtype=np.int64)
+    pair_j = np.asarray(pair_j, dtype=np.int64)
+    distances = np.asarray(distances, dtype=np.int64)
+    low, high = np.minimum(pair_i, pair_j), np.maximum(pair_i, pair_j)
+    _, unique = np.unique(low * n + high, return_index=True)
+    low, high, distances = low[unique], high[unique], distances[unique]
+
+    labels = connected_components(n, low, high)
+    sizes = np.bincount(labels, minlength=n)
+    edge_counts = np.bincount(labels[low], minlength=n)
+    component = labels[low]
+    clique = edge_counts[component] == sizes[component] * (sizes[component] - 1) // 2
+    pending = ~clique
+    if not pending.any():
+        return labels
+
+    low, high, distances = low[pending], high[pending], distances[pending]
+    labels[np.union1d(low, high)] = np.union1d(low, high)
+    order = np.lexsort((high, low, distances))
+    low, high = low[order].tolist(), high[order].tolist()
+    neighbours = defaultdict(set)
+    for i, j in zip(low, high):
+        neighbours[i].add(j)
+        neighbours[j].add(i)
+
+    union_find = UnionFind(n)
+    members = {}
+    for i, j in zip(low, high):
+        root_i, root_j = union_find.find(i), union_find.find(j)
+        if root_i == root_j:
+            continue
+        group_i, group_j = members.get(root_i, [root_i]), members.get(root_j, [root_j])
+        if all(neighbours[a].issuperset(group_j) for a in group_i):
+            root = union_find.union(root_i, root_j)
+            members.pop(root_i, None)
+            members.pop(root_j, None)
+            members[root] = group_i + group_j
+
+    for root, group in members.items():
+        labels[group] = root
+    return labels
+
+
+def cluster_labels(n, pair_i, pair_j, distances=None, linkage='single'):
+    """由候选图片对聚类，返回每个节点所在组的标签（组内最小下标）"""
+    if linkage not in LINKAGES:
+        raise ValueError(f"不支持的聚类方式: {linkage}")
+    if linkage == 'complete':
+        if distances is None:
+            distances = np.zeros(len(pair_i), dtype=np.int64)
+        return complete_link_groups(n, pair_i, pair_j, distances)
+    return connected_components(n, pair_i, pair_j)
+
+
+def cluster_pairs(n, pair_i, pair_j, distances=None, linkage='single', min_size=2):
+    """
+    由候选图片对聚类，返回下标分组列表（组内、组间均按下标排序）。
+    single：传递闭包，A~B、B~C 则三者同组（向量化连通分量，百万级图片对不到一秒）；
+    complete：组内任意两张都必须是候选对。
+    """
+    return labels_to_groups(cluster_labels(n, pair_i, pair_j, distances, linkage), min_size)
+
+
+class SimilarityGraph:
+    """
+    保存一次检索得到的稀疏相似图：所有距离不超过 max_threshold 的图片对。
+    阈值在 max_threshold 以内变化时，只需按距离筛边再重新聚类，无需重新检索。
+    node_of 把图片映射到节点（哈希完全相同的图片共用一个节点），此时图片对记录的是节点下标；
+    同一节点的图片在任何阈值下都同组，不必为它们保存两两的边。
+    """
+
+    def __init__(self, paths, pair_i, pair_j, distances, max_threshold, linkage='single', node_of=None):
+        self.paths = list(paths)
+        self.node_of = (np.arange(len(self.paths), dtype=np.int64) if node_of is None
+                        else np.asarray(node_of, dtype=np.int64))
+        self.num_nodes = int(self.node_of.max()) + 1 if len(self.node_of) else 0
+        self.pair_i = np.asarray(pair_i, dtype=np.int64)
+        self.pair_j = np.asarray(pair_j, dtype=np.int64)
+        self.distances = np.asarray(distances, dtype=np.int64)
+        self.max_threshold = max_threshold
+        self.linkage = linkage
+
+    def __len__(self):
+        return len(self.pair_i)
+
+    def covers(self, threshold):
+        return threshold <= self.max_threshold
+
+    def groups(self, threshold, linkage=None):
+        """返回阈值 threshold 下的相似组（路径列表的列表），默认沿用构造时的聚类方式"""
+        if not self.covers(threshold):
+            raise ValueError(f"阈值 {threshold} 超出了相似图的范围 {self.max_threshold}")
+        keep = self.distances <= threshold
+        labels = cluster_labels(self.num_nodes, self.pair_i[keep], self.pair_j[keep],
+                                self.distances[keep], linkage or self.linkage)
+        groups = labels_to_groups(labels[self.node_of])
+        return [[self.paths[k] for k in group] for group in groups]
+
+
+class StreamingGroups:
+    """
+    哈希计算过程中逐步确认的重复组：字节完全相同的文件，以及哈希完全相同（距离为 0）的图片。
+    这些关系在任何阈值、任何聚类方式下都成立，最终分组只会在此基础上继续合并，不会被拆开，
+    因此可以在全部哈希算完之前先交给界面显示。
+    """
+
+    def __init__(self, exact_groups=()):
+        self._next_id = 0
+        self.members = {}
+        self.group_of = {}
+        self._first_by_code = {}
+        self._changed = set()
+        self._absorbed = defaultdict(list)
+        for group in exact_groups:
+            self._new_group(list(group))
+
+    def _new_group(self, paths):
+        group_id = self._next_id
+        self._next_id += 1
+        self.members[group_id] = paths
+        for path in paths:
+            self.group_of[path] = group_id
+        self._changed.add(group_id)
+        return group_id
+
+    def add(self, path, code):
+        """加入一张刚算出哈希的图片，与之前哈希相同的图片归入同一组"""
+        first = self._first_by_code.setdefault(code, path)
+        if first == path:
+            return
+        group_a, group_b = self.group_of.get(first), self.group_of.get(path)
+        if group_a is None and group_b is None:
+            self._new_group([first, path])
+        elif group_a is None:
+            self._join(group_b, [first])
+        elif group_b is None:
+            self._join(group_a, [path])
+        elif group_a != group_b:
+            # 保留较早出现的组，另一组并入其中
+            keep, drop = min(group_a, group_b), max(group_a, group_b)
+            self._join(keep, self.members.pop(drop))
+            self._absorbed[keep].extend([drop, *self._absorbed.pop(drop, [])])
+            self._changed.discard(drop)
+
+    def _join(self, group_id, paths):
+        self.members[group_id].extend(paths)
+        for path in paths:
+            self.group_of[path] = group_id
+        self._changed.add(group_id)
+
+    def flush(self):
+        """返回自上次调用以来有变化的组：[(组号, 成员列表, 被并入的组号列表)]"""
+        batch = [(group_id, list(self.members[group_id]), self._absorbed.pop(group_id, []))
+                 for group_id in sorted(self._changed)]
+        self._changed.clear()
+        return batch
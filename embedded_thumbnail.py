@@ -0,0 +1,336 @@
+import io
+import os
+import struct
+
+import pillow_heif
+from PIL import Image
+
+# JPEG 的 APP1 段最大 64KB，EXIF 缩略图一定在文件开头这段范围内
+_JPEG_HEAD_BYTES = 128 * 1024
+# HEIF 的 meta 盒子一般只有几 KB，超过该大小视为异常文件不再解析
+_HEIF_MAX_META = 4 * 1024 * 1024
+# 缩略图与原图宽高比的允许误差，超出时通常是带黑边的缩略图，不能代替原图
+_ASPECT_TOLERANCE = 0.03
+
+
+def _covers(thumb_size, original_size, box):
+    """缩略图是否足够大：原图按比例缩放到 box 内后，缩略图不小于该尺寸且宽高比一致"""
+    tw, th = thumb_size
+    ow, oh = original_size
+    if not (tw and th and ow and oh):
+        return False
+    if abs(tw / th - ow / oh) > _ASPECT_TOLERANCE * (ow / oh):
+        return False
+    scale = min(box[0] / ow, box[1] / oh, 1.0)
+    return tw + 1 >= ow * scale and th + 1 >= oh * scale
+
+
+# ---------------------------------------------------------------- JPEG / EXIF IFD1
+
+def read_exif_thumbnail(path):
+    """读取 JPEG 的 EXIF IFD1 缩略图字节，没有时返回 None"""
+    with open(path, 'rb') as f:
+        head = f.read(_JPEG_HEAD_BYTES)
+    if head[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 4 <= len(head) and head[pos] == 0xFF:
+        marker = head[pos + 1]
+        if marker in (0xD9, 0xDA):  # 图像结束或扫描数据开始，后面不会再有 APP 段
+            return None
+        length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        segment = head[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and segment[:6] == b'Exif\x00\x00':
+            return _thumbnail_from_tiff(segment[6:])
+        pos += 2 + length
+    return None
+
+
+def _thumbnail_from_tiff(tiff):
+    if len(tiff) < 8:
+        return None
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None:
+        return None
+    ifd0 = struct.unpack(endian + 'I', tiff[4:8])[0]
+    if ifd0 + 2 > len(tiff):
+        return None
+    count = struct.unpack(endian + 'H', tiff[ifd0:ifd0 + 2])[0]
+    next_pos = ifd0 + 2 + count * 12
+    if next_pos + 4 > len(tiff):
+        return None
+    ifd1 = struct.unpack(endian + 'I', tiff[next_pos:next_pos + 4])[0]
+    if not ifd1 or ifd1 + 2 > len(tiff):
+        return None
+
+    offset = length = None
+    count = struct.unpack(endian + 'H', tiff[ifd1:ifd1 + 2])[0]
+    for k in range(count):
+        entry = tiff[ifd1 + 2 + k * 12:ifd1 + 14 + k * 12]
+        if len(entry) < 12:
+            break
+        tag = struct.unpack(endian + 'H', entry[:2])[0]
+        if tag == 0x0201:
+            offset = struct.unpack(endian + 'I', entry[8:12])[0]
+        elif tag == 0x0202:
+            length = struct.unpack(endian + 'I', entry[8:12])[0]
+    if offset is None or not length or offset + length > len(tiff):
+        return None
+    data = tiff[offset:offset + length]
+    return data if data[:2] == b'\xff\xd8' else None
+
+
+def _open_jpeg_thumbnail(path, box):
+    data = read_exif_thumbnail(path)
+    if data is None:
+        return None
+    with Image.open(path) as original:
+        original_size = original.size
+    thumb = Image.open(io.BytesIO(data))
+    if not _covers(thumb.size, original_size, box):
+        return None
+    thumb.load()
+    return thumb, original_size
+
+
+# ---------------------------------------------------------------- HEIF 缩略图条目
+
+def _iter_boxes(data, start, end):
+    """遍历 [start, end) 范围内的 ISOBMFF 盒子，产出 (类型, 内容起点, 盒子终点)"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _read_uint(data, pos, size):
+    if size == 0:
+        return 0, pos
+    return int.from_bytes(data[pos:pos + size], 'big'), pos + size
+
+
+class _HeifMeta:
+    """解析 HEIF 的 meta 盒子：主图、条目类型、缩略图引用、尺寸属性和数据位置"""
+
+    def __init__(self, data, start, end):
+        self.primary = None
+        self.item_types = {}
+        self.thumbnails = {}        # 缩略图条目 -> 原图条目
+        self.sizes = {}             # 条目 -> (宽, 高)
+        self.locations = {}         # 条目 -> (构造方式, [(偏移, 长度)])
+        self.offset_fields = {}     # 条目 -> (基准偏移字段, [各区间偏移字段])，字段为 (位置, 字节数)，用于改写数据位置
+        self.pitm_field = None      # pitm 中条目号的位置与字节数，用于改写主图
+        self.thmb_types = []        # iref 中 thmb 引用类型字段的位置
+        properties, associations = [], {}
+
+        for box_type, body, box_end in _iter_boxes(data, start + 4, end):
+            version = data[body]
+            if box_type == b'pitm':
+                width = 2 if version == 0 else 4
+                self.primary, _ = _read_uint(data, body + 4, width)
+                self.pitm_field = (body + 4, width)
+            elif box_type == b'iinf':
+                first = body + 4 + (2 if version == 0 else 4)
+                for entry_type, entry_body, _ in _iter_boxes(data, first, box_end):
+                    if entry_type != b'infe' or data[entry_body] < 2:
+                        continue
+                    width = 2 if data[entry_body] == 2 else 4
+                    item_id, pos = _read_uint(data, entry_body + 4, width)
+                    self.item_types[item_id] = bytes(data[pos + 2:pos + 6])
+            elif box_type == b'iref':
+                width = 2 if version == 0 else 4
+                for ref_type, ref_body, _ in _iter_boxes(data, body + 4, box_end):
+                    if ref_type != b'thmb':
+                        continue
+                    from_id, pos = _read_uint(data, ref_body, width)
+                    ref_count, pos = _read_uint(data, pos, 2)
+                    if ref_count:
+                        self.thumbnails[from_id], _ = _read_uint(data, pos, width)
+                    self.thmb_types.append(ref_body - 4)
+            elif box_type == b'iprp':
+                for prop_type, prop_body, prop_end in _iter_boxes(data, body, box_end):
+                    if prop_type == b'ipco':
+                        properties = list(_iter_boxes(data, prop_body, prop_end))
+                    elif prop_type == b'ipma':
+                        associations = self._parse_ipma(data, prop_body)
+            elif box_type == b'iloc':
+                self._parse_iloc(data, body)
+
+        for item_id, indexes in associations.items():
+            for index in indexes:
+                if 0 < index <= len(properties) and properties[index - 1][0] == b'ispe':
+                    prop_body = properties[index - 1][1]
+                    self.sizes[item_id] = struct.unpack('>II', data[prop_body + 4:prop_body + 12])
+
+    @staticmethod
+    def _parse_ipma(data, body):
+        version = data[body]
+        flags = int.from_bytes(data[body + 1:body + 4], 'big')
+        count, pos = _read_uint(data, body + 4, 4)
+        result = {}
+        for _ in range(count):
+            item_id, pos = _read_uint(data, pos, 2 if version < 1 else 4)
+            assoc_count, pos = _read_uint(data, pos, 1)
+            indexes = []
+            for _ in range(assoc_count):
+                if flags & 1:
+                    value, pos = _read_uint(data, pos, 2)
+                    indexes.append(value & 0x7FFF)
+                else:
+                    value, pos = _read_uint(data, pos, 1)
+                    indexes.append(value & 0x7F)
+            result[item_id] = indexes
+        return result
+
+    def _parse_iloc(self, data, body):
+        version = data[body]
+        offset_size, length_size = data[body + 4] >> 4, data[body + 4] & 0x0F
+        base_offset_size = data[body + 5] >> 4
+        index_size = data[body + 5] & 0x0F if version in (1, 2) else 0
+        count, pos = _read_uint(data, body + 6, 2 if version < 2 else 4)
+        for _ in range(count):
+            item_id, pos = _read_uint(data, pos, 2 if version < 2 else 4)
+            method = 0
+            if version in (1, 2):
+                method, pos = _read_uint(data, pos, 2)
+                method &= 0x0F
+            pos += 2  # data_reference_index
+            base_field = (pos, base_offset_size)
+            base_offset, pos = _read_uint(data, pos, base_offset_size)
+            extent_count, pos = _read_uint(data, pos, 2)
+            extents, extent_fields = [], []
+            for _ in range(extent_count):
+                _, pos = _read_uint(data, pos, index_size)
+                extent_fields.append((pos, offset_size))
+                offset, pos = _read_uint(data, pos, offset_size)
+                length, pos = _read_uint(data, pos, length_size)
+                extents.append((base_offset + offset, length))
+            self.locations[item_id] = (method, extents)
+            self.offset_fields[item_id] = (base_field, extent_fields)
+
+
+def _write_uint(data, field, value):
+    pos, size = field
+    if value >= 1 << (8 * size):
+        raise ValueError("偏移量超出字段宽度")
+    data[pos:pos + size] = value.to_bytes(size, 'big')
+
+
+def _relocate_item(data, meta, item_id, chunks):
+    """
+    把条目的数据区间依次放进追加在 data 末尾的 mdat 盒子，并改写 iloc 中该条目的偏移量。
+    这样组成的文件只包含文件头、meta 和该条目的数据，大小与原文件无关。
+    """
+    (base_field, extent_fields) = meta.offset_fields[item_id]
+    if base_field[1] == 0 and any(size == 0 for _, size in extent_fields):
+        return None  # 偏移量没有可改写的字段
+    position = len(data) + 8
+    if base_field[1]:
+        _write_uint(data, base_field, 0 if all(size for _, size in extent_fields) else position)
+    for field, chunk in zip(extent_fields, chunks):
+        if field[1]:
+            _write_uint(data, field, position)
+        elif len(chunks) > 1:
+            return None  # 多个区间共用基准偏移，无法分别改写
+        position += len(chunk)
+    data += struct.pack('>I4s', 8 + sum(len(chunk) for chunk in chunks), b'mdat')
+    for chunk in chunks:
+        data += chunk
+    return data
+
+
+def _read_item(path, item_id=None, box=None):
+    """
+    读取 HEIF 文件头和 meta，返回 (meta, 由文件头与单个条目数据组成的最小文件内容, 条目号)。
+    item_id 为 None 时选取足以覆盖 box 的最小缩略图条目；找不到时返回 None。
+    """
+    with open(path, 'rb') as f:
+        head = f.read(64 * 1024)
+        meta_range = None
+        for box_type, body, box_end in _iter_boxes(head, 0, _HEIF_MAX_META):
+            if box_type == b'meta':
+                meta_range = (body, box_end)
+                break
+        if meta_range is None or meta_range[1] > _HEIF_MAX_META:
+            return None
+        if meta_range[1] > len(head):
+            f.seek(0)
+            head = f.read(meta_range[1])
+
+        data = bytearray(head[:meta_range[1]])
+        meta = _HeifMeta(data, *meta_range)
+        if item_id is None:
+            if meta.primary is None or meta.primary not in meta.sizes:
+                return None
+            candidates = [
+                thumb_id for thumb_id, target in meta.thumbnails.items()
+                if target == meta.primary and meta.item_types.get(thumb_id) in (b'hvc1', b'av01')
+                and thumb_id in meta.sizes and meta.locations.get(thumb_id, (None,))[0] in (0, 1)
+            ]
+            original_size = meta.sizes[meta.primary]
+            usable = [thumb_id for thumb_id in candidates if _covers(meta.sizes[thumb_id], original_size, box)]
+            if not usable:
+                return None
+            item_id = min(usable, key=lambda thumb_id: meta.sizes[thumb_id][0] * meta.sizes[thumb_id][1])
+
+        method, extents = meta.locations[item_id]
+        if method == 0:
+            # 只读取该条目的数据区间，不按整个文件的大小分配内存
+            chunks = []
+            for offset, length in extents:
+                if not length:
+                    return None  # 长度 0 表示延伸到文件末尾，缩略图不会这样存放
+                f.seek(offset)
+                chunks.append(f.read(length))
+                if len(chunks[-1]) < length:
+                    return None
+            data = _relocate_item(data, meta, item_id, chunks)
+            if data is None:
+                return None
+    return meta, data, item_id
+
+
+def _open_heif_thumbnail(path, box):
+    """
+    找到主图的缩略图条目后，只读取文件头部的盒子和缩略图的数据区间，
+    把 pitm 改写为缩略图条目、去掉 thmb 引用，再交给 libheif 解码。
+    """
+    found = _read_item(path, box=box)
+    if found is None:
+        return None
+    meta, data, thumb_id = found
+    if meta.pitm_field is None:
+        return None
+    original_size = meta.sizes[meta.primary]
+
+    pos, width = meta.pitm_field
+    data[pos:pos + width] = thumb_id.to_bytes(width, 'big')
+    for type_pos in meta.thmb_types:
+        data[type_pos:type_pos + 4] = b'none'
+    thumb = pillow_heif.open_heif(io.BytesIO(bytes(data))).to_pillow()
+    return thumb, original_size
+
+
+def open_embedded_thumbnail(path, box):
+    """
+    若图片内嵌的缩略图（JPEG 的 EXIF 缩略图、HEIF 的缩略图条目）足够覆盖 box，
+    返回 (缩略图, 原图尺寸)，否则返回 None，由调用方回退到缩小解码。
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext in ('.jpg', '.jpeg'):
+            return _open_jpeg_thumbnail(path, box)
+        if ext in ('.heic', '.heif'):
+            return _open_heif_thumbnail(path, box)
+    except Exception:
+        return None
+    return None
@@ -0,0 +1,75 @@
+import hashlib
+import os
+from collections import defaultdict
+
+# 部分摘要读取文件首尾各这么多字节
+PARTIAL_BYTES = 64 * 1024
+_READ_CHUNK = 1024 * 1024
+
+
+def _partial_digest(path, size):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_BYTES))
+        if size > 2 * PARTIAL_BYTES:
+            f.seek(size - PARTIAL_BYTES)
+        digest.update(f.read())
+    return digest.digest()
+
+
+def _full_digest(path):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while chunk := f.read(_READ_CHUNK):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _refine(groups, key_func, should_stop):
+    """把每组文件按 key_func 的结果细分，只保留仍有多个文件的组"""
+    refined = []
+    for paths in groups:
+        buckets = defaultdict(list)
+        for path in paths:
+            if should_stop and should_stop():
+                return []
+            try:
+                buckets[key_func(path)].append(path)
+            except OSError:
+                continue
+        refined.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+    return refined
+
+
+def find_exact_duplicates(paths, should_stop=None):
+    """
+    找出字节完全相同的文件，返回 (重复组列表, 需要继续做感知哈希的路径列表)。
+    依次按 文件大小 → 首尾 64KB 摘要 → 全文件 BLAKE2 摘要 缩小范围，
+    只有前两步仍然冲突的文件才会被完整读取。
+    每个重复组按路径排序，第一个文件作为代表参与后续的感知哈希。
+    """
+    paths = list(dict.fromkeys(paths))  # 重叠的文件夹可能让同一路径出现多次
+    by_size = defaultdict(list)
+    for path in paths:
+        try:
+            by_size[os.path.getsize(path)].append(path)
+        except OSError:
+            continue
+
+    sizes = {}
+    candidates = []
+    for size, same_size in by_size.items():
+        if size > 0 and len(same_size) > 1:
+            candidates.append(same_size)
+            sizes.update((path, size) for path in same_size)
+
+    candidates = _refine(candidates, lambda p: _partial_digest(p, sizes[p]), should_stop)
+    # 不超过首尾两段长度的文件已被完整比较过，无需再算全文件摘要
+    small = [group for group in candidates if sizes[group[0]] <= 2 * PARTIAL_BYTES]
+    large = [group for group in candidates if sizes[group[0]] > 2 * PARTIAL_BYTES]
+    groups = small + _refine(large, _full_digest, should_stop)
+
+    groups = sorted(sorted(group) for group in groups)
+    duplicates = {path for group in groups for path in group[1:]}
+    unique_paths = [path for path in paths if path not in duplicates]
+    return groups, unique_paths
@@ -0,0 +1,40 @@
+import io
+
+from PIL import Image
+from PyQt6.QtGui import QImage
+
+from hash_cache import hash_cache, file_signature
+
+# 结果页网格缩略图的边长（保持比例），界面显示时再按控件大小缩放
+GRID_THUMBNAIL_SIZE = 120
+_JPEG_QUALITY = 85
+
+
+def grid_thumbnail_algo(size=GRID_THUMBNAIL_SIZE):
+    return f"grid{size}v1"
+
+
+def encode_grid_thumbnail(img, size=GRID_THUMBNAIL_SIZE):
+    """由已解码的图片生成网格缩略图并编码为 JPEG 字节；先缩小再转换颜色，开销只与缩略图尺寸有关"""
+    if img.mode not in ('RGB', 'RGBA', 'L'):
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    scale = min(size / img.width, size / img.height, 1.0)
+    thumb = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                       Image.Resampling.BILINEAR, reducing_gap=2.0)
+    if thumb.mode != 'RGB':
+        thumb = thumb.convert('RGB')
+    buffer = io.BytesIO()
+    thumb.save(buffer, 'JPEG', quality=_JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def load_grid_thumbnails(paths, size=GRID_THUMBNAIL_SIZE):
+    """从缓存读取哈希时顺带生成的网格缩略图 {路径: QImage}，只查缓存不读原图；文件已变化或没有记录的不在结果中"""
+    signatures = {path: sig for path in paths if (sig := file_signature(path)) is not None}
+    cached = hash_cache.get_many(signatures, grid_thumbnail_algo(size))
+    thumbnails = {}
+    for path, blob in cached.items():
+        image = QImage.fromData(blob, 'JPEG') if blob else QImage()
+        if not image.isNull():
+            thumbnails[path] = image
+    return thumbnails
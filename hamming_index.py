@@ -0,0 +1,427 @@
+import math
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def popcount64(values):
+    """逐元素统计 uint64 数组中 1 的个数（SWAR 算法，全部向量化，原地运算减少临时数组）"""
+    x = np.array(values, dtype=np.uint64, copy=True)
+    t = np.empty_like(x)
+    np.right_shift(x, np.uint64(1), out=t)
+    t &= _M1
+    x -= t
+    np.right_shift(x, np.uint64(2), out=t)
+    t &= _M2
+    x &= _M2
+    x += t
+    np.right_shift(x, np.uint64(4), out=t)
+    x += t
+    x &= _M4
+    x *= _H01
+    x >>= np.uint64(56)
+    return x.astype(np.int64)
+
+
+def bits_to_code(hash_bits):
+    """把不超过64位的布尔哈希数组打包成一个整数（高位在前）"""
+    bits = np.asarray(hash_bits, dtype=bool).ravel()
+    if bits.size > 64:
+        raise ValueError("哈希位数超过64位，无法打包")
+    return int.from_bytes(np.packbits(bits).tobytes().ljust(8, b'\0'), 'big')
+
+
+def hashes_to_codes(hash_list):
+    """把若干个布尔哈希数组（不超过64位）打包成一个 uint64 数组"""
+    if not len(hash_list):
+        return np.zeros(0, dtype=np.uint64)
+    bits = np.asarray(hash_list, dtype=bool)
+    if bits.shape[1] > 64:
+        raise ValueError("哈希位数超过64位，无法打包")
+    packed = np.packbits(bits, axis=1)
+    if packed.shape[1] < 8:
+        packed = np.pad(packed, ((0, 0), (0, 8 - packed.shape[1])))
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def pairs_within_blocked(codes, radius, block_size=1024, should_stop=None):
+    """
+    分块的全量两两比较：每次取两个块做广播异或 + 计数，
+    临时内存固定为 block_size² 个 uint64，与图片总数无关。
+    返回 (i, j, 距离)，i < j，按 (i, j) 排序。
+    """
+    codes = np.ascontiguousarray(codes, dtype=np.uint64)
+    n = len(codes)
+    found_i, found_j, found_d = [], [], []
+    for a_start in range(0, n, block_size):
+        block_a = codes[a_start:a_start + block_size]
+        for b_start in range(a_start, n, block_size):
+            if should_stop and should_stop():
+                return (np.zeros(0, dtype=np.int64),) * 3
+            dists = popcount64(block_a[:, None] ^ codes[b_start:b_start + block_size][None, :])
+            close = dists <= radius
+            if b_start == a_start:
+                close = np.triu(close, 1)
+            rows, cols = np.nonzero(close)
+            if len(rows):
+                found_i.append(rows + a_start)
+                found_j.append(cols + b_start)
+                found_d.append(dists[rows, cols])
+    if not found_i:
+        return (np.zeros(0, dtype=np.int64),) * 3
+    pair_i = np.concatenate(found_i).astype(np.int64)
+    pair_j = np.concatenate(found_j).astype(np.int64)
+    order = np.lexsort((pair_j, pair_i))
+    return pair_i[order], pair_j[order], np.concatenate(found_d)[order]
+
+
+def collapse_identical(codes):
+    """
+    哈希完全相同的图片合并为一个节点，检索只在节点之间进行，s 张相同的图片不再展开成 s² 个图片对。
+    返回 (节点哈希, 每张图片的节点号, 每个节点的第一张图片下标)。
+    """
+    codes = np.ascontiguousarray(codes, dtype=np.uint64)
+    nodes, first, node_of = np.unique(codes, return_index=True, return_inverse=True)
+    return nodes, node_of.astype(np.int64).ravel(), first.astype(np.int64)
+
+
+class PackedHashes:
+    """一组图片的哈希：连续的 uint64 数组 + 路径索引，每张图片只占 8 字节"""
+
+    def __init__(self, paths=(), codes=None):
+        self.paths = list(paths)
+        self.codes = np.zeros(0, dtype=np.uint64) if codes is None else np.asarray(codes, dtype=np.uint64)
+        if len(self.paths) != len(self.codes):
+            raise ValueError("路径数量与哈希数量不一致")
+        self._rows = None
+        # 可选的拍摄时间（秒，未知为 NaN）和相机型号，用于按时间窗口剪枝
+        self.taken_at = None
+        self.cameras = None
+        # 同一批图片的多种哈希 {算法名: uint64 数组}，codes 是其中当前选用的一种
+        self.algorithm = None
+        self.variants = {}
+        # 可选的视频指纹（VideoFingerprints），与图片一起分组
+        self.videos = None
+
+    @classmethod
+    def from_dict(cls, code_dict):
+        """由 {路径: 整数哈希} 构造，按路径排序保证结果可复现"""
+        paths = sorted(code_dict)
+        codes = np.fromiter((code_dict[p] for p in paths), dtype=np.uint64, count=len(paths))
+        return cls(paths, codes)
+
+    @classmethod
+    def from_variants(cls, code_dict, algorithms):
+        """由 {路径: 按 algorithms 顺序排列的哈希元组} 构造，默认选用第一种算法"""
+        paths = sorted(code_dict)
+        table = np.array([code_dict[p] for p in paths], dtype=np.uint64).reshape(len(paths), len(algorithms))
+        packed = cls(paths, table[:, 0])
+        packed.algorithm = algorithms[0]
+        packed.variants = {name: np.ascontiguousarray(table[:, k]) for k, name in enumerate(algorithms)}
+        return packed
+
+    def with_algorithm(self, algorithm):
+        """换用另一种已算好的哈希，路径和拍摄信息共享，不复制数组"""
+        if algorithm == self.algorithm or (not self.variants and not len(self)):
+            return self
+        if algorithm not in self.variants:
+            raise ValueError(f"没有 {algorithm} 哈希")
+        packed = PackedHashes(self.paths, self.variants[algorithm])
+        packed._rows = self._rows
+        packed.taken_at, packed.cameras = self.taken_at, self.cameras
+        packed.algorithm, packed.variants = algorithm, self.variants
+        packed.videos = self.videos
+        return packed
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = {path: row for row, path in enumerate(self.paths)}
+        return self._rows
+
+    def code(self, path):
+        return int(self.codes[self.rows[path]])
+
+    def items(self):
+        return zip(self.paths, self.codes.tolist())
+
+    def attach_capture(self, capture_info):
+        """附加 {路径: (时间戳或 None, 相机)} 形式的拍摄信息，缺失的图片视为时间未知"""
+        self.taken_at = np.array(
+            [np.nan if capture_info.get(p, (None, ''))[0] is None else capture_info[p][0] for p in self.paths],
+            dtype=np.float64
+        )
+        self.cameras = [capture_info.get(p, (None, ''))[1] for p in self.paths]
+        return self
+
+
+def _mask_count(bits, radius):
+    return sum(math.comb(bits, k) for k in range(min(radius, bits) + 1))
+
+
+@lru_cache(maxsize=64)
+def _chunk_masks(bits, radius):
+    """枚举 bits 位以内所有汉明重量不超过 radius 的异或掩码（第一个总是 0）"""
+    masks = [0]
+    for weight in range(1, min(radius, bits) + 1):
+        for positions in combinations(range(bits), weight):
+            masks.append(sum(1 << p for p in positions))
+    return np.asarray(masks, dtype=np.int64)
+
+
+class _ChunkTable:
+    """某一段的分桶表：相同段值的图片放在同一个桶里"""
+
+    # 段位数不超过该值时使用直接寻址数组查桶，否则二分查找
+    DENSE_BITS = 22
+
+    def __init__(self, codes, shift, bits):
+        self.shift = shift
+        self.bits = bits
+        keys = ((codes >> np.uint64(shift)) & np.uint64((1 << bits) - 1)).astype(np.int64)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.slots = None
+        if bits <= self.DENSE_BITS:
+            self.slots = np.full(1 << bits, -1, dtype=np.int32)
+            self.slots[self.keys] = np.arange(len(self.keys), dtype=np.int32)
+
+    def key_of(self, code):
+        return int((int(code) >> self.shift) & ((1 << self.bits) - 1))
+
+    def lookup(self, probes):
+        """返回每个探测值所在的桶号，不存在时为 -1"""
+        if self.slots is not None:
+            return self.slots[probes]
+        pos = np.minimum(np.searchsorted(self.keys, probes), len(self.keys) - 1)
+        return np.where(self.keys[pos] == probes, pos, -1)
+
+    def members(self, bucket_ids):
+        return [self.order[self.starts[b]:self.starts[b] + self.counts[b]] for b in bucket_ids]
+
+
+class MultiIndexHashing:
+    """
+    多索引哈希（Multi-Index Hashing）：把64位哈希切成 m 段，
+    若两哈希距离不超过 r，则至少有一段的距离不超过 r // m（抽屉原理），
+    因此只需在各段内做小半径的精确查找，再用完整距离校验候选。
+    结果与暴力两两比较完全一致。
+    """
+
+    CHUNK_CHOICES = (2, 3, 4, 5, 6, 8)
+
+    def __init__(self, codes, num_bits=64):
+        self.codes = np.ascontiguousarray(codes, dtype=np.uint64)
+        self.num_bits = num_bits
+        self._tables = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    @staticmethod
+    def _chunk_layout(num_bits, num_chunks):
+        base, extra = divmod(num_bits, num_chunks)
+        layout, shift = [], 0
+        for k in range(num_chunks):
+            bits = base + (1 if k < extra else 0)
+            layout.append((shift, bits))
+            shift += bits
+        return layout
+
+    def _table(self, num_chunks):
+        if num_chunks not in self._tables:
+            self._tables[num_chunks] = [
+                _ChunkTable(self.codes, shift, bits)
+                for shift, bits in self._chunk_layout(self.num_bits, num_chunks)
+            ]
+        return self._tables[num_chunks]
+
+    def _plan(self, radius, queries):
+        """估算各种分段方式与暴力比较的代价，返回最便宜的分段数（0 表示暴力比较）"""
+        n = max(len(self.codes), 2)
+        best_chunks, best_cost = 0, queries * n
+        for num_chunks in self.CHUNK_CHOICES:
+            if num_chunks > self.num_bits:
+                continue
+            min_bits = self.num_bits // num_chunks
+            max_bits = min_bits + (1 if self.num_bits % num_chunks else 0)
+            masks = _mask_count(max_bits, radius // num_chunks)
+            buckets = min(n, 2 ** min_bits)
+            probe = 1 if max_bits <= _ChunkTable.DENSE_BITS else math.log2(buckets) + 1
+            # 单次查询只探测自己的段值，批量查询则对每个桶探测一次
+            probes = num_chunks * masks * (min(queries, buckets) if queries > 1 else 1) * probe
+            candidates = num_chunks * masks * queries * n / (2 ** min_bits)
+            build = 0 if num_chunks in self._tables else num_chunks * (n * math.log2(n) + 2 ** min(max_bits, 22) / 8)
+            cost = probes + 2 * candidates + build
+            if cost < best_cost:
+                best_chunks, best_cost = num_chunks, cost
+        return best_chunks
+
+    def search(self, code, radius):
+        """返回与 code 距离不超过 radius 的 (下标数组, 距离数组)"""
+        code = np.uint64(code)
+        num_chunks = self._plan(radius, 1)
+        if not num_chunks:
+            ids = np.arange(len(self.codes))
+        else:
+            found = []
+            for table in self._table(num_chunks):
+                probes = _chunk_masks(table.bits, radius // num_chunks) ^ table.key_of(code)
+                buckets = table.lookup(probes)
+                found.extend(table.members(buckets[buckets >= 0]))
+            ids = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+        dists = popcount64(self.codes[ids] ^ code)
+        keep = dists <= radius
+        return ids[keep], dists[keep]
+
+    def nearest(self, code, k, max_radius=None):
+        """
+        返回距离最近的 k 个 (下标数组, 距离数组)，按 (距离, 下标) 排序。
+        从小半径开始检索，命中不足 k 个时半径加倍；半径 r 内的结果是完整的，所以前 k 个一定是真正的最近邻。
+        """
+        max_radius = self.num_bits if max_radius is None else min(max_radius, self.num_bits)
+        radius = min(4, max_radius)
+        while True:
+            ids, dists = self.search(code, radius)
+            if len(ids) >= k or radius >= max_radius:
+                break
+            radius = min(radius * 2, max_radius)
+        order = np.lexsort((ids, dists))[:k]
+        return ids[order], dists[order]
+
+    def search_many(self, queries, radius, should_stop=None):
+        """
+        批量查询一组不在索引中的哈希，返回 (查询下标, 命中下标, 距离)，按 (查询下标, 命中下标) 排序。
+        结果与逐个调用 search 相同，但所有查询共用一次分段探测。
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.uint64)
+        n = len(self.codes)
+        empty = (np.zeros(0, dtype=np.int64),) * 3
+        if not n or not len(queries):
+            return empty
+
+        found = []
+        num_chunks = self._plan(radius, len(queries))
+        if not num_chunks:
+            # 临时内存约为 2^22 个 uint64
+            step = max(1, (1 << 22) // n)
+            for start in range(0, len(queries), step):
+                if should_stop and should_stop():
+                    return empty
+                dists = popcount64(queries[start:start + step, None] ^ self.codes[None, :])
+                rows, cols = np.nonzero(dists <= radius)
+                found.append((rows + start) * n + cols)
+        else:
+            for table in self._table(num_chunks):
+                keys = ((queries >> np.uint64(table.shift)) & np.uint64((1 << table.bits) - 1)).astype(np.int64)
+                for mask in _chunk_masks(table.bits, radius // num_chunks):
+                    if should_stop and should_stop():
+                        return empty
+                    buckets = table.lookup(keys ^ mask)
+                    hit = np.flatnonzero(buckets >= 0)
+                    if not len(hit):
+                        continue
+                    counts = table.counts[buckets[hit]]
+                    offset = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+                    ids = table.order[np.repeat(table.starts[buckets[hit]], counts) + offset]
+                    found.append(np.repeat(hit, counts).astype(np.int64) * n + ids)
+
+        if not found:
+            return empty
+        keys = np.unique(np.concatenate(found))
+        query_ids, ids = np.divmod(keys, n)
+        dists = popcount64(queries[query_ids] ^ self.codes[ids])
+        keep = dists <= radius
+        return query_ids[keep], ids[keep], dists[keep]
+
+    def pairs_within(self, radius, should_stop=None):
+        """
+        返回所有距离不超过 radius 的图片对 (i, j, 距离)，i < j，按 (i, j) 排序。
+        should_stop 为可选回调，返回 True 时提前结束并返回空结果。
+        """
+        n = len(self.codes)
+        empty = (np.zeros(0, dtype=np.int64),) * 3
+        if n < 2:
+            return empty
+
+        num_chunks = self._plan(radius, n)
+        if not num_chunks:
+            return pairs_within_blocked(self.codes, radius, should_stop=should_stop)
+
+        found = []
+        for table in self._table(num_chunks):
+            bucket_ids = np.arange(len(table.keys), dtype=np.int32)
+            crowded = np.flatnonzero(table.counts > 1)
+            for mask in _chunk_masks(table.bits, radius // num_chunks):
+                if should_stop and should_stop():
+                    return empty
+                if mask == 0:
+                    # 段值完全相同：桶内两两配对，每对只展开一次
+                    left, right = self._expand_within(table, crowded)
+                else:
+                    # 掩码是对称的，(a, b) 与 (b, a) 会各出现一次，只保留 a < b；不存在的桶为 -1，自然被排除
+                    bucket_a = np.flatnonzero(table.lookup(table.keys ^ mask) > bucket_ids)
+                    if not len(bucket_a):
+                        continue
+                    bucket_b = table.lookup(table.keys[bucket_a] ^ mask)
+                    left, right = self._expand_buckets(table, bucket_a, bucket_b)
+                if len(left):
+                    close = popcount64(self.codes[left] ^ self.codes[right]) <= radius
+                    found.append(left[close] * n + right[close])
+            if len(found) > 1:
+                # 同一对图片可能在多段中重复命中，每段结束后去重，峰值内存只与不同的图片对数有关
+                found = [np.unique(np.concatenate(found))]
+
+        if not found:
+            return empty
+        keys = np.unique(np.concatenate(found))
+        pair_i, pair_j = np.divmod(keys, n)
+        dists = popcount64(self.codes[pair_i] ^ self.codes[pair_j])
+        return pair_i, pair_j, dists
+
+    @staticmethod
+    def _expand_within(table, buckets):
+        """展开每个桶内部的图片对（只取上三角），返回 (较小下标, 较大下标)"""
+        counts = table.counts[buckets]
+        sizes = counts * (counts - 1) // 2
+        total = int(sizes.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pair_id = np.repeat(np.arange(len(sizes)), sizes)
+        rank = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        # 第 rank 个 (row, col)，row < col：按列展开，col 满足 col*(col-1)/2 <= rank
+        col = ((1 + np.sqrt(1 + 8 * rank.astype(np.float64))) // 2).astype(np.int64)
+        col -= col * (col - 1) // 2 > rank
+        col += (col + 1) * col // 2 <= rank
+        row = rank - col * (col - 1) // 2
+        base = table.starts[buckets][pair_id]
+        left, right = table.order[base + row], table.order[base + col]
+        return np.minimum(left, right).astype(np.int64), np.maximum(left, right).astype(np.int64)
+
+    @staticmethod
+    def _expand_buckets(table, bucket_a, bucket_b):
+        """展开两个不同桶之间的所有图片对，返回 (较小下标, 较大下标)"""
+        count_a = table.counts[bucket_a]
+        count_b = table.counts[bucket_b]
+        sizes = count_a * count_b
+        total = int(sizes.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pair_id = np.repeat(np.arange(len(sizes)), sizes)
+        offset = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        width = count_b[pair_id]
+        left = table.order[table.starts[bucket_a][pair_id] + offset // width]
+        right = table.order[table.starts[bucket_b][pair_id] + offset % width]
+        return np.minimum(left, right).astype(np.int64), np.maximum(left, right).astype(np.int64)
@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """返回 (文件大小, 修改时间ns)，文件不可访问时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def code_to_blob(code: int) -> bytes:
+    """64位哈希转为8字节大端序，与按位 packbits 的结果一致"""
+    return int(code).to_bytes(8, 'big')
+
+
+def blob_to_code(blob: bytes) -> int:
+    return int.from_bytes(blob.ljust(8, b'\0'), 'big')
+
+
+def codes_to_blob(codes: Iterable[int]) -> bytes:
+    """多个64位哈希依次拼接为一条缓存记录，每个占8字节"""
+    return b''.join(code_to_blob(code) for code in codes)
+
+
+def blob_to_codes(blob: bytes) -> Tuple[int, ...]:
+    return tuple(int.from_bytes(blob[k:k + 8], 'big') for k in range(0, len(blob), 8))
+
+
+class HashCache:
+    """按 路径+大小+修改时间 缓存图片哈希，文件变化后自动失效"""
+
+    _QUERY_CHUNK = 500
+
+    def __init__(self, db_file: str = "_internal/hash_cache.db"):
+        self.db_file = Path(db_file)
+        self._lock = threading.Lock()
+        self._conn = None
+        # 写入计数：按算法分别递增（删除、清空影响所有算法，计入公共部分），
+        # 内存中由某一算法的记录构建的索引据 generation(algo) 判断是否需要重新加载，其它算法的写入不影响它
+        self._generation = 0
+        self._algo_generations = defaultdict(int)
+
+    def generation(self, algo: str) -> int:
+        """algo 的记录每变化一次（包括删除、清空）返回值就增大"""
+        with self._lock:
+            return self._generation + self._algo_generations[algo]
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_file), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS hashes ("
+                " path TEXT NOT NULL,"
+                " algo TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " hash BLOB NOT NULL,"
+                " PRIMARY KEY (path, algo))"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, signatures: Dict[str, Tuple[int, int]], algo: str) -> Dict[str, bytes]:
+        """批量查询，只返回大小和修改时间都与当前文件一致的记录"""
+        hits = {}
+        paths = list(signatures)
+        if not paths:
+            return hits
+        try:
+            with self._lock:
+                conn = self._connect()
+                for start in range(0, len(paths), self._QUERY_CHUNK):
+                    chunk = paths[start:start + self._QUERY_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = conn.execute(
+                        f"SELECT path, size, mtime_ns, hash FROM hashes "
+                        f"WHERE algo = ? AND path IN ({placeholders})",
+                        [algo, *chunk]
+                    ).fetchall()
+                    for path, size, mtime_ns, blob in rows:
+                        if signatures.get(path) == (size, mtime_ns):
+                            hits[path] = blob
+        except sqlite3.Error as e:
+            logger.warning(f"读取哈希缓存时出错了: {e}")
+        return hits
+
+    def load_all(self, algo: str) -> List[Tuple[str, bytes]]:
+        """取出某算法下全部非空记录，不检查文件是否仍然存在或已变化，用于不扫描磁盘直接构建图库索引"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                return conn.execute(
+                    "SELECT path, hash FROM hashes WHERE algo = ? AND length(hash) > 0", (algo,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取哈希缓存时出错了: {e}")
+            return []
+
+    def put_many(self, entries: Iterable[Tuple[str, int, int, bytes]], algo: str) -> bool:
+        """批量写入 (路径, 大小, 修改时间ns, 哈希) 记录，旧记录直接覆盖"""
+        rows = [(path, algo, size, mtime_ns, blob) for path, size, mtime_ns, blob in entries]
+        if not rows:
+            return True
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO hashes (path, algo, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+                self._algo_generations[algo] += 1
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"写入哈希缓存时出错了: {e}")
+            return False
+
+    def prune_missing(self, roots: Iterable[str], present: Iterable[str] = ()) -> int:
+        """
+        删除 roots 目录（含子目录）下已不存在的文件的全部记录，返回删除的路径数。
+        present 是本次扫描刚列出的文件，已知存在，不再逐个检查；目录之外的记录不受影响。
+        """
+        prefixes = tuple(os.path.normcase(os.path.normpath(root)).rstrip(os.sep) + os.sep for root in roots)
+        if not prefixes:
+            return 0
+        present = set(present)
+        try:
+            with self._lock:
+                paths = [path for (path,) in self._connect().execute("SELECT DISTINCT path FROM hashes")]
+        except sqlite3.Error as e:
+            logger.warning(f"读取哈希缓存时出错了: {e}")
+            return 0
+        stale = [path for path in paths
+                 if path not in present and os.path.normcase(os.path.normpath(path)).startswith(prefixes)
+                 and not os.path.exists(path)]
+        if stale and not self.remove_paths(stale):
+            return 0
+        return len(stale)
+
+    def remove_paths(self, paths: List[str]) -> bool:
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.executemany("DELETE FROM hashes WHERE path = ?", [(p,) for p in paths])
+                conn.commit()
+                self._generation += 1
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"清理哈希缓存时出错了: {e}")
+            return False
+
+    def clear(self) -> bool:
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM hashes")
+                conn.commit()
+                self._generation += 1
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"清空哈希缓存时出错了: {e}")
+            return False
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+hash_cache = HashCache()
@@ -0,0 +1,104 @@
+import io
+
+import pillow_heif
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QImage, QImageReader
+
+from embedded_thumbnail import open_embedded_thumbnail
+from large_image import (MAX_DECODE_PIXELS, banded_factor, check_pixel_limit, decode_banded, exceeds_budget,
+                         open_large, supports_banded)
+from raw_preview import extract_raw_preview, is_raw_file
+from video_fingerprint import is_video_file, read_video_frame
+
+HEIF_EXTENSIONS = ('.heic', '.heif')
+
+
+def _target_box(target):
+    if isinstance(target, int):
+        return target, target
+    return max(1, int(target[0])), max(1, int(target[1]))
+
+
+def open_image_reduced(path, target, mode=None, use_embedded=False, reducing_gap=2.0):
+    """
+    以大约 target 像素打开图片（整数表示正方形框，或 (宽, 高)），返回 (已加载的图片, 原始尺寸)。
+    解码出的尺寸只保证不小于目标框，最后的精确缩放由调用方完成：
+    JPEG 在 DCT 域按 1/2、1/4、1/8 缩放解码，其它格式解码后先用 reduce 做整数倍缩小，
+    这样后续缩放、转灰度等处理的开销只与目标尺寸有关。
+    像素数超过 MAX_DECODE_PIXELS 的 TIFF/PNG 分块解码并边读边缩小，内存占用与原图尺寸无关；
+    其它格式和不支持分块的 TIFF/PNG 照常整幅解码。
+    reducing_gap 与 PIL 的 Image.thumbnail 含义相同：reduce 后至少保留目标框的这么多倍，
+    为 None 时不做 reduce（对缩放结果极敏感的场景，例如感知哈希）。
+    use_embedded 为 True 时优先使用足够大的内嵌缩略图，完全跳过原图解码。
+    """
+    box_w, box_h = _target_box(target)
+    embedded = open_embedded_thumbnail(path, (box_w, box_h)) if use_embedded else None
+    if embedded is not None:
+        img, original_size = embedded
+    elif path.lower().endswith(HEIF_EXTENSIONS):
+        # libheif 不支持缩放解码，只能整图解码后再缩小
+        heif_file = pillow_heif.open_heif(path)
+        original_size = heif_file.size
+        img = heif_file.to_pillow()
+    else:
+        source = path
+        if is_raw_file(path):
+            # RAW 只解码相机内嵌的 JPEG 预览图，不做去马赛克
+            preview = extract_raw_preview(path)
+            if preview is None:
+                raise ValueError("RAW 文件中没有可用的内嵌预览图")
+            source = io.BytesIO(preview)
+        img = open_large(source)
+        original_size = img.size
+        if img.format == 'JPEG':
+            # 灰度输出时顺便跳过色度通道的转换
+            img.draft('L' if mode == 'L' else None, (box_w, box_h))
+        if exceeds_budget(img) and supports_banded(img):
+            img = decode_banded(img, source, banded_factor(img.size, (box_w, box_h), reducing_gap), mode)
+        else:
+            # 不支持分块的格式照常整幅解码，只要不超过 PIL 的防解压炸弹上限
+            check_pixel_limit(img)
+            img.load()
+
+    if mode and img.mode != mode:
+        img = img.convert(mode)
+    factor = min(int(img.width / (box_w * reducing_gap)), int(img.height / (box_h * reducing_gap))) \
+        if reducing_gap else 1
+    if factor >= 2:
+        try:
+            img = img.reduce(factor)
+        except ValueError:
+            # 调色板等模式不支持 reduce，保持原尺寸交给调用方缩放
+            pass
+    return img, original_size
+
+
+def pil_to_qimage(img):
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    qimage = QImage(img.tobytes(), img.width, img.height, img.width * 3, QImage.Format.Format_RGB888)
+    return qimage.copy()
+
+
+def load_qimage_reduced(path, size, use_embedded=False):
+    """按 size（QSize）以保持比例的方式加载 QImage，JPEG 由 Qt 在解码阶段直接缩放"""
+    box = (size.width(), size.height())
+    embedded = open_embedded_thumbnail(path, box) if use_embedded else None
+    if embedded is not None:
+        return pil_to_qimage(embedded[0])
+    if is_video_file(path):
+        # 视频取中间一帧，由 ffmpeg 跳转后直接输出缩小的画面
+        return pil_to_qimage(read_video_frame(path, 0.5, box))
+    if path.lower().endswith(HEIF_EXTENSIONS) or is_raw_file(path):
+        img, _ = open_image_reduced(path, box, 'RGB')
+        return pil_to_qimage(img)
+
+    reader = QImageReader(path)
+    source = reader.size()
+    if source.isValid() and source.width() * source.height() > MAX_DECODE_PIXELS:
+        # Qt 会整幅分配后再缩放（且受其分配上限限制），超大图片改走分块解码
+        img, _ = open_image_reduced(path, box, 'RGB')
+        return pil_to_qimage(img)
+    if source.isValid() and (source.width() > size.width() or source.height() > size.height()):
+        reader.setScaledSize(source.scaled(size, Qt.AspectRatioMode.KeepAspectRatio))
+    return reader.read()
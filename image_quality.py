@@ -0,0 +1,88 @@
+import os
+import struct
+from typing import NamedTuple
+
+import numpy as np
+import pillow_heif
+from PIL import Image
+
+from large_image import open_large
+from raw_preview import is_raw_file
+
+# 清晰度在长边不超过该尺寸的灰度图上计算（不放大）。自动选择时先比分辨率，清晰度只在分辨率相同、
+# 因而解码尺寸也相同的副本之间比较；128px 时连拍帧之间的模糊差异几乎消失，这里尽量保留解码得到的细节
+SHARPNESS_SIZE = 512
+# 哈希时的缩小解码至少保留这么多像素（短边），JPEG 不会因为目标小而按 1/8 解码到只剩一两百像素
+SHARPNESS_MIN_DECODE = 256
+_RECORD = struct.Struct('>IIQfB')
+
+
+class ImageQuality(NamedTuple):
+    width: int
+    height: int
+    file_size: int
+    sharpness: float
+    has_exif: bool
+
+    def to_bytes(self):
+        return _RECORD.pack(self.width, self.height, self.file_size, self.sharpness, self.has_exif)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        if len(blob) != _RECORD.size:
+            return None
+        width, height, file_size, sharpness, has_exif = _RECORD.unpack(blob)
+        return cls(width, height, file_size, sharpness, bool(has_exif))
+
+
+QUALITY_BYTES = _RECORD.size
+
+
+def laplacian_variance(img):
+    """拉普拉斯算子响应的方差，越大越清晰；模糊、过度压缩的副本明显偏小"""
+    gray = img.convert('L') if img.mode != 'L' else img
+    scale = SHARPNESS_SIZE / max(gray.size)
+    if scale < 1:
+        gray = gray.resize((max(3, round(gray.width * scale)), max(3, round(gray.height * scale))),
+                           Image.Resampling.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.float32)
+    laplacian = (pixels[:-2, 1:-1] + pixels[2:, 1:-1] + pixels[1:-1, :-2] + pixels[1:-1, 2:]
+                 - 4 * pixels[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def has_exif(path):
+    """只解析文件头判断是否带有 EXIF，不解码图像"""
+    try:
+        if path.lower().endswith(('.heic', '.heif')):
+            return bool(pillow_heif.open_heif(path).info.get('exif'))
+        if is_raw_file(path):
+            # RAW 文件总带有相机写入的拍摄信息
+            return True
+        with open_large(path) as img:
+            if img.format == 'PNG':
+                # PNG 的 getexif 会为查找图像数据之后的 eXIf 块而整幅解码一次，这里只看打开时已解析的 eXIf 块
+                return bool(img.info.get('exif'))
+            return len(img.getexif()) > 0
+    except Exception:
+        return False
+
+
+def measure_quality(path, img, original_size):
+    """由哈希时已解码的图片计算质量指标，img 可以是缩小解码的结果"""
+    width, height = original_size
+    return ImageQuality(width, height, os.path.getsize(path), laplacian_variance(img), has_exif(path))
+
+
+def quality_rank(path, quality):
+    """
+    自动选择保留哪一张时的排序键，越大越好：
+    分辨率 → 清晰度 → 是否带 EXIF → 文件大小。没有质量记录的文件（视频、字节相同的副本）只比文件大小。
+    """
+    if quality is None:
+        try:
+            file_size = os.path.getsize(path)
+        except OSError:
+            file_size = 0
+        return 0, 0.0, False, file_size
+    return quality.width * quality.height, quality.sharpness, quality.has_exif, quality.file_size
@@ -0,0 +1,264 @@
+import os
+import queue
+import struct
+import sys
+import threading
+from collections import defaultdict, deque
+
+# 读取顺序："off" 保持原顺序；"directory" 按 设备 → 目录 → 文件名；"inode" 按 设备 → 目录 → inode；
+# "extent" 按文件在磁盘上的物理位置（仅 Linux 上支持 FIEMAP 的文件系统，取不到时回退为 inode 顺序）
+READ_ORDERS = ("off", "directory", "inode", "extent")
+# 预读方式："fadvise" 只通知系统（posix_fadvise WILLNEED）；"read" 由后台线程读入页缓存；"auto" 能用前者时用前者
+PREFETCH_MODES = ("auto", "fadvise", "read")
+# 读取 EXIF 时只需预读文件开头这么多字节
+EXIF_PREFETCH_BYTES = 256 * 1024
+_READ_CHUNK = 1024 * 1024
+
+# linux/fiemap.h：只取第一个 extent 的物理偏移
+_FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER = struct.Struct('=QQIIII')
+_FIEMAP_EXTENT = struct.Struct('=QQQQQIIII')
+
+
+def physical_offset(path):
+    """文件第一个数据块在设备上的字节偏移，不支持时返回 None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import fcntl
+        request = bytearray(_FIEMAP_HEADER.pack(0, 2 ** 64 - 1, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+        with open(path, 'rb') as f:
+            fcntl.ioctl(f.fileno(), _FS_IOC_FIEMAP, request)
+        if _FIEMAP_HEADER.unpack_from(request)[3] == 0:
+            return None  # 空文件或数据内联在 inode 中
+        return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP_HEADER.size)[1]
+    except (OSError, ImportError):
+        return None
+
+
+def _locality_key(path, order):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 1, 0, '', 0, path  # 无法访问的文件排在最后，交给后续阶段报错
+    folder = os.path.dirname(path)
+    if order == "extent":
+        offset = physical_offset(path)
+        if offset is not None:
+            return 0, stat.st_dev, '', offset, path
+    if order == "directory":
+        return 0, stat.st_dev, folder, 0, path
+    return 0, stat.st_dev, folder, stat.st_ino, path
+
+
+def order_for_locality(paths, order="inode"):
+    """按读取局部性重新排列路径，同一设备上的文件连续读取，减少机械硬盘的寻道"""
+    if order not in READ_ORDERS or order == "off":
+        return list(paths)
+    return sorted(paths, key=lambda path: _locality_key(path, order))
+
+
+def device_of(path):
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def read_through(path, buffer=None, limit=0):
+    """把文件（limit 不为 0 时只读开头这么多字节）顺序读一遍，使随后的解码直接命中系统页缓存；返回读取的字节数"""
+    buffer = memoryview(buffer or bytearray(_READ_CHUNK))
+    total = 0
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            while count := f.readinto(buffer if not limit else buffer[:min(len(buffer), limit - total)]):
+                total += count
+                if limit and total >= limit:
+                    break
+    except OSError:
+        pass  # 读取失败的文件照常交给解码阶段，由其报告错误
+    return total
+
+
+class ReadScheduler:
+    """
+    读取调度：路径按设备分组并保持给定（已按局部性排好的）顺序，每个设备最多 readers_per_device 个线程
+    整文件顺序读取，读完的文件按完成顺序交给解码阶段。读取最多领先解码 window 个文件，
+    既让解码线程不再互相打断磁头，又不会读得太远、在解码之前就被挤出页缓存。
+    head_bytes 与 Prefetcher 的含义相同：不为 0 时只读文件开头，也可以是按路径返回字节数的函数。
+    """
+
+    def __init__(self, paths, readers_per_device=1, window=32, should_stop=None, head_bytes=0):
+        self._total = len(paths)
+        self._should_stop = should_stop
+        self.head_bytes = head_bytes
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+        self._ready = queue.Queue()
+        self._slots = threading.Semaphore(max(1, window))
+        self._closed = threading.Event()
+        self._yielded = 0
+        queues = defaultdict(deque)
+        for path in paths:
+            queues[device_of(path)].append(path)
+        self.devices = len(queues)
+        self._threads = []
+        for device_queue in queues.values():
+            for _ in range(max(1, readers_per_device)):
+                thread = threading.Thread(target=self._reader, args=(device_queue,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _reader(self, device_queue):
+        buffer = bytearray(_READ_CHUNK)
+        while not self._closed.is_set():
+            while not self._slots.acquire(timeout=0.2):
+                if self._closed.is_set():
+                    return
+            try:
+                path = device_queue.popleft()
+            except IndexError:
+                self._slots.release()
+                return
+            limit = self.head_bytes(path) if callable(self.head_bytes) else self.head_bytes
+            count = read_through(path, buffer, limit)
+            with self._lock:
+                self.bytes_read += count
+            self._ready.put(path)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._yielded < self._total and not self._closed.is_set():
+            if self._should_stop and self._should_stop():
+                break
+            try:
+                path = self._ready.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            self._yielded += 1
+            self._slots.release()
+            return path
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        self._closed.set()
+
+
+class Prefetcher:
+    """
+    预读：处理第 N 个文件时，后台线程提前让系统读入第 N+1 … N+depth 个文件，解码很少再阻塞在磁盘上。
+    调用方每开始处理一个文件调用一次 advance（可以来自多个线程），或直接迭代本对象；
+    head_bytes 不为 0 时只预读文件开头（读取 EXIF 等元数据的场景），也可以是按路径返回字节数的函数，
+    让只读取文件头的格式（RAW 的内嵌预览、视频等）不被整个读入。
+    """
+
+    def __init__(self, paths, depth=8, mode="auto", head_bytes=0):
+        self.paths = list(paths)
+        self.depth = max(0, depth or 0)
+        if mode not in PREFETCH_MODES:
+            mode = "auto"
+        if not hasattr(os, "posix_fadvise"):
+            mode = "read"  # Windows 没有 posix_fadvise
+        self.mode = "fadvise" if mode == "auto" else mode
+        self.head_bytes = head_bytes
+        self.bytes_read = 0
+        self._done = bytearray(len(self.paths))
+        self._requested = 0
+        self._position = 0
+        self._started = 0
+        self._hits = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._thread = None
+        if self.depth and self.paths:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def _prefetch(self, path, buffer):
+        limit = self.head_bytes(path) if callable(self.head_bytes) else self.head_bytes
+        if self.mode == "fadvise":
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, limit, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+            return 0
+        return read_through(path, buffer, limit)
+
+    def _run(self):
+        buffer = bytearray(_READ_CHUNK)
+        while not self._closed.is_set():
+            try:
+                index = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if index is None:
+                return
+            if index < self._position:
+                continue  # 调用方已经越过该文件，预读已无意义
+            try:
+                self.bytes_read += self._prefetch(self.paths[index], buffer)
+            except OSError:
+                pass
+            self._done[index] = 1
+
+    def advance(self, position):
+        """调用方开始处理第 position 个文件：记录它是否已预读完成，并把预读窗口推进到 position + depth"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._started += 1
+            self._hits += self._done[position]
+            self._position = max(self._position, position)
+            target = min(len(self.paths), self._position + 1 + self.depth)
+            while self._requested < target:
+                self._queue.put(self._requested)
+                self._requested += 1
+
+    def __iter__(self):
+        for position, path in enumerate(self.paths):
+            if self._closed.is_set():
+                return
+            self.advance(position)
+            yield path
+
+    def close(self):
+        self._closed.set()
+        self._queue.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def summary(self):
+        """阶段统计里的一句话：预读了多少、处理到时有多少已就绪"""
+        return prefetch_summary([self])
+
+
+def prefetch_summary(prefetchers):
+    """
+    一个或多个预读器（例如按目录分别创建的）合计的统计。
+    fadvise 只是发出提示，提示发出时文件未必已经读入，因此该方式只报告提示了多少文件，不报告就绪比例。
+    """
+    prefetchers = [prefetcher for prefetcher in prefetchers if prefetcher.enabled]
+    if not prefetchers:
+        return "未启用预读"
+    first = prefetchers[0]
+    requested = sum(prefetcher._requested for prefetcher in prefetchers)
+    if first.mode == "fadvise":
+        return f"预读提示（fadvise，深度 {first.depth}）已对 {requested} 个文件发出"
+    started = sum(prefetcher._started for prefetcher in prefetchers)
+    ready = sum(prefetcher._hits for prefetcher in prefetchers) / started if started else 0.0
+    volume = sum(prefetcher.bytes_read for prefetcher in prefetchers)
+    return (f"预读（{first.mode}，深度 {first.depth}）{requested} 个文件，读入 {volume / 2 ** 20:.1f} MB，"
+            f"开始处理时已就绪 {ready:.0%}")
@@ -0,0 +1,269 @@
+import io
+import math
+import struct
+import zlib
+
+from PIL import Image, PngImagePlugin, TiffImagePlugin, TiffTags
+
+# 整幅解码的像素上限，超过的图片改为分块解码并边读边缩小，内存只与单块和缩小后的结果有关
+MAX_DECODE_PIXELS = 64 * 1024 * 1024
+# 分块解码时每块最多这么多像素
+BAND_PIXELS = 4 * 1024 * 1024
+# 哈希等不缩小的场景，分块缩小后至少保留目标框的这么多倍
+HASH_REDUCING_GAP = 4.0
+
+# 组成最小 TIFF 时从原文件复制的、解码所需的标签
+_TIFF_DECODE_TAGS = (256, 258, 259, 262, 266, 277, 284, 317, 320, 322, 323, 338, 339, 347, 529, 530, 531, 532)
+_IMAGE_LENGTH, _ROWS_PER_STRIP = 257, 278
+_STRIP_OFFSETS, _STRIP_BYTE_COUNTS = 273, 279
+_TILE_OFFSETS, _TILE_BYTE_COUNTS = 324, 325
+
+# 能把解码结果无损写回原始字节的模式（分块时需要上一块最后一行的原始值）
+_PNG_RAWMODES = ('L', 'LA', 'RGB', 'RGBA', 'P')
+
+_PLUGIN_ACCEPT = {
+    TiffImagePlugin.TiffImageFile: TiffImagePlugin._accept,
+    PngImagePlugin.PngImageFile: PngImagePlugin._accept,
+}
+
+
+def open_large(source):
+    """
+    打开图片但不解码像素。PIL 会直接拒绝像素数超过防解压炸弹阈值的文件；能分块解码的 TIFF/PNG
+    在这里改由对应的插件类直接打开（只读取文件头，不修改全局的像素上限，其它线程的检查不受影响），
+    像素交给 decode_banded 按固定内存上限处理。其它格式照常抛出 DecompressionBombError。
+    """
+    try:
+        return Image.open(source)
+    except Image.DecompressionBombError:
+        if hasattr(source, 'seek'):
+            source.seek(0)
+            prefix = source.read(16)
+            source.seek(0)
+        else:
+            with open(source, 'rb') as f:
+                prefix = f.read(16)
+        for plugin in (TiffImagePlugin.TiffImageFile, PngImagePlugin.PngImageFile):
+            if _PLUGIN_ACCEPT[plugin](prefix):
+                img = plugin(source)
+                if supports_banded(img):
+                    return img
+                img.close()
+        raise
+
+
+def exceeds_budget(img):
+    return img.width * img.height > MAX_DECODE_PIXELS
+
+
+def check_pixel_limit(img):
+    """整幅解码前的防解压炸弹检查，阈值与 PIL 打开图片时直接报错的阈值一致（MAX_IMAGE_PIXELS 的两倍）"""
+    limit = Image.MAX_IMAGE_PIXELS
+    if limit is not None and img.width * img.height > 2 * limit:
+        raise Image.DecompressionBombError(
+            f"图片像素数 {img.width * img.height} 超过上限 {2 * limit}，且该格式不支持分块解码")
+
+
+def _png_rawmode(img):
+    args = img.tile[0].args if img.tile else None
+    return args if isinstance(args, str) else args[0] if args else None
+
+
+def supports_banded(img):
+    """能否分块解码：条带或图块存储、非分平面的 TIFF，以及非隔行扫描的 8 位 PNG"""
+    if img.format == 'TIFF':
+        tags = img.tag_v2
+        if tags.get(284, 1) != 1 and tags.get(277, 1) > 1:
+            return False
+        return _TILE_OFFSETS in tags or _STRIP_OFFSETS in tags
+    if img.format == 'PNG':
+        return not img.info.get('interlace') and _png_rawmode(img) in _PNG_RAWMODES
+    return False
+
+
+def banded_factor(size, box, reducing_gap=None):
+    """分块解码时的整数缩小倍数：保留目标框 reducing_gap 倍以上的细节，同时保证结果不超过整幅解码的上限"""
+    gap = reducing_gap or HASH_REDUCING_GAP
+    factor = min(int(size[0] / (box[0] * gap)), int(size[1] / (box[1] * gap)))
+    return max(1, factor, math.ceil(math.sqrt(size[0] * size[1] / MAX_DECODE_PIXELS)))
+
+
+def _working_mode(img, mode):
+    if mode == 'L':
+        return 'L'
+    has_alpha = 'A' in img.mode or 'transparency' in img.info
+    return 'RGBA' if has_alpha else 'RGB'
+
+
+class _BandReducer:
+    """逐块接收整行宽度的图像并按 factor 缩小，块高度不是 factor 整数倍时余下的行并入下一块"""
+
+    def __init__(self, factor, mode):
+        self.factor = factor
+        self.mode = mode
+        self._carry = None
+        self._parts = []
+
+    def add(self, band):
+        if band.mode != self.mode:
+            band = band.convert(self.mode)
+        if self._carry is not None:
+            joined = Image.new(self.mode, (band.width, self._carry.height + band.height))
+            joined.paste(self._carry, (0, 0))
+            joined.paste(band, (0, self._carry.height))
+            band = joined
+        usable = band.height - band.height % self.factor
+        self._carry = band.crop((0, usable, band.width, band.height)) if usable < band.height else None
+        if usable:
+            self._parts.append(band.crop((0, 0, band.width, usable)).reduce(self.factor))
+
+    def finish(self):
+        if self._carry is not None:
+            self._parts.append(self._carry.reduce(self.factor))
+            self._carry = None
+        if not self._parts:
+            raise ValueError("图片中没有可解码的数据")
+        result = Image.new(self.mode, (self._parts[0].width, sum(part.height for part in self._parts)))
+        y = 0
+        for part in self._parts:
+            result.paste(part, (0, y))
+            y += part.height
+        return result
+
+
+def _read_at(fp, offset, length):
+    fp.seek(offset)
+    return fp.read(length)
+
+
+def _as_tuple(value):
+    return value if isinstance(value, tuple) else (value,)
+
+
+def _mini_tiff(tags, chunks, rows, tiled):
+    """由原文件的解码标签和若干条带（或一行图块）组成一个只有 rows 行的最小 TIFF"""
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=tags.prefix)
+    for tag in _TIFF_DECODE_TAGS:
+        if tag in tags:
+            ifd[tag] = tags[tag]
+            ifd.tagtype[tag] = tags.tagtype[tag]
+    ifd[_IMAGE_LENGTH] = rows
+    if not tiled:
+        ifd[_ROWS_PER_STRIP] = tags.get(_ROWS_PER_STRIP, rows)
+    offsets_tag, counts_tag = (_TILE_OFFSETS, _TILE_BYTE_COUNTS) if tiled else (_STRIP_OFFSETS, _STRIP_BYTE_COUNTS)
+    ifd[counts_tag] = tuple(len(chunk) for chunk in chunks)
+    ifd.tagtype[counts_tag] = ifd.tagtype[offsets_tag] = TiffTags.LONG
+    ifd[offsets_tag] = tuple(0 for _ in chunks)
+    # 数据紧跟在目录之后。PIL 写出时会把条带偏移自动加上目录长度，图块偏移则需自行计算：
+    # 目录长度与偏移量的取值无关，先占位求出长度再填入
+    start = 0 if not tiled else 8 + len(ifd.tobytes(8))
+    positions, position = [], start
+    for chunk in chunks:
+        positions.append(position)
+        position += len(chunk)
+    ifd[offsets_tag] = tuple(positions)
+    endian = '<' if tags.prefix == b'II' else '>'
+    header = tags.prefix + struct.pack(endian + 'HL', 42, 8)
+    return header + ifd.tobytes(8) + b''.join(chunks)
+
+
+def _iter_tiff_bands(img, fp):
+    """按条带或图块行依次解码 TIFF，每次只在内存中保留一块"""
+    tags = img.tag_v2
+    width, height = img.size
+    tiled = _TILE_OFFSETS in tags
+    if tiled:
+        offsets, counts = _as_tuple(tags[_TILE_OFFSETS]), _as_tuple(tags[_TILE_BYTE_COUNTS])
+        unit_rows = tags[323]
+        per_unit = math.ceil(width / tags[322])
+    else:
+        offsets, counts = _as_tuple(tags[_STRIP_OFFSETS]), _as_tuple(tags[_STRIP_BYTE_COUNTS])
+        unit_rows = min(tags.get(_ROWS_PER_STRIP, height), height)
+        per_unit = 1
+    units_per_band = max(1, BAND_PIXELS // (width * unit_rows))
+    total_units = math.ceil(height / unit_rows)
+    for first in range(0, total_units, units_per_band):
+        last = min(first + units_per_band, total_units)
+        rows = min(last * unit_rows, height) - first * unit_rows
+        chunks = [_read_at(fp, offsets[k], counts[k]) for k in range(first * per_unit, last * per_unit)]
+        with Image.open(io.BytesIO(_mini_tiff(tags, chunks, rows, tiled))) as band:
+            band.load()
+            yield band
+
+
+def _iter_png_chunks(fp):
+    fp.seek(8)
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        length, kind = struct.unpack('>I4s', header)
+        yield kind, fp.read(length)
+        fp.seek(4, io.SEEK_CUR)  # CRC
+        if kind == b'IEND':
+            return
+
+
+def _iter_png_bands(img, fp):
+    """
+    流式解压 IDAT，按行数分块交给 PIL 的 PNG 解码器还原滤波。
+    每块前面补上上一块最后一行的原始字节（滤波类型 0），块首行的 Up/Average/Paeth 滤波因此能正确还原。
+    """
+    rawmode = _png_rawmode(img)
+    width, height = img.size
+    # 每行的字节数：1 个滤波类型字节加上该行的原始数据
+    stride = 1 + len(Image.new(img.mode, (width, 1)).tobytes('raw', rawmode))
+    rows_per_band = max(1, BAND_PIXELS // width)
+    palette = img.palette if img.mode == 'P' else None  # getpalette() 会触发整幅解码
+
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    previous = None
+    done = 0
+
+    def decode(count):
+        nonlocal previous, done
+        data = bytes(pending[:count * stride])
+        del pending[:count * stride]
+        prefix = b'\x00' + previous if previous is not None else b''
+        rows = count + (previous is not None)
+        band = Image.frombytes(img.mode, (width, rows), zlib.compress(prefix + data, 0), 'zip', rawmode)
+        if previous is not None:
+            band = band.crop((0, 1, width, rows))
+        if palette is not None:
+            band.putpalette(palette)
+            band.info = dict(img.info)
+        previous = band.crop((0, count - 1, width, count)).tobytes('raw', rawmode)
+        done += count
+        return band
+
+    for kind, data in _iter_png_chunks(fp):
+        if kind != b'IDAT':
+            continue
+        pending += inflater.decompress(data)
+        while len(pending) >= rows_per_band * stride and done < height:
+            yield decode(min(rows_per_band, height - done))
+    pending += inflater.flush()
+    while done < height and len(pending) >= stride:
+        yield decode(min(rows_per_band, height - done, len(pending) // stride))
+    if done < height:
+        raise ValueError("PNG 图像数据不完整")
+
+
+def decode_banded(img, source, factor, mode=None):
+    """
+    分块解码超大 TIFF/PNG 并边读边按 factor 缩小，返回已加载的图片（mode 为 'L' 时为灰度，否则为 RGB/RGBA）。
+    内存上限约为一块的大小加上缩小后的结果，与原图尺寸无关；supports_banded 为假的图片抛出 ValueError。
+    """
+    if not supports_banded(img):
+        raise ValueError(f"{img.format} {img.mode} 图片不支持分块解码")
+    iter_bands = _iter_tiff_bands if img.format == 'TIFF' else _iter_png_bands
+    reducer = _BandReducer(factor, _working_mode(img, mode))
+    fp = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        for band in iter_bands(img, fp):
+            reducer.add(band)
+    finally:
+        if fp is not source:
+            fp.close()
+    return reducer.finish()
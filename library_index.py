@@ -0,0 +1,79 @@
+import os
+import threading
+
+import numpy as np
+
+from hamming_index import MultiIndexHashing, PackedHashes
+from hash_cache import hash_cache
+
+
+def is_within_folder(path, folder):
+    path = os.path.normcase(os.path.normpath(path))
+    folder = os.path.normcase(os.path.normpath(folder))
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+class LibraryIndex:
+    """
+    由哈希缓存直接构建的图库索引：只读取 sqlite 中已有的哈希，不扫描磁盘。
+    缓存里的记录可能已经过期（文件被移动或删除），调用方只需核实命中的少量文件。
+    """
+
+    def __init__(self, hashes, generation=0):
+        self.hashes = hashes
+        self.generation = generation
+        self._indexes = {}
+
+    @classmethod
+    def load(cls, cache_algo, algorithms):
+        generation = hash_cache.generation(cache_algo)
+        # 记录以各算法的哈希开头，之后是质量指标
+        width = 8 * len(algorithms)
+        rows = sorted((path, blob[:width]) for path, blob in hash_cache.load_all(cache_algo) if len(blob) >= width)
+        table = np.frombuffer(b''.join(blob for _, blob in rows), dtype='>u8').astype(np.uint64)
+        table = table.reshape(len(rows), len(algorithms))
+        hashes = PackedHashes([path for path, _ in rows], table[:, 0])
+        hashes.algorithm = algorithms[0]
+        hashes.variants = {name: np.ascontiguousarray(table[:, k]) for k, name in enumerate(algorithms)}
+        return cls(hashes, generation)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def paths(self):
+        return self.hashes.paths
+
+    def index(self, algorithm):
+        """某种哈希的多索引结构，首次使用时构建，之后常驻内存"""
+        if algorithm not in self._indexes:
+            self._indexes[algorithm] = MultiIndexHashing(self.hashes.with_algorithm(algorithm).codes)
+        return self._indexes[algorithm]
+
+    def query(self, codes, radius, algorithm, exclude_folder=None, should_stop=None):
+        """
+        批量查询图库中与 codes 距离不超过 radius 的图片，返回 (查询下标, 图库路径列表, 距离)。
+        exclude_folder 内的图片（例如刚导入、已写入缓存的新文件夹本身）不参与匹配；
+        命中的文件会核实是否仍存在，已删除的过期记录被丢弃。
+        """
+        query_ids, ids, dists = self.index(algorithm).search_many(codes, radius, should_stop)
+        if exclude_folder and len(ids):
+            outside = np.array([not is_within_folder(self.paths[k], exclude_folder) for k in ids], dtype=bool)
+            query_ids, ids, dists = query_ids[outside], ids[outside], dists[outside]
+        existing = {k for k in np.unique(ids).tolist() if os.path.exists(self.paths[k])}
+        keep = np.array([k in existing for k in ids.tolist()], dtype=bool)
+        return query_ids[keep], [self.paths[k] for k in ids[keep]], dists[keep]
+
+
+_cache_lock = threading.Lock()
+_loaded = {}
+
+
+def get_library_index(cache_algo, algorithms):
+    """复用内存中的图库索引，哈希缓存中该算法的记录有变化后才重新加载"""
+    with _cache_lock:
+        library = _loaded.get(cache_algo)
+        if library is None or library.generation != hash_cache.generation(cache_algo):
+            library = LibraryIndex.load(cache_algo, algorithms)
+            _loaded[cache_algo] = library
+        return library
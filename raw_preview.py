@@ -0,0 +1,223 @@
+import os
+import struct
+
+RAW_EXTENSIONS = (
+    '.arw', '.cr2', '.cr3', '.nef', '.orf', '.sr2', '.raf', '.dng', '.rw2',
+    '.pef', '.nrw', '.kdc', '.srw', '.erf', '.3fr', '.mef', '.mos', '.iiq'
+)
+
+# TIFF 字段类型对应的字节数
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4, 16: 8, 17: 8, 18: 8}
+# 同时遍历的 IFD 数量上限，防止损坏文件中的循环引用
+_MAX_IFDS = 64
+# 小于该字节数的 JPEG 视为缩略图而非预览图
+_MIN_PREVIEW_BYTES = 4 * 1024
+# CR3 中存放 PRVW 预览图的 uuid
+_CR3_PREVIEW_UUID = bytes.fromhex('eaf42b5e1c984b88b9fbb7dc406e4d16')
+# 不是普通 JPEG 预览的光度解释：CFA 马赛克原始数据、线性原始数据
+_RAW_PHOTOMETRIC = (32803, 34892)
+
+
+def is_raw_file(path):
+    return os.path.splitext(path)[1].lower() in RAW_EXTENSIONS
+
+
+def _is_baseline_jpeg(f, offset, length):
+    """检查区间开头是否为有损 JPEG（排除 DNG/CR2 中用无损 JPEG 压缩的原始数据）"""
+    f.seek(offset)
+    head = f.read(min(length, 256 * 1024))
+    if head[:2] != b'\xff\xd8':
+        return False
+    pos = 2
+    while pos + 4 <= len(head) and head[pos] == 0xFF:
+        marker = head[pos + 1]
+        if marker in (0xC0, 0xC1, 0xC2):
+            return True
+        if marker in (0xC3, 0xC7, 0xCB, 0xCF, 0xDA):
+            return False
+        pos += 2 + struct.unpack('>H', head[pos + 2:pos + 4])[0]
+    return False
+
+
+class _TiffReader:
+    """按需读取 TIFF 结构的 IFD，不把整个文件读入内存"""
+
+    def __init__(self, f, base=0):
+        self.f = f
+        self.base = base
+        f.seek(base)
+        header = f.read(8)
+        self.endian = {b'II': '<', b'MM': '>'}.get(header[:2])
+        if self.endian is None:
+            raise ValueError("不是 TIFF 结构")
+        self.first_ifd = struct.unpack(self.endian + 'I', header[4:8])[0]
+
+    def read_ifd(self, offset):
+        """返回 ({标签: (类型, 数量, 原始4字节)}, 下一个 IFD 偏移)"""
+        self.f.seek(self.base + offset)
+        raw = self.f.read(2)
+        if len(raw) < 2:
+            return {}, 0
+        count = struct.unpack(self.endian + 'H', raw)[0]
+        entries = self.f.read(count * 12 + 4)
+        if len(entries) < count * 12 + 4:
+            return {}, 0
+        tags = {}
+        for k in range(count):
+            tag, field_type, value_count = struct.unpack(self.endian + 'HHI', entries[k * 12:k * 12 + 8])
+            value = entries[k * 12 + 8:k * 12 + 12]
+            tags[tag] = (field_type, value_count, value)
+        next_ifd = struct.unpack(self.endian + 'I', entries[-4:])[0]
+        return tags, next_ifd
+
+    def values(self, entry):
+        """把字段解析为整数列表，非整数类型返回空列表"""
+        field_type, count, value = entry
+        code = {3: 'H', 4: 'I', 8: 'h', 9: 'i', 13: 'I', 16: 'Q'}.get(field_type)
+        if code is None or count > 4096:
+            return []
+        size = _TYPE_SIZES[field_type] * count
+        if size > 4:
+            self.f.seek(self.base + struct.unpack(self.endian + 'I', value)[0])
+            value = self.f.read(size)
+        return list(struct.unpack(self.endian + code * count, value[:size]))
+
+
+def _tiff_candidates(f, base=0):
+    """遍历 IFD 链、SubIFD 和 EXIF IFD，收集所有 (偏移, 长度) 形式的 JPEG 预览"""
+    reader = _TiffReader(f, base)
+    candidates = []
+    pending, seen = [reader.first_ifd], set()
+    while pending and len(seen) < _MAX_IFDS:
+        offset = pending.pop()
+        if not offset or offset in seen:
+            continue
+        seen.add(offset)
+        tags, next_ifd = reader.read_ifd(offset)
+        pending.append(next_ifd)
+        for tag in (0x014A, 0x8769):  # SubIFDs、EXIF IFD
+            if tag in tags:
+                pending.extend(reader.values(tags[tag]))
+
+        # 0x0201/0x0202：JPEGInterchangeFormat，ARW/NEF/PEF 等的预览
+        if 0x0201 in tags and 0x0202 in tags:
+            start, length = reader.values(tags[0x0201]), reader.values(tags[0x0202])
+            if start and length:
+                candidates.append((base + start[0], length[0]))
+        # 0x002E：RW2 的 JpgFromRaw，内容本身就是完整的 JPEG
+        if 0x002E in tags:
+            field_type, count, value = tags[0x002E]
+            if field_type == 7 and count > 4:
+                candidates.append((base + struct.unpack(reader.endian + 'I', value)[0], count))
+        # 单条带 JPEG 压缩的图像（CR2 的 IFD0、DNG 的预览 SubIFD），排除原始数据
+        compression = reader.values(tags[0x0103]) if 0x0103 in tags else []
+        photometric = reader.values(tags[0x0106]) if 0x0106 in tags else []
+        if compression and compression[0] in (6, 7) and 0x0111 in tags and 0x0117 in tags \
+                and not (photometric and photometric[0] in _RAW_PHOTOMETRIC):
+            offsets, counts = reader.values(tags[0x0111]), reader.values(tags[0x0117])
+            if len(offsets) == 1 and len(counts) == 1:
+                candidates.append((base + offsets[0], counts[0]))
+    return candidates
+
+
+def _iter_boxes(f, start, end):
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header[:8])
+        body = pos + 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            body = pos + 16
+        elif size == 0:
+            size = end - pos
+        if size < body - pos or pos + size > end:
+            return
+        yield box_type, body, pos + size
+        pos += size
+
+
+def _find_box(f, start, end, path):
+    for box_type, body, box_end in _iter_boxes(f, start, end):
+        if box_type == path[0]:
+            return (body, box_end) if len(path) == 1 else _find_box(f, body, box_end, path[1:])
+    return None
+
+
+def _cr3_candidates(f, file_size):
+    """CR3：第一个轨道是全尺寸 JPEG，取其第一个样本；另外 uuid 盒子中的 PRVW 为中等尺寸预览"""
+    candidates = []
+    stbl = _find_box(f, 0, file_size, (b'moov', b'trak', b'mdia', b'minf', b'stbl'))
+    if stbl:
+        sizes = _find_box(f, *stbl, (b'stsz',))
+        offsets = _find_box(f, *stbl, (b'co64',)) or _find_box(f, *stbl, (b'stco',))
+        if sizes and offsets:
+            f.seek(sizes[0] + 4)
+            sample_size, sample_count = struct.unpack('>II', f.read(8))
+            if not sample_size and sample_count:
+                sample_size = struct.unpack('>I', f.read(4))[0]
+            f.seek(offsets[0] + 8)
+            wide = _find_box(f, *stbl, (b'co64',)) is not None
+            offset = struct.unpack('>Q' if wide else '>I', f.read(8 if wide else 4))[0]
+            candidates.append((offset, sample_size))
+
+    for box_type, body, box_end in _iter_boxes(f, 0, file_size):
+        if box_type != b'uuid':
+            continue
+        f.seek(body)
+        if f.read(16) != _CR3_PREVIEW_UUID:
+            continue
+        # uuid(16) + 8 字节未知字段后是 PRVW 盒子，其头部之后 JPEG 长度紧挨在数据前面
+        prvw = _find_box(f, body + 24, box_end, (b'PRVW',))
+        if prvw:
+            f.seek(prvw[0])
+            head = f.read(32)
+            start = head.find(b'\xff\xd8')
+            if start >= 4:
+                length = struct.unpack('>I', head[start - 4:start])[0]
+                candidates.append((prvw[0] + start, length))
+    return candidates
+
+
+def _raf_candidates(f):
+    """RAF：固定头部第 84 字节起为内嵌 JPEG 的偏移和长度（大端序）"""
+    f.seek(84)
+    offset, length = struct.unpack('>II', f.read(8))
+    return [(offset, length)]
+
+
+def extract_raw_preview(path):
+    """
+    读取 RAW 文件中内嵌的最大 JPEG 预览图字节，只读取所需的结构和数据区间，
+    不做去马赛克、不依赖外部程序。找不到可用预览时返回 None。
+    """
+    try:
+        file_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            magic = f.read(16)
+            if magic[4:12] == b'ftypcrx ':
+                candidates = _cr3_candidates(f, file_size)
+            elif magic.startswith(b'FUJIFILM'):
+                candidates = _raf_candidates(f)
+            elif magic[:4] in (b'IIU\x00', b'IIRO', b'IIRS', b'MMOR'):
+                # RW2/ORF 使用了非标准的魔数，IFD 结构与 TIFF 相同
+                candidates = _tiff_candidates(f)
+            elif magic[:4] in (b'II*\x00', b'MM\x00*'):
+                candidates = _tiff_candidates(f)
+            else:
+                return None
+
+            candidates = [
+                (offset, length) for offset, length in candidates
+                if length >= _MIN_PREVIEW_BYTES and offset + length <= file_size
+            ]
+            for offset, length in sorted(candidates, key=lambda c: c[1], reverse=True):
+                if _is_baseline_jpeg(f, offset, length):
+                    f.seek(offset)
+                    return f.read(length)
+    except (OSError, ValueError, struct.error):
+        return None
+    return None
@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from hamming_index import MultiIndexHashing, bits_to_code, popcount64
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.avi', '.mkv', '.3gp', '.webm', '.wmv')
+# 在视频时长的这些相对位置各取一帧，避开片头片尾的黑场
+SAMPLE_POSITIONS = (0.1, 0.3, 0.5, 0.7, 0.9)
+# 只让 ffmpeg 输出这么高的帧，哈希只需要很小的画面
+_FRAME_HEIGHT = 64
+VIDEO_CACHE_ALGO = f"video{len(SAMPLE_POSITIONS)}dhash8v1"
+
+
+def is_video_file(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def _frame_times(duration, positions):
+    # 最后一帧的时间戳略小于时长，留出余量避免读到文件末尾之外
+    last = max(duration - 0.1, 0.0)
+    return [min(duration * position, last) for position in positions]
+
+
+def read_video_frames(path, positions=SAMPLE_POSITIONS, height=_FRAME_HEIGHT):
+    """
+    按相对位置逐帧跳转读取（ffmpeg 在输入端 seek，不解码整段视频），
+    由 ffmpeg 直接缩放到 height 像素高，返回 PIL 图像列表。
+    """
+    # 只有真正读取视频时才加载 moviepy：图片解码路径会导入本模块，不应为此承担 moviepy 的启动开销和导入失败
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+
+    clip = VideoFileClip(path, audio=False, target_resolution=(height, None))
+    try:
+        if not clip.duration:
+            raise ValueError("无法获取视频时长")
+        return [Image.fromarray(clip.get_frame(t)) for t in _frame_times(clip.duration, positions)]
+    finally:
+        clip.close()
+
+
+def read_video_frame(path, position=0.5, box=(320, 320)):
+    """读取一帧作为缩略图，按 box 保持比例缩小"""
+    img = read_video_frames(path, (position,), height=box[1])[0]
+    img.thumbnail(box)
+    return img
+
+
+def _frame_dhash(img, hash_size=8):
+    pixels = np.array(img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR),
+                      dtype=np.int16)
+    return bits_to_code(pixels[:, 1:] > pixels[:, :-1])
+
+
+def video_fingerprint(path, hash_size=8):
+    """视频指纹：SAMPLE_POSITIONS 各帧的 dHash 组成的元组，无法读取时返回 None"""
+    try:
+        return tuple(_frame_dhash(frame, hash_size) for frame in read_video_frames(path))
+    except Exception:
+        return None
+
+
+def sequence_distances(frames_a, frames_b):
+    """
+    两组帧哈希序列的对齐距离（可批量，形状为 (对数, 帧数)）。
+    用对称 DTW 在保持先后顺序的前提下让帧错位匹配，能容忍剪掉片头片尾造成的相对位置偏移；
+    对角步记两倍代价，总代价除以两个序列的长度之和，结果仍是"每帧平均汉明距离"的量纲。
+    """
+    frames_a = np.asarray(frames_a, dtype=np.uint64)
+    frames_b = np.asarray(frames_b, dtype=np.uint64)
+    costs = popcount64(frames_a[:, :, None] ^ frames_b[:, None, :]).astype(np.float64)
+    count, rows, cols = costs.shape
+    total = np.full((count, rows + 1, cols + 1), np.inf)
+    total[:, 0, 0] = 0.0
+    for r in range(1, rows + 1):
+        for c in range(1, cols + 1):
+            cost = costs[:, r - 1, c - 1]
+            total[:, r, c] = np.minimum(
+                total[:, r - 1, c - 1] + 2 * cost,
+                np.minimum(total[:, r - 1, c], total[:, r, c - 1]) + cost
+            )
+    return total[:, rows, cols] / (rows + cols)
+
+
+class VideoFingerprints:
+    """一组视频的指纹：路径列表 + (视频数, 帧数) 的 uint64 数组"""
+
+    def __init__(self, paths=(), frames=None):
+        self.paths = list(paths)
+        self.frames = np.zeros((0, len(SAMPLE_POSITIONS)), dtype=np.uint64) if frames is None \
+            else np.asarray(frames, dtype=np.uint64)
+        if len(self.paths) != len(self.frames):
+            raise ValueError("路径数量与指纹数量不一致")
+
+    @classmethod
+    def from_dict(cls, fingerprint_dict):
+        """由 {路径: 帧哈希元组} 构造，按路径排序保证结果可复现"""
+        paths = sorted(fingerprint_dict)
+        frames = np.array([fingerprint_dict[p] for p in paths], dtype=np.uint64)
+        return cls(paths, frames.reshape(len(paths), len(SAMPLE_POSITIONS)))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def pairs_within(self, radius, should_stop=None):
+        """
+        返回对齐距离不超过 radius 的视频对 (i, j, 距离)，i < j，按 (i, j) 排序。
+        对齐距离是匹配帧距离的平均值，因此至少有一对帧在 radius 以内；
+        先用多索引检索找出有相近帧的视频对，只对这些候选计算序列距离。
+        """
+        empty = (np.zeros(0, dtype=np.int64),) * 3
+        n, k = self.frames.shape
+        if n < 2:
+            return empty
+        owners = np.repeat(np.arange(n, dtype=np.int64), k)
+        frame_i, frame_j, _ = MultiIndexHashing(self.frames.ravel()).pairs_within(radius, should_stop)
+        video_i, video_j = owners[frame_i], owners[frame_j]
+        distinct = video_i != video_j
+        if should_stop and should_stop() or not distinct.any():
+            return empty
+        keys = np.unique(np.minimum(video_i, video_j)[distinct] * n + np.maximum(video_i, video_j)[distinct])
+        pair_i, pair_j = keys // n, keys % n
+        distances = np.rint(sequence_distances(self.frames[pair_i], self.frames[pair_j])).astype(np.int64)
+        keep = distances <= radius
+        return pair_i[keep], pair_j[keep], distances[keep]